@@ -0,0 +1,188 @@
+import hashlib
+import hmac
+import os
+import threading
+import time
+import logging
+from collections import OrderedDict, deque
+from dataclasses import dataclass, replace
+from typing import Dict, Any, Optional, Tuple
+
+from token_bucket import TokenBucket
+from metrics_exporter import ADMISSION_QUEUE_TIME, ADMISSION_REJECTED, ADMISSION_IN_FLIGHT, ADMISSION_QUEUED
+
+logger = logging.getLogger("Admission")
+
+
+@dataclass
+class RouteLimit:
+    """Rate limit per client plus concurrency limit for one route"""
+    rate: float  # Requests per second each client may sustain
+    burst: float  # Requests a client may make at once
+    max_concurrent: int  # Requests of this route running at once in this process
+    max_queue: int  # Requests waiting for a slot before new ones are turned away
+    max_wait: float  # Seconds a request may wait for a slot
+
+    @classmethod
+    def from_env(cls, prefix: str, default: "RouteLimit") -> "RouteLimit":
+        """Override fields from e.g. CHAT_RATE, CHAT_BURST, CHAT_MAX_CONCURRENT, CHAT_MAX_QUEUE, CHAT_MAX_WAIT"""
+        overrides = {}
+        for name, cast in (('rate', float), ('burst', float), ('max_concurrent', int),
+                           ('max_queue', int), ('max_wait', float)):
+            value = os.environ.get(f"{prefix}_{name.upper()}")
+            if value is not None:
+                overrides[name] = cast(value)
+        return replace(default, **overrides)
+
+
+class Rejected(Exception):
+    """Request turned away; maps to an HTTP status with a Retry-After hint"""
+    def __init__(self, reason: str, status_code: int, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def sign_client_id(client_id: str, secret: str) -> str:
+    """Header value "<id>.<hex HMAC-SHA256 of id>" that verify_client_id accepts"""
+    return f"{client_id}.{hmac.new(secret.encode(), client_id.encode(), hashlib.sha256).hexdigest()}"
+
+
+def verify_client_id(value: str, secret: str) -> Optional[str]:
+    """The client id of a signed header value, or None if the signature does not match"""
+    client_id, _, signature = value.rpartition('.')
+    if not client_id or not hmac.compare_digest(sign_client_id(client_id, secret), value):
+        return None
+    return client_id
+
+
+class ClientRateLimiter:
+    """
+    One token bucket per client
+
+    Buckets of clients not seen for a while are dropped oldest-first once
+    max_clients is reached; a dropped client simply starts with a full
+    bucket again.
+    """
+    def __init__(self, rate: float, burst: float, max_clients: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def check(self, client: str) -> Tuple[bool, float]:
+        """(allowed, seconds until the client may retry)"""
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                bucket = self._buckets[client] = TokenBucket(self.rate, self.burst)
+                if len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(client)
+        if bucket.try_acquire():
+            return True, 0.0
+        return False, bucket.wait_time()
+
+
+class AdmissionQueue:
+    """
+    At most max_concurrent requests run at once; up to max_queue more wait
+    in FIFO order for at most max_wait seconds
+
+    Rejecting early keeps tail latency bounded: a request that would only
+    finish after the client has given up is turned away in microseconds
+    instead of holding a worker thread.
+    """
+    def __init__(self, route: str, max_concurrent: int, max_queue: int, max_wait: float):
+        self.route = route
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._waiters: "deque[threading.Event]" = deque()
+        ADMISSION_IN_FLIGHT.set_function(lambda: self._in_flight, route=route)
+        ADMISSION_QUEUED.set_function(lambda: len(self._waiters), route=route)
+
+    def acquire(self):
+        """
+        Wait for a slot
+
+        Raises:
+            Rejected: Queue full, or no slot within max_wait (503)
+        """
+        started = time.perf_counter()
+        with self._lock:
+            if self._in_flight < self.max_concurrent and not self._waiters:
+                self._in_flight += 1
+                ADMISSION_QUEUE_TIME.observe(0.0, route=self.route)
+                return
+            if len(self._waiters) >= self.max_queue:
+                raise Rejected('queue_full', 503, self.max_wait)
+            granted = threading.Event()
+            self._waiters.append(granted)
+
+        if not granted.wait(self.max_wait):
+            with self._lock:
+                if not granted.is_set():
+                    self._waiters.remove(granted)
+                    raise Rejected('queue_timeout', 503, self.max_wait)
+        # The releasing request handed its slot over; _in_flight was not decremented
+        ADMISSION_QUEUE_TIME.observe(time.perf_counter() - started, route=self.route)
+
+    def release(self):
+        with self._lock:
+            if self._waiters:
+                self._waiters.popleft().set()
+            else:
+                self._in_flight -= 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "in_flight": self._in_flight,
+                "queued": len(self._waiters),
+                "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue
+            }
+
+
+class AdmissionController:
+    """Rate limiting and admission queues for the routes that have limits"""
+    def __init__(self, limits: Dict[str, RouteLimit]):
+        self.limits = limits
+        self._limiters = {route: ClientRateLimiter(limit.rate, limit.burst) for route, limit in limits.items()}
+        self._queues = {
+            route: AdmissionQueue(route, limit.max_concurrent, limit.max_queue, limit.max_wait)
+            for route, limit in limits.items()
+        }
+
+    def admit(self, route: str, client: str) -> Optional[AdmissionQueue]:
+        """
+        Check the client's rate and wait for a slot
+
+        Returns:
+            The queue to release() once the request is done, or None if the
+            route has no limits
+
+        Raises:
+            Rejected: 429 when the client is over its rate, 503 when the route is saturated
+        """
+        if route not in self.limits:
+            return None
+        try:
+            allowed, retry_after = self._limiters[route].check(client)
+            if not allowed:
+                raise Rejected('rate_limited', 429, retry_after)
+            queue = self._queues[route]
+            queue.acquire()
+            return queue
+        except Rejected as e:
+            ADMISSION_REJECTED.inc(route=route, reason=e.reason)
+            raise
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {route: queue.get_stats() for route, queue in self._queues.items()}
@@ -0,0 +1,280 @@
+import json
+import os
+import shutil
+import time
+import logging
+from datetime import datetime, date
+from typing import Dict, List, Any, Optional
+
+import numpy as np
+
+from forecasting import day_number, to_timestamp
+
+logger = logging.getLogger("AnalyticsSnapshot")
+
+DEFAULT_DIR = os.path.join(os.path.dirname(__file__), '..', 'data', 'analytics')
+CURRENT = 'CURRENT'
+DAILY_SALES = 'daily_sales.arrow'
+PRODUCT_METRICS = 'product_metrics.arrow'
+
+
+def materialize(products: List[Dict], sales: List[Dict], base_dir: str = DEFAULT_DIR, keep: int = 7,
+                now: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Write per-product daily sales aggregates and velocity metrics as Arrow files
+
+    Sales dated before today's start (the cutoff) go into the snapshot;
+    readers add the sales from the cutoff onwards themselves. The snapshot
+    is written to its own directory and published by atomically replacing
+    the CURRENT pointer, so readers never see a partial snapshot.
+
+    Args:
+        products: All product documents
+        sales: All sale documents
+        base_dir: Directory holding the snapshots
+        keep: Number of snapshot directories kept
+        now: Build time (defaults to now)
+    """
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+
+    now = time.time() if now is None else now
+    today = day_number(now)
+    cutoff = datetime.combine(date.fromordinal(today), datetime.min.time()).timestamp()
+
+    product_ids = [p['barcode_id'] for p in products if 'barcode_id' in p]
+    index = {product_id: i for i, product_id in enumerate(product_ids)}
+
+    # Per-product running sums; the sum of sale timestamps lets readers get
+    # the average days from entry to sale for any entry date in O(1)
+    count = len(product_ids)
+    total_sold = np.zeros(count)
+    revenue = np.zeros(count)
+    sale_count = np.zeros(count, dtype=np.int64)
+    dated_count = np.zeros(count, dtype=np.int64)
+    sale_ts_sum = np.zeros(count)
+    first_sale = np.full(count, np.nan)
+    last_sale = np.full(count, np.nan)
+
+    rows, days, units, amounts = [], [], [], []
+    for sale in sales:
+        row = index.get(sale.get('product_id'))
+        if row is None:
+            continue
+        ts = to_timestamp(sale.get('selling_date'))
+        if ts is not None and ts >= cutoff:
+            continue
+        quantity = sale.get('quantity_sold', 0) or 0
+        amount = sale.get('total_price', 0) or 0
+        total_sold[row] += quantity
+        revenue[row] += amount
+        sale_count[row] += 1
+        if ts is None:
+            continue
+        dated_count[row] += 1
+        sale_ts_sum[row] += ts
+        first_sale[row] = ts if np.isnan(first_sale[row]) else min(first_sale[row], ts)
+        last_sale[row] = ts if np.isnan(last_sale[row]) else max(last_sale[row], ts)
+        rows.append(row)
+        days.append(day_number(ts))
+        units.append(quantity)
+        amounts.append(amount)
+
+    # Collapse sales to one row per (product, day)
+    rows = np.asarray(rows, dtype=np.int64)
+    days = np.asarray(days, dtype=np.int64)
+    if len(rows):
+        keys, inverse = np.unique(rows * 10_000_000 + days, return_inverse=True)
+        daily_units = np.bincount(inverse, weights=np.asarray(units, dtype=np.float64))
+        daily_revenue = np.bincount(inverse, weights=np.asarray(amounts, dtype=np.float64))
+        daily_rows, daily_days = keys // 10_000_000, keys % 10_000_000
+    else:
+        daily_units = daily_revenue = np.zeros(0)
+        daily_rows = daily_days = np.zeros(0, dtype=np.int64)
+
+    metadata = {
+        b'built_at': str(now).encode(),
+        b'cutoff': str(cutoff).encode()
+    }
+    daily_table = pa.table({
+        'product_index': pa.array(daily_rows.astype(np.int32)),
+        'day': pa.array(daily_days.astype(np.int32)),
+        'units': pa.array(daily_units),
+        'revenue': pa.array(daily_revenue)
+    }).replace_schema_metadata(metadata)
+    metrics_table = pa.table({
+        'product_id': pa.array(product_ids, pa.string()),
+        'total_sold': pa.array(total_sold),
+        'revenue': pa.array(revenue),
+        'sale_count': pa.array(sale_count),
+        'dated_sale_count': pa.array(dated_count),
+        'sale_ts_sum': pa.array(sale_ts_sum),
+        'first_sale': pa.array(first_sale),
+        'last_sale': pa.array(last_sale)
+    }).replace_schema_metadata(metadata)
+
+    name = f"snapshot-{datetime.fromtimestamp(now).strftime('%Y%m%d-%H%M%S')}"
+    target = os.path.join(base_dir, name)
+    os.makedirs(target, exist_ok=True)
+    for filename, table in ((DAILY_SALES, daily_table), (PRODUCT_METRICS, metrics_table)):
+        # Uncompressed IPC files can be memory-mapped without a copy
+        with ipc.new_file(os.path.join(target, filename), table.schema) as writer:
+            writer.write_table(table)
+
+    pointer = os.path.join(base_dir, CURRENT)
+    with open(pointer + '.tmp', 'w') as f:
+        json.dump({"snapshot": name, "built_at": now, "cutoff": cutoff}, f)
+    os.replace(pointer + '.tmp', pointer)
+
+    snapshots = sorted(d for d in os.listdir(base_dir) if d.startswith('snapshot-'))
+    for old in snapshots[:-keep]:
+        shutil.rmtree(os.path.join(base_dir, old), ignore_errors=True)
+
+    logger.info(f"Materialized {name}: {count} products, {len(daily_units)} product-days")
+    return {"status": "success", "snapshot": name, "products": count, "product_days": int(len(daily_units))}
+
+
+class AnalyticsSnapshot:
+    """
+    Read side of a materialized snapshot
+
+    Files are memory-mapped, so opening one costs milliseconds regardless of
+    how much sales history it summarizes.
+    """
+    def __init__(self, path: str):
+        import pyarrow as pa
+        import pyarrow.ipc as ipc
+
+        self.path = path
+        self._daily = ipc.open_file(pa.memory_map(os.path.join(path, DAILY_SALES))).read_all()
+        self._metrics = ipc.open_file(pa.memory_map(os.path.join(path, PRODUCT_METRICS))).read_all()
+        metadata = self._metrics.schema.metadata or {}
+        self.built_at = float(metadata.get(b'built_at', 0))
+        self.cutoff = float(metadata.get(b'cutoff', 0))
+
+        self.product_ids: List[str] = self._metrics.column('product_id').to_pylist()
+        self._index = {product_id: i for i, product_id in enumerate(self.product_ids)}
+        self._columns = {
+            name: self._metrics.column(name).to_numpy()
+            for name in ('total_sold', 'sale_count', 'dated_sale_count', 'sale_ts_sum')
+        }
+        self._daily_rows = self._daily.column('product_index').to_numpy()
+        self._daily_days = self._daily.column('day').to_numpy()
+        self._daily_units = self._daily.column('units').to_numpy()
+
+    @property
+    def cutoff_datetime(self) -> datetime:
+        return datetime.fromtimestamp(self.cutoff)
+
+    def velocity_data(self, products: List[Dict], new_sales: List[Dict]) -> Dict[str, Any]:
+        """
+        Same shape as InventoryChatService.calculate_sales_velocity, from the
+        snapshot plus the sales since its cutoff
+        """
+        extra: Dict[str, List[float]] = {}
+        for sale in new_sales:
+            product_id = sale.get('product_id')
+            if product_id is None:
+                continue
+            totals = extra.setdefault(product_id, [0.0, 0, 0.0])
+            totals[0] += sale.get('quantity_sold', 0) or 0
+            ts = to_timestamp(sale.get('selling_date'))
+            if ts is not None:
+                totals[1] += 1
+                totals[2] += ts
+
+        velocity_data = {}
+        for product in products:
+            product_id = product.get('barcode_id')
+            if product_id is None or 'entry_date' not in product:
+                continue
+            i = self._index.get(product_id)
+            sold, dated, ts_sum = extra.get(product_id, (0.0, 0, 0.0))
+            count = 0
+            if i is not None:
+                sold += self._columns['total_sold'][i]
+                count = self._columns['sale_count'][i]
+                dated += self._columns['dated_sale_count'][i]
+                ts_sum += self._columns['sale_ts_sum'][i]
+            count += 1 if product_id in extra else 0
+            if count == 0 or sold <= 0:
+                continue
+
+            entered = to_timestamp(product['entry_date'])
+            avg_days_to_sell = None
+            if dated and entered is not None:
+                # mean(sale - entry) = mean(sale) - entry
+                avg_days_to_sell = (ts_sum / dated - entered) / 86400
+            velocity_data[product_id] = {
+                'name': product.get('name', 'Unknown Product'),
+                'total_sold': sold,
+                'avg_days_to_sell': avg_days_to_sell,
+                'current_stock': product.get('quantity', 0),
+                'price': product.get('price', 0),
+                'entry_date': product.get('entry_date')
+            }
+        return velocity_data
+
+    def demand(self, product_ids: List[str], history_days: int = 56, now: Optional[float] = None) -> np.ndarray:
+        """
+        (products, history_days) daily units from the snapshot, aligned like
+        forecasting.demand_matrix; days after the cutoff are zero
+        """
+        today = day_number(time.time() if now is None else now)
+        lookup = np.full(len(self.product_ids), -1, dtype=np.int64)
+        for row, product_id in enumerate(product_ids):
+            i = self._index.get(product_id)
+            if i is not None:
+                lookup[i] = row
+
+        rows = lookup[self._daily_rows] if len(self._daily_rows) else np.zeros(0, dtype=np.int64)
+        columns = history_days - 1 - (today - self._daily_days.astype(np.int64))
+        keep = (rows >= 0) & (columns >= 0) & (columns < history_days)
+        matrix = np.zeros((len(product_ids), history_days))
+        np.add.at(matrix, (rows[keep], columns[keep]), self._daily_units[keep])
+        return matrix
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "built_at": datetime.fromtimestamp(self.built_at).isoformat(),
+            "cutoff": self.cutoff_datetime.isoformat(),
+            "products": len(self.product_ids),
+            "product_days": self._daily.num_rows
+        }
+
+
+def load_latest(base_dir: str = DEFAULT_DIR) -> Optional[AnalyticsSnapshot]:
+    """The current snapshot, or None if there is none (or pyarrow is not installed)"""
+    try:
+        with open(os.path.join(base_dir, CURRENT)) as f:
+            name = json.load(f)["snapshot"]
+        return AnalyticsSnapshot(os.path.join(base_dir, name))
+    except FileNotFoundError:
+        return None
+    except ImportError:
+        logger.warning("pyarrow is not installed; analytics snapshots are disabled")
+        return None
+    except Exception as e:
+        logger.error(f"Error loading analytics snapshot: {str(e)}")
+        return None
+
+
+def main():
+    """Materialize a snapshot now, from the live Firestore data"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Materialize daily analytics snapshots")
+    parser.add_argument('--dir', default=DEFAULT_DIR, help="Snapshot directory")
+    parser.add_argument('--keep', type=int, default=7, help="Snapshots to keep")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    from backend.firebase_config import db
+    products = [{**doc.to_dict(), 'id': doc.id} for doc in db.collection('products').stream()]
+    sales = [{**doc.to_dict(), 'id': doc.id} for doc in db.collection('sales').stream()]
+    print(json.dumps(materialize(products, sales, args.dir, keep=args.keep), indent=2))
+
+
+if __name__ == "__main__":
+    main()
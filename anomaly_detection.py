@@ -0,0 +1,142 @@
+import math
+import threading
+import time
+import logging
+from dataclasses import dataclass
+from typing import Dict, List, Any, Optional
+
+logger = logging.getLogger("AnomalyDetection")
+
+
+@dataclass
+class DetectorConfig:
+    """Tuning for one metric's detector"""
+    fast_alpha: float = 0.2     # Recent level, roughly the last 10 requests
+    slow_alpha: float = 0.01    # Baseline, roughly the last 200 requests
+    z_enter: float = 3.0        # Start alerting at this many baseline deviations
+    z_exit: float = 1.5         # Stop alerting once back under this
+    warmup: int = 30            # Samples before z-scores are trusted
+    floor: float = 0.0          # Never alert while the recent level is below this
+    ceiling: Optional[float] = None  # Always alert while the recent level is above this
+    min_std: float = 1e-6       # Lower bound on baseline deviation, avoids dividing by ~0
+
+
+class MetricDetector:
+    """
+    Rolling-baseline detector for one metric
+
+    A fast EWMA tracks the recent level and a slow EWMA (with EW variance)
+    tracks the baseline. The detector fires when the recent level is z_enter
+    baseline deviations above the baseline, or above the hard ceiling, and
+    only clears once it falls back under z_exit (hysteresis). The baseline is
+    frozen while firing so a sustained incident does not become the new normal.
+    Each update is O(1).
+    """
+    def __init__(self, name: str, config: DetectorConfig):
+        self.name = name
+        self.config = config
+        self.count = 0
+        self.fast: Optional[float] = None
+        self.mean: Optional[float] = None
+        self.var = 0.0
+        self.firing = False
+        self.fired_at: Optional[float] = None
+        self.z = 0.0
+
+    @property
+    def std(self) -> float:
+        return max(math.sqrt(self.var), self.config.min_std)
+
+    def update(self, value: float) -> Optional[str]:
+        """
+        Add a sample
+
+        Returns:
+            "fire" when the detector starts firing, "resolve" when it clears, else None
+        """
+        config = self.config
+        self.count += 1
+        if self.mean is None:
+            self.fast = self.mean = value
+            return None
+
+        self.fast += config.fast_alpha * (value - self.fast)
+        self.z = (self.fast - self.mean) / self.std
+
+        over_ceiling = config.ceiling is not None and self.fast >= config.ceiling
+        event = None
+        if not self.firing:
+            trusted = self.count >= config.warmup
+            if over_ceiling or (trusted and self.z >= config.z_enter and self.fast >= config.floor):
+                self.firing = True
+                event = "fire"
+        elif not over_ceiling and (self.z <= config.z_exit or self.fast < config.floor):
+            self.firing = False
+            event = "resolve"
+
+        if not self.firing:
+            # Incremental EW mean/variance update of the baseline
+            diff = value - self.mean
+            increment = config.slow_alpha * diff
+            self.mean += increment
+            self.var = (1 - config.slow_alpha) * (self.var + diff * increment)
+        return event
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "firing": self.firing,
+            "recent": self.fast,
+            "baseline": self.mean,
+            "baseline_std": math.sqrt(self.var),
+            "z_score": self.z,
+            "samples": self.count
+        }
+
+
+class AnomalyDetector:
+    """
+    Per-metric rolling-baseline detectors with per-window alert deduplication
+
+    At most one alert per metric is emitted per `dedup_window` seconds, even if
+    the metric flaps between firing and resolved inside that window.
+    """
+    def __init__(self, configs: Dict[str, DetectorConfig], dedup_window: float = 900.0):
+        self.detectors = {name: MetricDetector(name, config) for name, config in configs.items()}
+        self.dedup_window = dedup_window
+        self._last_alert: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.suppressed = 0
+
+    def observe(self, values: Dict[str, float], now: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        Feed one request's metric values
+
+        Returns:
+            Alerts to send, one dict per metric that just started firing
+        """
+        now = time.time() if now is None else now
+        alerts = []
+        with self._lock:
+            for name, value in values.items():
+                detector = self.detectors.get(name)
+                if detector is None:
+                    continue
+                event = detector.update(value)
+                if event == "resolve":
+                    logger.info(f"Anomaly resolved for {name}: recent {detector.fast:.4g}, baseline {detector.mean:.4g}")
+                if event != "fire":
+                    continue
+                last = self._last_alert.get(name)
+                if last is not None and now - last < self.dedup_window:
+                    self.suppressed += 1
+                    continue
+                self._last_alert[name] = now
+                alerts.append({"metric": name, **detector.status()})
+        return alerts
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "metrics": {name: detector.status() for name, detector in self.detectors.items()},
+                "suppressed_alerts": self.suppressed
+            }
@@ -0,0 +1,36 @@
+from typing import Dict, Optional
+
+from metrics_exporter import BARCODE_DECODE
+
+
+def decode_barcode(image_bytes: bytes) -> Optional[Dict[str, str]]:
+    """
+    Decode the first barcode in an encoded image (JPEG, PNG, ...)
+
+    OpenCV and pyzbar are imported on first call, so only processes that
+    actually scan (the scan worker, or an all-in-one API) load them.
+
+    Returns:
+        {"barcode": data, "type": symbology}, or None if no barcode was found
+    """
+    import cv2
+    import numpy as np
+    from pyzbar.pyzbar import decode
+
+    with BARCODE_DECODE.time():
+        # Convert to numpy array for OpenCV
+        nparr = np.frombuffer(image_bytes, np.uint8)
+        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+
+        # Try to decode barcodes
+        barcodes = decode(img)
+
+    if not barcodes:
+        return None
+
+    # Get the first barcode
+    barcode = barcodes[0]
+    return {
+        "barcode": barcode.data.decode('utf-8'),
+        "type": barcode.type
+    }
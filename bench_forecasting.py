@@ -0,0 +1,44 @@
+import argparse
+import time
+
+import numpy as np
+
+from forecasting import forecast
+
+
+def synthetic_demand(num_products: int, num_days: int, intermittent_share: float = 0.3, seed: int = 0):
+    """Poisson daily demand with a weekend bump, plus a share of sparse (intermittent) products"""
+    rng = np.random.default_rng(seed)
+    rates = rng.gamma(1.5, 3.0, num_products)
+    weekend = np.where(np.arange(num_days) % 7 >= 5, 1.4, 1.0)
+    demand = rng.poisson(rates[:, None] * weekend[None, :]).astype(np.float64)
+    sparse = rng.random(num_products) < intermittent_share
+    demand[sparse] *= rng.random((sparse.sum(), num_days)) < 0.15
+    stock = rng.integers(0, 120, num_products)
+    return demand, stock
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the vectorized demand forecaster")
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--days', type=int, default=56)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    demand, stock = synthetic_demand(args.products, args.days)
+    forecast(demand[:10], stock[:10], last_weekday=6)  # Warm up NumPy
+
+    timings = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        result = forecast(demand, stock, last_weekday=6)
+        timings.append(time.perf_counter() - started)
+
+    print(f"{args.products} products x {args.days} days")
+    print(f"  best {min(timings) * 1000:.1f} ms, median {sorted(timings)[len(timings) // 2] * 1000:.1f} ms")
+    print(f"  intermittent (Croston): {int(result.intermittent.sum())}")
+    print(f"  reorder now: {int((result.order_quantity > 0).sum())}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+# Runs in a fresh interpreter: import the app, build it and serve one request
+FIRST_REQUEST = """
+import json, sys, time
+started = time.perf_counter()
+import chat_api
+imported = time.perf_counter()
+app = chat_api.create_app({features})
+if {warm}:
+    app.extensions['services'].warm()
+created = time.perf_counter()
+response = app.test_client().open({path!r}, method={method!r})
+done = time.perf_counter()
+print(json.dumps({{
+    "import_ms": (imported - started) * 1000,
+    "create_app_ms": (created - imported) * 1000,
+    "first_request_ms": (done - created) * 1000,
+    "status": response.status_code,
+    "modules": len(sys.modules)
+}}))
+"""
+
+
+def import_breakdown(top: int, env):
+    """Slowest modules by cumulative import time, from python -X importtime"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import chat_api'],
+                            capture_output=True, text=True, env=env)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, self_us, cumulative_us, name = [part.strip() for part in line.replace('import time:', '|', 1).split('|')]
+        rows.append((int(cumulative_us), int(self_us), name))
+    return sorted(rows, reverse=True)[:top]
+
+
+def first_request(features, path: str, method: str, warm: bool, env):
+    """Wall time from spawning a worker to its first response, plus the child's own split"""
+    code = FIRST_REQUEST.format(features=repr(features), warm=warm, path=path, method=method)
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, env=env)
+    wall = (time.perf_counter() - started) * 1000
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "worker failed")
+    return wall, json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark chat_api worker startup")
+    parser.add_argument('--features', default=None, help="Comma-separated features (default: APP_FEATURES or all)")
+    parser.add_argument('--path', default='/metrics', help="Path of the first request")
+    parser.add_argument('--method', default='GET')
+    parser.add_argument('--warm', action='store_true', help="Create the chat services before the first request")
+    parser.add_argument('--top', type=int, default=15, help="Modules shown in the import breakdown")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [os.path.dirname(os.path.abspath(__file__)),
+                                                      env.get('PYTHONPATH')]))
+    features = args.features.split(',') if args.features else None
+
+    print("Slowest imports (cumulative ms, self ms):")
+    for cumulative_us, self_us, name in import_breakdown(args.top, env):
+        print(f"  {cumulative_us / 1000:8.1f} {self_us / 1000:8.1f}  {name}")
+
+    runs = [first_request(features, args.path, args.method, args.warm, env) for _ in range(args.repeat)]
+    walls = sorted(wall for wall, _ in runs)
+    _, last = runs[-1]
+    print(f"\nTime to first request ({args.method} {args.path} -> {last['status']}), {args.repeat} runs:")
+    print(f"  spawn to response: best {walls[0]:.0f} ms, median {walls[len(walls) // 2]:.0f} ms")
+    print(f"  import {last['import_ms']:.0f} ms, create_app {last['create_app_ms']:.0f} ms, "
+          f"first request {last['first_request_ms']:.0f} ms, {last['modules']} modules loaded")
+
+
+if __name__ == "__main__":
+    main()
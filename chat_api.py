@@ -1,64 +1,483 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Blueprint, current_app, request, jsonify, send_file, g, Response
 from flask_cors import CORS
 import os
 import sys
+import threading
 from dotenv import load_dotenv
 import asyncio
-from voice_service import VoiceProcessingService
-import io
-import base64
-import cv2
-import numpy as np
-from pyzbar.pyzbar import decode
 
 # Add parent directory to path for imports if needed
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-# Fix imports to use modules in the current directory
-from chat_service import InventoryChatService, ChatService
+from datetime import datetime
+from metrics_exporter import REGISTRY, CONTENT_TYPE, HTTP_REQUEST_DURATION
+from job_queue import JobQueue, JobTimeout
+from admission import AdmissionController, RouteLimit, Rejected, verify_client_id
+from workers import VOICE_JOB, SCAN_JOB
+import time
+import uuid
 
 # Load environment variables
 load_dotenv()
 
-app = Flask(__name__)
-CORS(app)
+ALL_FEATURES = ('chat', 'voice', 'barcode')
 
-# Initialize chat service
-chat_service = InventoryChatService()
+# Deployable profiles: the features a process serves itself, and the ones it
+# hands to voice/scan worker processes (workers.py) through the job queue
+PROFILES = {
+    'all': {'features': ALL_FEATURES, 'queued': ()},
+    'chat': {'features': ('chat',), 'queued': ('voice', 'barcode')},
+}
 
-# Initialize voice service after initializing chat service
-voice_service = VoiceProcessingService(chat_service)
+# Largest /api/chat/batch request, and LLM calls it may have in flight at once
+MAX_BATCH_QUERIES = int(os.environ.get('MAX_BATCH_QUERIES', 100))
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', 4))
 
-@app.route('/api/chat', methods=['POST'])
+# Seconds a request waits for a worker before giving up
+VOICE_JOB_TIMEOUT = float(os.environ.get('VOICE_JOB_TIMEOUT', 60))
+SCAN_JOB_TIMEOUT = float(os.environ.get('SCAN_JOB_TIMEOUT', 10))
+
+# Keep sales velocity current from Firestore listeners (VELOCITY_INDEX=1),
+# re-checked against a full read this often. Off by default: every worker
+# process would hold its own listeners and copy of the sales collection
+VELOCITY_INDEX = os.environ.get('VELOCITY_INDEX') == '1'
+VELOCITY_VERIFY_SECONDS = float(os.environ.get('VELOCITY_VERIFY_SECONDS', 3600))
+
+# Cache chat answers by meaning (SEMANTIC_CACHE=1). The embedding model pulls
+# in torch, several hundred MB per process, so it is opt-in and loaded when
+# the chat service is created, on a background thread (or by warm())
+SEMANTIC_CACHE = os.environ.get('SEMANTIC_CACHE') == '1'
+
+# Routes that can hold a worker thread for seconds (LLM calls, Whisper) get a
+# per-client rate limit and a bounded admission queue; each can be tuned
+# through the environment, e.g. CHAT_MAX_CONCURRENT=16
+ROUTE_LIMITS = {
+    '/api/chat': RouteLimit.from_env('CHAT', RouteLimit(rate=0.5, burst=10, max_concurrent=8, max_queue=16, max_wait=5.0)),
+    '/api/chat/batch': RouteLimit.from_env('BATCH', RouteLimit(rate=0.05, burst=2, max_concurrent=2, max_queue=2, max_wait=5.0)),
+    '/api/voice': RouteLimit.from_env('VOICE', RouteLimit(rate=0.2, burst=3, max_concurrent=2, max_queue=4, max_wait=10.0)),
+}
+
+class AppServices:
+    """
+    Services shared by the routes of one app, each created on first use
+
+    Nothing here is built at import or app creation: Firebase, the LLM
+    client and the alert pipeline come up with the first request that needs
+    them, and the voice (torch/transformers) and barcode (OpenCV/pyzbar)
+    modules are only imported by their own routes.
+    """
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._services = {}
+
+    def _get(self, name, factory):
+        service = self._services.get(name)
+        if service is None:
+            with self._lock:
+                service = self._services.get(name)
+                if service is None:
+                    service = self._services[name] = factory()
+        return service
+
+    @property
+    def llm_client(self):
+        # One pooled LLM client (Gemini primary, Groq hedge/failover) shared by
+        # the chat service and the monitor
+        from llm_client import build_default_client
+        return self._get('llm_client', build_default_client)
+
+    @property
+    def llm_monitor(self):
+        # Monitor real chat traffic; alerts are coalesced and rate limited
+        # before being pushed to staff
+        def create():
+            from llm_moniter import LLMMonitor
+            from notification_delivery import DeliveryPipeline, FCMTransport
+            alert_pipeline = DeliveryPipeline(FCMTransport())
+            alert_pipeline.start()
+            return LLMMonitor(delivery_pipeline=alert_pipeline, llm_client=self.llm_client)
+        return self._get('llm_monitor', create)
+
+    @property
+    def chat_service(self):
+        def create():
+            from chat_service import InventoryChatService
+            service = InventoryChatService(monitor=self.llm_monitor, llm_client=self.llm_client)
+            if VELOCITY_INDEX:
+                service.start_velocity_index(VELOCITY_VERIFY_SECONDS)
+            if SEMANTIC_CACHE:
+                service.semantic_cache.load_embedder(wait=False)
+            return service
+        return self._get('chat_service', create)
+
+    @property
+    def chat_history(self):
+        # Paginated reads of chat_history, continuing into the daily archives
+        def create():
+            from chat_history import ChatHistoryStore
+            return ChatHistoryStore(self.chat_service.db)
+        return self._get('chat_history', create)
+
+    @property
+    def job_queue(self):
+        # Shared with the worker processes through JOB_QUEUE_DB
+        return self._get('job_queue', JobQueue)
+
+    @property
+    def voice_service(self):
+        def create():
+            from voice_service import VoiceProcessingService
+            return VoiceProcessingService(self.chat_service)
+        return self._get('voice_service', create)
+
+    def warm(self):
+        """Create the chat services (and load the semantic cache model) now instead of on the first request"""
+        self.chat_service.db
+        self.chat_history
+        if SEMANTIC_CACHE:
+            self.chat_service.semantic_cache.load_embedder()
+
+# Rate limits are per client address. Behind reverse proxies, TRUSTED_PROXIES
+# is the number of them in front of the app, whose X-Forwarded-For entries are
+# believed. X-Client-Id is only honoured when signed with CLIENT_ID_SECRET (see
+# admission.sign_client_id), or when TRUST_CLIENT_ID=1 and a trusted proxy
+# sets the header itself
+TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', 0))
+CLIENT_ID_SECRET = os.environ.get('CLIENT_ID_SECRET')
+TRUST_CLIENT_ID = os.environ.get('TRUST_CLIENT_ID') == '1'
+
+def create_app(features=None, app_services=None, queued=None, profile=None, limits=None):
+    """
+    Build the Flask app
+
+    Args:
+        features: Route groups served in this process, from ALL_FEATURES;
+            defaults to the profile's, else the comma-separated APP_FEATURES
+            environment variable, else all
+        app_services: AppServices to use; a new lazy one by default
+        queued: Route groups whose work is handed to worker processes
+        profile: Name in PROFILES (defaults to APP_PROFILE)
+        limits: Per-route RouteLimit (defaults to ROUTE_LIMITS)
+    """
+    profile = profile or os.environ.get('APP_PROFILE')
+    if profile:
+        if profile not in PROFILES:
+            raise ValueError(f"Unknown profile: {profile}")
+        features = PROFILES[profile]['features'] if features is None else features
+        queued = PROFILES[profile]['queued'] if queued is None else queued
+    if features is None:
+        features = [f.strip() for f in os.environ.get('APP_FEATURES', ','.join(ALL_FEATURES)).split(',') if f.strip()]
+    queued = set(queued or ()) - set(features)
+    unknown = (set(features) | queued) - set(ALL_FEATURES)
+    if unknown:
+        raise ValueError(f"Unknown features: {sorted(unknown)}")
+
+    app = Flask(__name__)
+    CORS(app)
+    if TRUSTED_PROXIES:
+        from werkzeug.middleware.proxy_fix import ProxyFix
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES, x_proto=TRUSTED_PROXIES)
+    app.config['QUEUED_FEATURES'] = queued
+    app.extensions['services'] = app_services or AppServices()
+    app.extensions['admission'] = AdmissionController(ROUTE_LIMITS if limits is None else limits)
+    app.register_blueprint(core)
+    for feature in ALL_FEATURES:
+        if feature in features or feature in queued:
+            app.register_blueprint(FEATURE_BLUEPRINTS[feature])
+    return app
+
+def services() -> AppServices:
+    return current_app.extensions['services']
+
+def queued(feature: str) -> bool:
+    return feature in current_app.config['QUEUED_FEATURES']
+
+# Request timing and the scrape endpoint are served whatever the features
+core = Blueprint('core', __name__)
+chat_routes = Blueprint('chat', __name__)
+voice_routes = Blueprint('voice', __name__)
+barcode_routes = Blueprint('barcode', __name__)
+FEATURE_BLUEPRINTS = {'chat': chat_routes, 'voice': voice_routes, 'barcode': barcode_routes}
+
+@core.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@core.before_app_request
+def admit_request():
+    """
+    Turn requests away fast instead of letting a burst pile up behind the
+    slow routes: 429 when a client is over its rate, 503 when the route's
+    admission queue is full or the wait for a slot runs out
+    """
+    if request.url_rule is None:
+        return None
+    client = client_key()
+    try:
+        g.admission_slot = current_app.extensions['admission'].admit(request.url_rule.rule, client)
+    except Rejected as e:
+        response = jsonify({"error": f"Request rejected: {e.reason}", "status": "error"})
+        response.status_code = e.status_code
+        response.headers['Retry-After'] = str(max(1, int(e.retry_after + 0.999)))
+        return response
+    return None
+
+def client_key() -> str:
+    """
+    Rate-limit key of the request: a verified X-Client-Id, else the client
+    address (the real one when ProxyFix trusts the proxies in front)
+    """
+    header = request.headers.get('X-Client-Id')
+    if header:
+        if CLIENT_ID_SECRET:
+            client_id = verify_client_id(header, CLIENT_ID_SECRET)
+            if client_id:
+                return f"id:{client_id}"
+        elif TRUST_CLIENT_ID and TRUSTED_PROXIES:
+            return f"id:{header}"
+    return request.remote_addr or 'unknown'
+
+@core.teardown_app_request
+def release_admission(exc):
+    slot = g.pop('admission_slot', None)
+    if slot is not None:
+        slot.release()
+
+@core.after_app_request
+def record_request_duration(response):
+    started = getattr(g, 'request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        HTTP_REQUEST_DURATION.observe(
+            time.perf_counter() - started,
+            route=route,
+            method=request.method,
+            status=response.status_code
+        )
+    return response
+
+@core.route('/metrics', methods=['GET'])
+def openmetrics():
+    """
+    OpenMetrics endpoint for Prometheus scraping
+    """
+    return Response(REGISTRY.render(), mimetype=None, content_type=CONTENT_TYPE)
+
+@chat_routes.route('/api/chat', methods=['POST'])
 def chat():
     """
     API endpoint to process chat queries
     """
     data = request.json
     user_query = data.get('query', '')
+    # Clients send back the session_id from the previous reply to continue a
+    # conversation; only those ids can have history worth loading
+    new_session = not data.get('session_id')
+    session_id = uuid.uuid4().hex if new_session else data['session_id']
     
     if not user_query:
         return jsonify({"error": "No query provided"}), 400
     
     try:
         # Process the query using the chat service
-        response = asyncio.run(chat_service.process_query(user_query))
+        response = asyncio.run(services().chat_service.process_query(user_query, session_id=session_id,
+                                                                     new_session=new_session))
+        return jsonify(response)
+    except Exception as e:
+        return jsonify({"error": str(e), "status": "error"}), 500
+
+@chat_routes.route('/api/chat/batch', methods=['POST'])
+def chat_batch():
+    """
+    API endpoint to answer many standalone queries against one load of the data
+    
+    Body: {"queries": [...], "local_answers": true}; results come back in
+    the same order
+    """
+    data = request.json or {}
+    queries = data.get('queries')
+    if not isinstance(queries, list) or not queries or not all(isinstance(q, str) and q for q in queries):
+        return jsonify({"error": "queries must be a non-empty list of strings"}), 400
+    if len(queries) > MAX_BATCH_QUERIES:
+        return jsonify({"error": f"At most {MAX_BATCH_QUERIES} queries per batch"}), 400
+    
+    try:
+        response = asyncio.run(services().chat_service.process_batch(
+            queries,
+            max_concurrency=BATCH_CONCURRENCY,
+            local_answers=bool(data.get('local_answers', True))
+        ))
+        if response.get("status") != "success":
+            return jsonify(response), 500
         return jsonify(response)
     except Exception as e:
         return jsonify({"error": str(e), "status": "error"}), 500
 
-@app.route('/api/inventory/summary', methods=['GET'])
+@chat_routes.route('/api/chat/history', methods=['GET'])
+def chat_history_page():
+    """
+    API endpoint to page through chat history, newest first
+    
+    Query parameters: limit (max 100), cursor (next_cursor of the previous
+    page), since/until (ISO 8601), session_id
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+        since = request.args.get('since')
+        until = request.args.get('until')
+        page = services().chat_history.query(
+            limit=limit,
+            cursor=request.args.get('cursor'),
+            since=datetime.fromisoformat(since) if since else None,
+            until=datetime.fromisoformat(until) if until else None,
+            session_id=request.args.get('session_id')
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e), "status": "error"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e), "status": "error"}), 500
+    return jsonify({"response": page, "status": "success"})
+
+@chat_routes.route('/api/inventory/summary', methods=['GET'])
 def inventory_summary():
     """
     API endpoint to get inventory summary
     """
     try:
-        summary = asyncio.run(chat_service.get_inventory_summary())
+        summary = asyncio.run(services().chat_service.get_inventory_summary())
         return jsonify(summary)
     except Exception as e:
         return jsonify({"error": str(e), "status": "error"}), 500
 
-@app.route('/api/voice', methods=['POST'])
+@chat_routes.route('/api/lots', methods=['POST'])
+def receive_lot():
+    """
+    API endpoint to receive a batch of a product
+    
+    JSON body: product_id, quantity, and optionally expiry_date and
+    received_date (ISO 8601) and lot_code
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        if 'product_id' not in data or 'quantity' not in data:
+            raise ValueError("product_id and quantity are required")
+        lot = services().chat_service.lots.receive(
+            str(data['product_id']),
+            int(data['quantity']),
+            expiry_date=datetime.fromisoformat(data['expiry_date']) if data.get('expiry_date') else None,
+            received_date=datetime.fromisoformat(data['received_date']) if data.get('received_date') else None,
+            lot_code=data.get('lot_code')
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e), "status": "error"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e), "status": "error"}), 500
+    return jsonify({"response": lot, "status": "success"})
+
+@chat_routes.route('/api/lots/<lot_id>/write_off', methods=['POST'])
+def write_off_lot(lot_id):
+    """
+    API endpoint to dispose of what is left of a batch, e.g. once it has
+    expired; its units are taken off the product's stock
+    """
+    try:
+        lot = services().chat_service.lots.write_off(lot_id)
+    except ValueError as e:
+        return jsonify({"error": str(e), "status": "error"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e), "status": "error"}), 500
+    return jsonify({"response": lot, "status": "success"})
+
+@chat_routes.route('/api/sales', methods=['POST'])
+def record_sale():
+    """
+    API endpoint to record a sale, drawing its units from the product's
+    oldest lots first
+    
+    JSON body: product_id, quantity, and optionally selling_date (ISO 8601)
+    and total_price (defaults to quantity times the product's price)
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        if 'product_id' not in data or 'quantity' not in data:
+            raise ValueError("product_id and quantity are required")
+        sale = services().chat_service.lots.record_sale(
+            str(data['product_id']),
+            int(data['quantity']),
+            selling_date=datetime.fromisoformat(data['selling_date']) if data.get('selling_date') else None,
+            total_price=float(data['total_price']) if data.get('total_price') is not None else None
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e), "status": "error"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e), "status": "error"}), 500
+    return jsonify({"response": sale, "status": "success"})
+
+@chat_routes.route('/api/rankings', methods=['GET'])
+def rankings():
+    """
+    API endpoint to get the top (or bottom) products by sales
+    
+    Query parameters: metric (units or days_to_sell), window (trailing days,
+    default 7, or "all"), k (max 100), order (desc, or asc for the lowest)
+    """
+    chat_service = services().chat_service
+    try:
+        metric = request.args.get('metric', 'units')
+        window = request.args.get('window', '7')
+        window_days = None if window == 'all' else int(window)
+        k = min(max(int(request.args.get('k', 10)), 1), 100)
+        order = request.args.get('order', 'desc')
+        if metric not in ('units', 'days_to_sell'):
+            raise ValueError("metric must be 'units' or 'days_to_sell'")
+        if window_days is not None and window_days not in chat_service.velocity_index.rank_windows:
+            raise ValueError(f"window must be 'all' or one of {list(chat_service.velocity_index.rank_windows)}")
+        if order not in ('asc', 'desc'):
+            raise ValueError("order must be 'asc' or 'desc'")
+    except ValueError as e:
+        return jsonify({"error": str(e), "status": "error"}), 400
+    result = asyncio.run(chat_service.get_rankings(k=k, metric=metric, window_days=window_days,
+                                                   ascending=order == 'asc'))
+    if result["status"] != "success":
+        return jsonify(result), 500
+    return jsonify(result)
+
+@chat_routes.route('/api/metrics', methods=['GET'])
+def metrics():
+    """
+    API endpoint to get per-stage latency, token usage and cost of chat requests
+    """
+    try:
+        chat_service = services().chat_service
+        return jsonify({
+            "response": {
+                **chat_service.tracer.get_metrics(),
+                "llm_providers": services().llm_client.get_stats(),
+                "semantic_cache": chat_service.semantic_cache.get_stats(),
+                "analytics_snapshot": chat_service.analytics.get_stats() if chat_service.analytics else None,
+                "velocity_index": chat_service.velocity_index.get_stats(),
+                "expiry_index": chat_service.expiry_index.get_stats(),
+                "admission": current_app.extensions['admission'].get_stats()
+            },
+            "status": "success"
+        })
+    except Exception as e:
+        return jsonify({"error": str(e), "status": "error"}), 500
+
+@chat_routes.route('/api/analytics/snapshot', methods=['POST'])
+def analytics_snapshot():
+    """
+    API endpoint to rebuild the daily sales analytics snapshot now
+    """
+    try:
+        result = services().chat_service.refresh_analytics()
+        if result.get("status") != "success":
+            return jsonify(result), 500
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({"error": str(e), "status": "error"}), 500
+
+@voice_routes.route('/api/voice', methods=['POST'])
 def voice_query():
     """
     API endpoint to process voice queries
@@ -72,13 +491,20 @@ def voice_query():
         # Read audio data
         audio_data = audio_file.read()
         
-        # Process the voice query
-        response = asyncio.run(voice_service.process_voice_query(audio_data))
+        # Process the voice query, transcribing on a voice worker if this
+        # process does not load Whisper itself
+        if queued('voice'):
+            job = services().job_queue.run(VOICE_JOB, audio_data, timeout=VOICE_JOB_TIMEOUT)
+            response = asyncio.run(services().voice_service.answer(job['text_query']))
+        else:
+            response = asyncio.run(services().voice_service.process_voice_query(audio_data))
         return jsonify(response)
+    except JobTimeout as e:
+        return jsonify({"error": f"Voice workers busy: {str(e)}", "status": "error"}), 503
     except Exception as e:
         return jsonify({"error": str(e), "status": "error"}), 500
 
-@app.route('/api/barcode/scan', methods=['POST'])
+@barcode_routes.route('/api/barcode/scan', methods=['POST'])
 def scan_barcode():
     """
     API endpoint to scan barcodes from images
@@ -92,27 +518,25 @@ def scan_barcode():
         # Read image data
         image_bytes = image_file.read()
         
-        # Convert to numpy array for OpenCV
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        # Try to decode barcodes
-        barcodes = decode(img)
+        if queued('barcode'):
+            result = services().job_queue.run(SCAN_JOB, image_bytes, timeout=SCAN_JOB_TIMEOUT)
+        else:
+            # OpenCV and pyzbar are only loaded by processes that scan barcodes
+            from barcode_service import decode_barcode
+            result = decode_barcode(image_bytes)
         
-        if not barcodes:
+        if not result:
             return jsonify({"error": "No barcode detected"}), 404
         
-        # Get the first barcode
-        barcode = barcodes[0]
-        barcode_data = barcode.data.decode('utf-8')
-        barcode_type = barcode.type
-        
-        return jsonify({
-            "barcode": barcode_data,
-            "type": barcode_type
-        })
+        return jsonify(result)
+    except JobTimeout as e:
+        return jsonify({"error": f"Scan workers busy: {str(e)}", "status": "error"}), 503
     except Exception as e:
         return jsonify({"error": str(e), "status": "error"}), 500
 
+# WSGI entry point (e.g. gunicorn chat_api:app); creating it is cheap since
+# every service is built on first use
+app = create_app()
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
\ No newline at end of file
@@ -0,0 +1,262 @@
+import base64
+import glob
+import gzip
+import json
+import os
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Any, Optional, Tuple
+
+from metrics_exporter import FIRESTORE_READS
+
+logger = logging.getLogger("ChatHistory")
+
+COLLECTION = 'chat_history'
+ARCHIVE_PREFIX = 'chat_history-'
+
+
+def encode_cursor(source: str, timestamp: datetime, doc_id: str) -> str:
+    """Opaque page cursor: where the last returned turn was read from and its sort key"""
+    raw = json.dumps({"src": source, "ts": timestamp.isoformat(), "id": doc_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, datetime, str]:
+    padded = cursor + "=" * (-len(cursor) % 4)
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return raw["src"], _as_utc(datetime.fromisoformat(raw["ts"])), raw["id"]
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def _as_utc(value: datetime) -> datetime:
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+class ChatHistoryStore:
+    """
+    Paginated reads of chat_history plus compaction into daily archives
+
+    Recent turns are read from Firestore, newest first, with keyset
+    pagination on (timestamp, document id) so each page costs one indexed
+    query no matter how deep the client pages. Turns older than the
+    compaction horizon are moved into one gzip-compressed JSONL file per UTC
+    day; reads continue into those archives once the live turns run out.
+    """
+    def __init__(self, db, archive_dir: Optional[str] = None):
+        """
+        Args:
+            db: Firestore client
+            archive_dir: Directory for the daily archives (defaults to data/chat_archive)
+        """
+        self.db = db
+        self.archive_dir = archive_dir or os.path.join(os.path.dirname(__file__), '..', 'data', 'chat_archive')
+
+    def query(self, limit: int = 20, cursor: Optional[str] = None, since: Optional[datetime] = None,
+              until: Optional[datetime] = None, session_id: Optional[str] = None,
+              include_archived: bool = True) -> Dict[str, Any]:
+        """
+        One page of turns, newest first
+
+        Args:
+            limit: Page size
+            cursor: next_cursor from the previous page
+            since: Only turns at or after this time
+            until: Only turns before this time
+            session_id: Only turns of this conversation
+            include_archived: Continue into the daily archives after the live turns
+
+        Returns:
+            {"items": [...], "next_cursor": str or None}
+        """
+        since = _as_utc(since) if since else None
+        until = _as_utc(until) if until else None
+        source, after = "live", None
+        if cursor:
+            source, after_ts, after_id = decode_cursor(cursor)
+            after = (after_ts, after_id)
+
+        items: List[Dict[str, Any]] = []
+        if source == "live":
+            items = self._query_live(limit + 1, after, since, until, session_id)
+            if len(items) > limit:
+                return self._page(items[:limit], "live")
+            # Live turns exhausted; archives hold everything older
+            after = None
+
+        if include_archived:
+            # Also when the live turns filled the page exactly: peek one
+            # archived turn to know whether to hand out an archive cursor
+            room = limit - len(items)
+            archived = self._query_archive(room + 1, after, since, until, session_id)
+            items.extend(archived[:room])
+            if len(archived) > room:
+                return self._page(items, "archive")
+        return self._page(items, None)
+
+    @staticmethod
+    def _page(items: List[Dict[str, Any]], source: Optional[str]) -> Dict[str, Any]:
+        next_cursor = encode_cursor(source, items[-1]["_ts"], items[-1]["id"]) if source else None
+        return {
+            "items": [{k: v for k, v in item.items() if k != "_ts"} for item in items],
+            "next_cursor": next_cursor
+        }
+
+    def _query_live(self, limit: int, after: Optional[Tuple[datetime, str]], since: Optional[datetime],
+                    until: Optional[datetime], session_id: Optional[str]) -> List[Dict[str, Any]]:
+        from firebase_admin import firestore
+
+        collection = self.db.collection(COLLECTION)
+        query = collection
+        # Equality on session_id plus the timestamp range/order is served by
+        # the composite index in firestore.indexes.json
+        if session_id:
+            query = query.where('session_id', '==', session_id)
+        if since:
+            query = query.where('timestamp', '>=', since)
+        if until:
+            query = query.where('timestamp', '<', until)
+        query = (query.order_by('timestamp', direction=firestore.Query.DESCENDING)
+                 .order_by('__name__', direction=firestore.Query.DESCENDING))
+        if after:
+            query = query.start_after([after[0], collection.document(after[1])])
+
+        items = [self._to_item(doc.id, doc.to_dict()) for doc in query.limit(limit).stream()]
+        FIRESTORE_READS.inc(len(items), collection=COLLECTION)
+        return [item for item in items if item is not None]
+
+    def _query_archive(self, limit: int, after: Optional[Tuple[datetime, str]], since: Optional[datetime],
+                       until: Optional[datetime], session_id: Optional[str]) -> List[Dict[str, Any]]:
+        upper = after[0] if after else until
+        items = []
+        for day, path in self._archive_days(descending=True):
+            # Skip whole days outside the requested range without opening them
+            if upper and day > upper.date():
+                continue
+            if since and day < since.date():
+                break
+            for item in self._read_archive(path):
+                key = (item["_ts"], item["id"])
+                if session_id and item.get("session_id") != session_id:
+                    continue
+                if since and item["_ts"] < since:
+                    continue
+                if until and item["_ts"] >= until:
+                    continue
+                if after and key >= after:
+                    continue
+                items.append(item)
+                if len(items) >= limit:
+                    return items
+        return items
+
+    def _read_archive(self, path: str) -> List[Dict[str, Any]]:
+        """Turns of one archive day, newest first; duplicates from an interrupted compaction are dropped"""
+        seen = {}
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                item = self._to_item(record.pop("id"), {**record, "timestamp": datetime.fromisoformat(record["timestamp"])})
+                if item is not None:
+                    seen[item["id"]] = item
+        return sorted(seen.values(), key=lambda item: (item["_ts"], item["id"]), reverse=True)
+
+    def _archive_days(self, descending: bool = False) -> List[Tuple[Any, str]]:
+        days = []
+        for path in glob.glob(os.path.join(self.archive_dir, f"{ARCHIVE_PREFIX}*.jsonl.gz")):
+            stamp = os.path.basename(path)[len(ARCHIVE_PREFIX):-len(".jsonl.gz")]
+            try:
+                days.append((datetime.strptime(stamp, "%Y-%m-%d").date(), path))
+            except ValueError:
+                continue
+        return sorted(days, reverse=descending)
+
+    @staticmethod
+    def _to_item(doc_id: str, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        timestamp = data.get('timestamp')
+        if not isinstance(timestamp, datetime):
+            # Server timestamp not yet applied
+            return None
+        timestamp = _as_utc(timestamp)
+        return {
+            "id": doc_id,
+            "query": data.get('query', ''),
+            "response": data.get('response', ''),
+            "session_id": data.get('session_id'),
+            "product_ids": data.get('product_ids') or [],
+            "timestamp": timestamp.isoformat(),
+            "_ts": timestamp
+        }
+
+    def compact(self, older_than_days: int = 30, batch_size: int = 500) -> Dict[str, Any]:
+        """
+        Move turns older than the horizon into daily gzip JSONL archives
+
+        Each batch is appended to its archive files before the documents are
+        deleted, so an interruption can only duplicate turns (dropped on
+        read), never lose them.
+        """
+        cutoff = datetime.now(timezone.utc) - timedelta(days=older_than_days)
+        os.makedirs(self.archive_dir, exist_ok=True)
+        archived = 0
+        days = set()
+        try:
+            while True:
+                docs = list(self.db.collection(COLLECTION)
+                            .where('timestamp', '<', cutoff)
+                            .order_by('timestamp')
+                            .limit(batch_size)
+                            .stream())
+                FIRESTORE_READS.inc(len(docs), collection=COLLECTION)
+                if not docs:
+                    break
+
+                by_day: Dict[str, List[str]] = {}
+                for doc in docs:
+                    item = self._to_item(doc.id, doc.to_dict())
+                    if item is None:
+                        continue
+                    item.pop("_ts")
+                    by_day.setdefault(item["timestamp"][:10], []).append(json.dumps(item, separators=(",", ":")))
+                for day, lines in by_day.items():
+                    # Appending adds a gzip member; readers see one continuous stream
+                    path = os.path.join(self.archive_dir, f"{ARCHIVE_PREFIX}{day}.jsonl.gz")
+                    with gzip.open(path, 'at', encoding='utf-8') as f:
+                        f.write("\n".join(lines) + "\n")
+                    days.add(day)
+
+                batch = self.db.batch()
+                for doc in docs:
+                    batch.delete(doc.reference)
+                batch.commit()
+                archived += len(docs)
+
+            if archived:
+                logger.info(f"Archived {archived} chat turns into {len(days)} daily files")
+            return {"status": "success", "archived": archived, "days": sorted(days)}
+        except Exception as e:
+            logger.error(f"Error compacting chat history: {str(e)}")
+            return {"status": "error", "archived": archived, "error": str(e)}
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Archive old chat history into daily compressed files")
+    parser.add_argument('--older-than', type=int, default=30, help="Archive turns older than this many days")
+    parser.add_argument('--archive-dir', help="Directory for the archives")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    from backend.firebase_config import db
+    store = ChatHistoryStore(db, archive_dir=args.archive_dir)
+    print(json.dumps(store.compact(older_than_days=args.older_than), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,48 @@
-import os
-from typing import Dict, List, Any
+import asyncio
+import hashlib
+from dataclasses import dataclass, field
+from typing import Dict, List, Any, Optional, Callable
 from datetime import datetime, timedelta
-import google.generativeai as genai
-from firebase_admin import firestore
-from backend.firebase_config import db
+from backend.firebase_config import get_db
+from llm_client import LLMClient, build_default_client
+from llm_tracing import ChatTracer
+from metrics_exporter import FIRESTORE_READS, LLM_COALESCED
+from singleflight import SingleFlight, normalize_query
+from semantic_cache import SemanticCache
+from forecasting import forecast_products, to_timestamp
+import analytics_snapshot
+from velocity_index import VelocityIndex
+from lots import LotStore, ExpiryIndex
+from conversation_memory import ConversationMemory, resolve_products, needs_full_inventory
+from local_answers import answer_locally
+
+@dataclass
+class DataContext:
+    """
+    Products and sales loaded once and shared by every query of a batch,
+    along with the (lazily computed) unfiltered restocking recommendations
+    and sales rankings
+    """
+    products: List[Dict]
+    products_version: str
+    sales: List[Dict]
+    sales_version: str
+    _recommendations: Optional[Dict[str, Any]] = field(default=None, repr=False)
+    _rankings: Optional[Dict[str, Any]] = field(default=None, repr=False)
+
+    def recommendations(self, service: "InventoryChatService") -> Dict[str, Any]:
+        # The first query that needs them computes them for the whole batch
+        if self._recommendations is None:
+            self._recommendations = service._recommendations_for(list(self.products), sales=self.sales)
+        return self._recommendations
+
+    def rankings(self, service: "InventoryChatService") -> Dict[str, Any]:
+        if self._rankings is None:
+            index = service.velocity_index
+            if not index.ready:
+                index = service._ranking_index(self.products, self.sales)
+            self._rankings = service._ranking_summary(index)
+        return self._rankings
 
 class ChatService:
     def __init__(self):
@@ -18,14 +57,59 @@ class ChatService:
         return response
 
 class InventoryChatService:
-    def __init__(self):
-        """Initialize the chat service with Firebase and Google Gemini"""
-        # Configure the Gemini API
-        genai.configure(api_key=os.environ.get("GEMINI_API_KEY"))
+    def __init__(self, monitor=None, llm_client: Optional[LLMClient] = None):
+        """
+        Initialize the chat service with Firebase and the LLM client
+        
+        Args:
+            monitor: Optional llm_moniter.LLMMonitor fed with per-request metrics
+            llm_client: Shared LLM client; defaults to Gemini with Groq failover from the environment
+        """
+        # Gemini 1.5 Flash by default, with hedging/failover to a secondary provider
+        self.llm = llm_client or build_default_client()
+        self.model_name = self.llm.primary.model
+        self._db = None
+        
+        # Per-stage timings, token usage and cost of chat requests
+        self.tracer = ChatTracer(monitor=monitor, model=self.model_name)
+        
+        # Identical questions asked at the same time against the same data
+        # share a single LLM call
+        self.llm_flights = SingleFlight()
         
-        # Use Gemini 1.5 Flash model
-        self.model = genai.GenerativeModel('gemini-1.5-flash')
-        self.db = db
+        # Per-session recent turns plus a rolling summary of older ones;
+        # sessions not in memory are rebuilt from chat_history
+        self.memory = ConversationMemory(loader=self._load_session_turns)
+        
+        # Answers to standalone questions, matched by meaning and dropped
+        # as soon as the products or sales data changes
+        self.semantic_cache = SemanticCache()
+        
+        # Reorder policy used by the demand forecasts
+        self.lead_time_days = 3  # Days from placing an order to delivery
+        self.review_days = 7  # Days until stock is next reviewed
+        self.service_level = 0.95  # Target chance of not running out before delivery
+        self.slow_cover_days = 30  # Stock lasting longer than this is slow-moving
+        self.forecast_history_days = 56
+        
+        # Nightly per-product sales aggregates; with a snapshot, analysis only
+        # streams the sales made since it was built
+        self.analytics = analytics_snapshot.load_latest()
+        
+        # Per-product velocity kept current from Firestore listeners once
+        # start_velocity_index() is called; takes precedence over the snapshot
+        self.velocity_index = VelocityIndex()
+        
+        # Received batches with expiry dates; the index is fed by a listener
+        # once start_expiry_index() is called, else due lots are queried
+        self.expiry_index = ExpiryIndex()
+        self.expiry_warning_days = 3  # Warn this many days before a lot expires
+        self._lots = None
+        
+        # Rankings shown in trend answers and the daily notifications
+        self.ranking_size = 10
+        self.top_sellers_window = 7
+        self.slow_sellers_window = 30
         
         # Define system prompt with enhanced analysis capabilities
         self.system_prompt = """
@@ -61,13 +145,36 @@ class InventoryChatService:
         """
         Get all documents from a collection
         """
+        return self._read_collection(collection_name)[0]
+
+    async def get_collection_snapshot(self, collection_name: str):
+        """
+        Get all documents from a collection along with a version string that
+        changes whenever any document is added, removed or updated
+        """
+        return self._read_collection(collection_name)
+
+    def _read_collection(self, collection_name: str):
+        """
+        Blocking read behind get_collection_snapshot, for the notification
+        generators the agent runs on worker threads
+        """
         docs = self.db.collection(collection_name).stream()
-        return [{**doc.to_dict(), 'id': doc.id} for doc in docs]
+        data = []
+        version = hashlib.blake2b(digest_size=8)
+        for doc in docs:
+            data.append({**doc.to_dict(), 'id': doc.id})
+            version.update(f"{doc.id}@{getattr(doc, 'update_time', '')};".encode('utf-8'))
+        FIRESTORE_READS.inc(len(data), collection=collection_name)
+        return data, version.hexdigest()
 
     async def calculate_sales_velocity(self, products: List[Dict], sales: List[Dict]) -> Dict[str, Any]:
         """
         Calculate sales velocity for products (how quickly they sell after being stocked)
         """
+        return self._sales_velocity(products, sales)
+
+    def _sales_velocity(self, products: List[Dict], sales: List[Dict]) -> Dict[str, Any]:
         velocity_data = {}
         
         # Create a lookup dictionary for products by barcode
@@ -123,37 +230,102 @@ class InventoryChatService:
         
         return velocity_data
 
-    async def get_restocking_recommendations(self) -> Dict[str, Any]:
+    async def get_restocking_recommendations(self, product_filter: Optional[Callable[[Dict], bool]] = None) -> Dict[str, Any]:
         """
         Generate restocking recommendations based on sales trends
+        
+        Args:
+            product_filter: Optional predicate restricting which products are analysed
+        """
+        return self._recommendations_for(self._current_products(), product_filter)
+
+    def _current_products(self) -> List[Dict]:
+        """
+        All product documents, from the velocity index when it is live
+        """
+        if self.velocity_index.ready:
+            return self.velocity_index.products()
+        return self._read_collection('products')[0]
+
+    def _recommendations_for(self, products: List[Dict],
+                             product_filter: Optional[Callable[[Dict], bool]] = None,
+                             sales: Optional[List[Dict]] = None) -> Dict[str, Any]:
+        """
+        Restocking recommendations for already loaded products, reading no
+        sales when the velocity index is live and only recent sales when an
+        analytics snapshot is available; `sales`, if given, are all sales
+        already loaded, and nothing more is read
+        """
+        index = self.velocity_index
+        if sales is None and index.ready:
+            products, _ = self._filter_products(products, [], product_filter)
+            velocity_data = index.velocity_data(products)
+            product_ids = [p['barcode_id'] for p in products if 'barcode_id' in p]
+            base_demand = index.demand(product_ids, self.forecast_history_days)
+            return self._classify_velocity(velocity_data, products, [], base_demand)
+        
+        snapshot = self.analytics
+        if snapshot is None:
+            if sales is None:
+                sales = self._read_collection('sales')[0]
+            products, sales = self._filter_products(products, sales, product_filter)
+            
+            # Calculate sales velocity
+            velocity_data = self._sales_velocity(products, sales)
+            return self._classify_velocity(velocity_data, products, sales)
+        
+        if sales is None:
+            new_sales = self._read_sales_since(snapshot.cutoff_datetime)
+        else:
+            new_sales = [s for s in sales if (to_timestamp(s.get('selling_date')) or 0) >= snapshot.cutoff]
+        products, new_sales = self._filter_products(products, new_sales, product_filter)
+        velocity_data = snapshot.velocity_data(products, new_sales)
+        product_ids = [p['barcode_id'] for p in products if 'barcode_id' in p]
+        base_demand = snapshot.demand(product_ids, self.forecast_history_days)
+        return self._classify_velocity(velocity_data, products, new_sales, base_demand)
+
+    def _classify_velocity(self, velocity_data: Dict[str, Any], products: List[Dict],
+                           sales: List[Dict], base_demand=None) -> Dict[str, Any]:
         """
-        products = await self.get_collection_data('products')
-        sales = await self.get_collection_data('sales')
+        Split products with sales into ones to reorder now and slow movers,
+        using per-product demand forecasts
         
-        # Calculate sales velocity
-        velocity_data = await self.calculate_sales_velocity(products, sales)
+        'fast_moving' holds products at or below their reorder point, with the
+        forecast order quantity; 'slow_moving' holds products whose stock
+        covers more than slow_cover_days of forecast demand. base_demand is
+        daily demand already aggregated from an analytics snapshot, in which
+        case `sales` only holds the sales made since.
+        """
+        forecasts = forecast_products(products, sales, history_days=self.forecast_history_days,
+                                      base_demand=base_demand, lead_time_days=self.lead_time_days,
+                                      review_days=self.review_days, service_level=self.service_level)
+        index = {product_id: i for i, product_id in enumerate(forecasts.product_ids)}
         
-        # Sort products by sales velocity
         fast_moving = []
         slow_moving = []
-        
         for product_id, data in velocity_data.items():
-            if data['avg_days_to_sell'] is not None:
-                if data['avg_days_to_sell'] < 7 and data['current_stock'] < 20:  # Fast-moving threshold
-                    fast_moving.append({
-                        'product_id': product_id,
-                        'name': data['name'],
-                        'days_to_sell': data['avg_days_to_sell'],
-                        'current_stock': data['current_stock'],
-                        'recommended_order': int(data['total_sold'] * 1.5)  # Simple ordering logic
-                    })
-                elif data['avg_days_to_sell'] > 20 and data['current_stock'] > 10:  # Slow-moving threshold
-                    slow_moving.append({
-                        'product_id': product_id,
-                        'name': data['name'],
-                        'days_to_sell': data['avg_days_to_sell'],
-                        'current_stock': data['current_stock']
-                    })
+            if product_id not in index:
+                continue
+            forecast = forecasts.to_dict(index[product_id])
+            data['forecast'] = forecast
+            item = {
+                'product_id': product_id,
+                'name': data['name'],
+                'days_to_sell': data['avg_days_to_sell'],
+                'current_stock': data['current_stock'],
+                'daily_demand': forecast['daily_demand'],
+                'days_of_cover': forecast['days_of_cover']
+            }
+            if forecast['order_quantity'] > 0:
+                fast_moving.append({
+                    **item,
+                    'reorder_point': forecast['reorder_point'],
+                    'safety_stock': forecast['safety_stock'],
+                    'recommended_order': forecast['order_quantity']
+                })
+            elif data['current_stock'] > 10 and (forecast['days_of_cover'] is None
+                                                 or forecast['days_of_cover'] > self.slow_cover_days):
+                slow_moving.append(item)
         
         return {
             'fast_moving': fast_moving,
@@ -161,38 +333,84 @@ class InventoryChatService:
             'velocity_data': velocity_data
         }
 
-    async def process_query(self, user_query: str) -> Dict[str, Any]:
+    async def load_context(self) -> DataContext:
         """
-        Process a user query about inventory using Google's Gemini 1.5 Flash and Firestore data
+        Read products and sales once, for answering several queries
+        """
+        products, products_version = await self.get_collection_snapshot('products')
+        sales, sales_version = await self.get_collection_snapshot('sales')
+        return DataContext(products, products_version, sales, sales_version)
+
+    async def process_query(self, user_query: str, session_id: Optional[str] = None,
+                            data: Optional[DataContext] = None, new_session: bool = False) -> Dict[str, Any]:
+        """
+        Process a user query about inventory using the LLM and Firestore data
+        
+        Args:
+            user_query: The question
+            session_id: Optional conversation id; follow-up questions in a session
+                reuse its earlier context and only send the products it is about
+            data: Products and sales already loaded (see load_context); read
+                from Firestore when not given
+            new_session: session_id was just created for this turn, so there
+                is no stored history to load
         """
+        trace = self.tracer.start("chat")
         try:
             # Fetch relevant data from Firestore
-            products = await self.get_collection_data('products')
-            sales = await self.get_collection_data('sales')
+            with trace.stage("firestore_load"):
+                if data is None:
+                    data = await self.load_context()
+                products, products_version = data.products, data.products_version
+                sales, sales_version = data.sales, data.sales_version
             
-            # Define specific trend analysis phrases that require advanced analysis
-            trend_analysis_phrases = [
-                "trend", "recommend", "restock", "restocking", 
-                "best sell", "fast sell", "slow sell", "popular", 
-                "sales velocity", "turnover rate", "moving products",
-                "should i order", "how many to order", "projected inventory"
-            ]
+            # Work out which products this turn is about
+            session = self.memory.get(session_id, fresh=new_session) if session_id else None
+            mentioned = resolve_products(user_query, products)
+            focus = self.memory.focus_products(session, mentioned) if session else mentioned
+            product_filter = None
+            if session is not None and session.turns and focus and not needs_full_inventory(user_query):
+                # Follow-up: send only the products under discussion
+                focus_ids = set(focus)
+                product_filter = lambda p: p.get('barcode_id') in focus_ids
+                products, sales = self._filter_products(products, sales, product_filter)
             
-            # Check if query explicitly asks for trend analysis
-            is_trend_query = False
-            user_query_lower = user_query.lower()
+            # Standalone questions can reuse the answer to an earlier question
+            # with the same meaning, while the data is unchanged
+            data_version = (products_version, sales_version)
+            cacheable = session is None or not session.turns
+            query_vector = None
+            if cacheable:
+                with trace.stage("semantic_cache"):
+                    cached, query_vector = self.semantic_cache.lookup(user_query, data_version,
+                                                                      guard=tuple(sorted(mentioned)))
+                if cached:
+                    trace.cache_hit = True
+                    await self._finish_turn(trace, user_query, cached["answer"], session_id, mentioned)
+                    return {
+                        "response": cached["answer"],
+                        "status": "success",
+                        "session_id": session_id,
+                        "cached": {"query": cached["query"], "similarity": cached["similarity"]},
+                        "context": {'products': products, 'sales': sales}
+                    }
             
-            for phrase in trend_analysis_phrases:
-                if phrase in user_query_lower:
-                    is_trend_query = True
-                    break
+            # Check if query explicitly asks for trend analysis
+            is_trend_query = self._is_trend_query(user_query)
                     
             # Only add trend analysis for explicit trend-related queries
             additional_context = {}
             if is_trend_query:
-                recommendations = await self.get_restocking_recommendations()
+                with trace.stage("analytics"):
+                    if product_filter is None:
+                        recommendations = data.recommendations(self)
+                        rankings = data.rankings(self)
+                    else:
+                        recommendations = self._recommendations_for(products, sales=sales)
+                        rankings = self._ranking_summary(self._ranking_index(products, sales))
                 additional_context = {
-                    'recommendations': recommendations
+                    'recommendations': recommendations,
+                    'rankings': rankings
                 }
 
             # Prepare context with database information
@@ -202,10 +420,150 @@ class InventoryChatService:
                 **additional_context
             }
 
-            # Create chat completion with Gemini
-            # Basic prompt for simple inventory queries
-            if not is_trend_query:
-                prompt = f"""
+            with trace.stage("prompt_build"):
+                conversation = self.memory.render(session) if session else ""
+                prompt = self._build_prompt(user_query, products, sales, is_trend_query, additional_context,
+                                            conversation)
+            
+            # Create chat completion; concurrent identical questions
+            # against the same data version and conversation state wait for
+            # one shared call
+            flight_key = (normalize_query(user_query), products_version, sales_version,
+                          session.context_key() if session else None,
+                          tuple(focus) if product_filter else None)
+            with trace.stage("llm_call"):
+                response, shared = await self.llm_flights.do(flight_key, lambda: self._generate(prompt))
+            response_text = response.text
+            if shared:
+                trace.coalesced = True
+                LLM_COALESCED.inc()
+            else:
+                trace.set_usage(response)
+                if cacheable:
+                    self.semantic_cache.store(user_query, response_text, data_version, query_vector,
+                                              guard=tuple(sorted(mentioned)))
+
+            await self._finish_turn(trace, user_query, response_text, session_id,
+                                    mentioned or (focus if product_filter else []))
+            return {
+                "response": response_text,
+                "status": "success",
+                "session_id": session_id,
+                "context": context
+            }
+
+        except Exception as e:
+            self.tracer.finish(trace, error=str(e))
+            return {
+                "response": f"Error processing query: {str(e)}",
+                "status": "error"
+            }
+
+    async def process_batch(self, queries: List[str], max_concurrency: int = 4,
+                            local_answers: bool = True) -> Dict[str, Any]:
+        """
+        Answer many standalone queries against one load of the data
+        
+        Products and sales are read once for the whole batch. Simple lookups
+        (counts, a product's price or stock, low or out-of-stock products)
+        are answered directly from the data when local_answers is set; the
+        rest go to the LLM, at most max_concurrency at a time.
+        
+        Returns:
+            {"results": [...], "status": "success"}, results in query order
+        """
+        try:
+            data = await self.load_context()
+        except Exception as e:
+            return {
+                "status": "error",
+                "error": f"Error loading inventory data: {str(e)}"
+            }
+        
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        
+        async def answer(query: str) -> Dict[str, Any]:
+            # One failing query gets an error result instead of failing the batch
+            try:
+                text = None
+                if local_answers:
+                    try:
+                        text = answer_locally(query, data.products)
+                    except Exception:
+                        text = None  # Unexpected product data; the LLM can still answer
+                if text is not None:
+                    trace = self.tracer.start("chat")
+                    trace.local_answer = True
+                    await self._finish_turn(trace, query, text, None, resolve_products(query, data.products))
+                    return {"response": text, "status": "success", "answered_locally": True}
+                async with semaphore:
+                    result = await self.process_query(query, data=data)
+                # The shared data is returned once for the whole batch, not per query
+                result.pop("context", None)
+                result.pop("session_id", None)
+                return result
+            except Exception as e:
+                return {
+                    "response": f"Error processing query: {str(e)}",
+                    "status": "error"
+                }
+        
+        results = await asyncio.gather(*(answer(query) for query in queries))
+        return {
+            "results": list(results),
+            "status": "success",
+            "data_version": {"products": data.products_version, "sales": data.sales_version}
+        }
+
+    async def _finish_turn(self, trace, user_query: str, response_text: str, session_id: Optional[str],
+                           product_ids: List[str]):
+        """
+        Remember the turn, store the conversation in Firestore and close the trace
+        """
+        if session_id:
+            self.memory.record(session_id, user_query, response_text, product_ids)
+        with trace.stage("history_write"):
+            await self.store_conversation(user_query, response_text, session_id, product_ids)
+        self.tracer.finish(trace)
+
+    def _generate(self, prompt: str):
+        """
+        Call the LLM client; errors (including blocked responses) propagate to every waiter
+        """
+        return self.llm.generate(prompt)
+
+    def _is_trend_query(self, user_query: str) -> bool:
+        """
+        Whether a query explicitly asks for trend analysis
+        """
+        # Define specific trend analysis phrases that require advanced analysis
+        trend_analysis_phrases = [
+            "trend", "recommend", "restock", "restocking", 
+            "best sell", "fast sell", "slow sell", "popular", 
+            "sales velocity", "turnover rate", "moving products",
+            "should i order", "how many to order", "projected inventory"
+        ]
+        
+        user_query_lower = user_query.lower()
+        return any(phrase in user_query_lower for phrase in trend_analysis_phrases)
+
+    def _build_prompt(self, user_query: str, products: List[Dict], sales: List[Dict],
+                      is_trend_query: bool, additional_context: Dict[str, Any], conversation: str = "") -> str:
+        """
+        Build the LLM prompt for a query
+        """
+        # Earlier turns let follow-ups like "and what about Colgate?" resolve;
+        # on follow-ups the database state only holds the products discussed
+        history = ""
+        if conversation:
+            history = f"""
+                {conversation}
+                
+                The question may refer back to the conversation above.
+                """
+        # Basic prompt for simple inventory queries
+        if not is_trend_query:
+            return f"""
                 You are an AI assistant for a small grocery store inventory management system. You have access to the Firebase database
                 with the following collections:
                 
@@ -218,12 +576,11 @@ class InventoryChatService:
                 Here is the current database state:
                 Products: {str(products)}
                 Sales: {str(sales)}
-                
+                {history}
                 User question: {user_query}
                 """
-            # Enhanced prompt for trend analysis queries
-            else:
-                prompt = f"""
+        # Enhanced prompt for trend analysis queries
+        return f"""
                 {self.system_prompt}
                 
                 Here is the current database state:
@@ -231,37 +588,47 @@ class InventoryChatService:
                 Sales: {str(sales)}
                 
                 Sales Trend Analysis: {str(additional_context)}
-                
+                {history}
                 User question: {user_query}
                 """
-            
-            response = self.model.generate_content(prompt)
 
-            # Store the conversation in Firestore
-            await self.store_conversation(user_query, response.text)
+    @property
+    def db(self):
+        """Firestore client, connected on first use"""
+        if self._db is None:
+            self._db = get_db()
+        return self._db
 
-            return {
-                "response": response.text,
-                "status": "success",
-                "context": context
-            }
-
-        except Exception as e:
-            return {
-                "response": f"Error processing query: {str(e)}",
-                "status": "error"
-            }
-
-    async def store_conversation(self, query: str, response: str):
+    async def store_conversation(self, query: str, response: str, session_id: Optional[str] = None,
+                                 product_ids: Optional[List[str]] = None):
         """
         Store conversation history in Firestore
         """
+        from firebase_admin import firestore
+        
         self.db.collection('chat_history').add({
             'query': query,
             'response': response,
+            'session_id': session_id,
+            'product_ids': product_ids or [],
             'timestamp': firestore.SERVER_TIMESTAMP
         })
 
+    def _load_session_turns(self, session_id: str, limit: int) -> List[Dict[str, Any]]:
+        """
+        Most recent stored turns of a session, oldest first
+        """
+        from firebase_admin import firestore
+        
+        docs = (self.db.collection('chat_history')
+                .where('session_id', '==', session_id)
+                .order_by('timestamp', direction=firestore.Query.DESCENDING)
+                .limit(limit)
+                .stream())
+        turns = [doc.to_dict() for doc in docs]
+        FIRESTORE_READS.inc(len(turns), collection='chat_history')
+        return list(reversed(turns))
+
     async def get_inventory_summary(self) -> Dict[str, Any]:
         """
         Get a summary of the current inventory status
@@ -299,60 +666,266 @@ class InventoryChatService:
                 "status": "error"
             }
 
-    async def generate_notifications(self) -> Dict[str, Any]:
+    async def get_products_by_id(self, product_ids: List[str]) -> List[Dict]:
+        """
+        Get product documents for the given barcode ids
+        """
+        return self._read_products_by_id(product_ids)
+
+    def _read_products_by_id(self, product_ids: List[str]) -> List[Dict]:
+        products = []
+        for product_id in product_ids:
+            doc = self.db.collection('products').document(product_id).get()
+            FIRESTORE_READS.inc(collection='products')
+            if doc.exists:
+                products.append({**doc.to_dict(), 'id': doc.id})
+        return products
+
+    async def get_sales_for_products(self, product_ids: List[str]) -> List[Dict]:
+        """
+        Get sales documents for the given product ids
+        """
+        return self._read_sales_for_products(product_ids)
+
+    def _read_sales_for_products(self, product_ids: List[str]) -> List[Dict]:
+        sales = []
+        ids = list(product_ids)
+        # Firestore 'in' filters accept at most 10 values per query
+        for i in range(0, len(ids), 10):
+            docs = self.db.collection('sales').where('product_id', 'in', ids[i:i + 10]).stream()
+            batch = [{**doc.to_dict(), 'id': doc.id} for doc in docs]
+            FIRESTORE_READS.inc(len(batch), collection='sales')
+            sales.extend(batch)
+        return sales
+
+    async def get_sales_since(self, since: datetime) -> List[Dict]:
+        """
+        Get sales documents with a selling date at or after `since`
+        """
+        return self._read_sales_since(since)
+
+    def _read_sales_since(self, since: datetime) -> List[Dict]:
+        docs = self.db.collection('sales').where('selling_date', '>=', since).stream()
+        sales = [{**doc.to_dict(), 'id': doc.id} for doc in docs]
+        FIRESTORE_READS.inc(len(sales), collection='sales')
+        return sales
+
+    def refresh_analytics(self) -> Dict[str, Any]:
+        """
+        Materialize a new analytics snapshot from all products and sales and start using it
+        """
+        try:
+            products = self._read_collection('products')[0]
+            sales = self._read_collection('sales')[0]
+            result = analytics_snapshot.materialize(products, sales)
+            self.analytics = analytics_snapshot.load_latest()
+            return result
+        except Exception as e:
+            return {
+                "status": "error",
+                "error": f"Error materializing analytics: {str(e)}"
+            }
+
+    async def get_rankings(self, k: int = 10, metric: str = 'units', window_days: Optional[int] = 7,
+                           ascending: bool = False) -> Dict[str, Any]:
+        """
+        Top (or bottom) k products by units sold or days to sell, over a
+        trailing window or all time (see VelocityIndex.rank)
+        
+        Read from the velocity index when it is live; otherwise ranked from a
+        full read of products and sales.
+        """
+        try:
+            if self.velocity_index.ready:
+                index = self.velocity_index
+            else:
+                index = self._ranking_index(await self.get_collection_data('products'),
+                                            await self.get_collection_data('sales'))
+            return {
+                "rankings": index.rank(k, metric, window_days, ascending),
+                "metric": metric,
+                "window_days": window_days,
+                "order": "asc" if ascending else "desc",
+                "status": "success"
+            }
+        except Exception as e:
+            return {
+                "status": "error",
+                "error": f"Error ranking products: {str(e)}"
+            }
+
+    def _ranking_index(self, products: List[Dict], sales: List[Dict]) -> VelocityIndex:
+        """
+        A velocity index over already loaded products and sales
+        """
+        index = VelocityIndex(rank_windows=self.velocity_index.rank_windows)
+        index.rebuild(products, sales)
+        return index
+
+    def _ranking_summary(self, index: VelocityIndex) -> Dict[str, Any]:
+        """
+        Best sellers over top_sellers_window days and slowest sellers over
+        slow_sellers_window days, for the trend analysis context
+        """
+        return {
+            f'top_sellers_{self.top_sellers_window}d': index.rank(self.ranking_size, 'units', self.top_sellers_window),
+            f'slowest_sellers_{self.slow_sellers_window}d': index.rank(self.ranking_size, 'units', self.slow_sellers_window,
+                                                                       ascending=True)
+        }
+
+    def start_velocity_index(self, verify_interval: float = 3600.0) -> Dict[str, Any]:
+        """
+        Keep sales velocity up to date from Firestore listeners, checking it
+        against a full recompute every verify_interval seconds
+        """
+        try:
+            self.velocity_index.start(self.db, verify_interval=verify_interval)
+            return {"status": "success"}
+        except Exception as e:
+            return {
+                "status": "error",
+                "error": f"Error starting velocity index: {str(e)}"
+            }
+
+    def start_expiry_index(self) -> Dict[str, Any]:
+        """
+        Keep lots with stock in an expiry-ordered index from a Firestore listener
+        """
+        try:
+            self.expiry_index.start(self.db)
+            return {"status": "success"}
+        except Exception as e:
+            return {
+                "status": "error",
+                "error": f"Error starting expiry index: {str(e)}"
+            }
+
+    @property
+    def lots(self) -> LotStore:
+        """Receiving lots and recording sales with FIFO lot depletion"""
+        if self._lots is None:
+            self._lots = LotStore(self.db)
+        return self._lots
+
+    def _filter_products(self, products: List[Dict], sales: List[Dict],
+                         product_filter: Optional[Callable[[Dict], bool]]):
+        """
+        Keep only products matching the filter, and the sales of those products
+        """
+        if product_filter is None:
+            return products, sales
+        products = [p for p in products if product_filter(p)]
+        product_ids = {p.get('barcode_id') for p in products}
+        return products, [s for s in sales if s.get('product_id') in product_ids]
+
+    # The notification generators below make blocking Firestore reads; the
+    # agent calls them on worker threads, off its scheduler loop
+    
+    def generate_notifications(self, product_filter: Optional[Callable[[Dict], bool]] = None) -> Dict[str, Any]:
         """
         Generate notifications based on inventory status and sales trends
         """
         try:
-            products = await self.get_collection_data('products')
-            sales = await self.get_collection_data('sales')
+            products = self._current_products()
+            products, _ = self._filter_products(products, [], product_filter)
             
             # Get restocking recommendations
-            recommendations = await self.get_restocking_recommendations()
+            recommendations = self._recommendations_for(products)
+            return {
+                "notifications": self._build_notifications(products, recommendations),
+                "status": "success"
+            }
             
-            notifications = []
+        except Exception as e:
+            return {
+                "status": "error",
+                "error": f"Error generating notifications: {str(e)}"
+            }
+
+    def generate_product_notifications(self, product_ids: List[str]) -> Dict[str, Any]:
+        """
+        Generate notifications for a subset of products only, reading just their
+        product documents and sales instead of the whole database
+        """
+        try:
+            products = self._read_products_by_id(product_ids)
+            sales = self._read_sales_for_products([p['barcode_id'] for p in products if 'barcode_id' in p])
             
-            # Check for low stock items (less than 15 units)
-            low_stock_items = [p for p in products if p.get('quantity', 0) < 15]
-            for item in low_stock_items:
-                notifications.append({
-                    "type": "warning",
-                    "message": f"Low stock alert: {item.get('name')} has only {item.get('quantity')} units left",
-                    "timestamp": datetime.now().isoformat(),
-                    "product_id": item.get('barcode_id')
-                })
+            velocity_data = self._sales_velocity(products, sales)
+            recommendations = self._classify_velocity(velocity_data, products, sales)
             
-            # Add notifications for fast-moving items
-            for item in recommendations.get('fast_moving', []):
-                notifications.append({
-                    "type": "info",
-                    "message": f"{item.get('name')} is selling well (avg {item.get('days_to_sell', 0):.1f} days to sell). Consider ordering {item.get('recommended_order', 0)} more units.",
-                    "timestamp": datetime.now().isoformat(),
-                    "product_id": item.get('product_id')
-                })
+            return {
+                "notifications": self._build_notifications(products, recommendations),
+                "status": "success"
+            }
             
-            # Add notifications for slow-moving items
-            for item in recommendations.get('slow_moving', []):
-                notifications.append({
-                    "type": "alert",
-                    "message": f"{item.get('name')} is moving slowly (avg {item.get('days_to_sell', 0):.1f} days to sell). Consider reducing stock.",
-                    "timestamp": datetime.now().isoformat(),
-                    "product_id": item.get('product_id')
-                })
+        except Exception as e:
+            return {
+                "status": "error",
+                "error": f"Error generating notifications: {str(e)}"
+            }
+
+    def generate_low_stock_notifications(self, product_filter: Optional[Callable[[Dict], bool]] = None) -> Dict[str, Any]:
+        """
+        Generate low stock notifications only; reads products but not sales
+        """
+        try:
+            products = self._read_collection('products')[0]
+            products, _ = self._filter_products(products, [], product_filter)
             
-            # Sort by notification type (warnings first, then alerts, then info)
-            def get_notification_priority(notification):
-                if notification["type"] == "warning":
-                    return 0
-                elif notification["type"] == "alert":
-                    return 1
-                else:
-                    return 2
-                    
-            notifications.sort(key=get_notification_priority)
+            return {
+                "notifications": self._sort_notifications(self._low_stock_notifications(products)),
+                "status": "success"
+            }
+            
+        except Exception as e:
+            return {
+                "status": "error",
+                "error": f"Error generating notifications: {str(e)}"
+            }
+
+    def generate_velocity_notifications(self, product_filter: Optional[Callable[[Dict], bool]] = None) -> Dict[str, Any]:
+        """
+        Generate fast-moving and slow-moving product notifications only
+        """
+        try:
+            recommendations = self._recommendations_for(self._current_products(), product_filter)
+            
+            return {
+                "notifications": self._sort_notifications(self._velocity_notifications(recommendations)),
+                "status": "success"
+            }
+            
+        except Exception as e:
+            return {
+                "status": "error",
+                "error": f"Error generating notifications: {str(e)}"
+            }
+
+    def generate_expiry_notifications(self, product_filter: Optional[Callable[[Dict], bool]] = None) -> Dict[str, Any]:
+        """
+        Generate notifications for lots expiring within expiry_warning_days or
+        already expired; reads only the due lots and their products
+        """
+        try:
+            within = self.expiry_warning_days * 86400
+            if self.expiry_index.ready:
+                due = self.expiry_index.due(within)
+            else:
+                due = self.lots.expiring(datetime.now() + timedelta(seconds=within))
+            if not due:
+                return {"notifications": [], "status": "success"}
+            
+            product_ids = sorted({lot.product_id for lot in due})
+            if self.velocity_index.ready:
+                wanted = set(product_ids)
+                products = [p for p in self.velocity_index.products() if p.get('barcode_id') in wanted]
+            else:
+                products = self._read_products_by_id(product_ids)
+            products, _ = self._filter_products(products, [], product_filter)
             
             return {
-                "notifications": notifications,
+                "notifications": self._sort_notifications(self._expiry_notifications(products, due)),
                 "status": "success"
             }
             
@@ -360,4 +933,140 @@ class InventoryChatService:
             return {
                 "status": "error",
                 "error": f"Error generating notifications: {str(e)}"
-            }
\ No newline at end of file
+            }
+
+    def _build_notifications(self, products: List[Dict], recommendations: Dict[str, Any]) -> List[Dict]:
+        """
+        Turn products and restocking recommendations into a sorted notification list
+        """
+        notifications = self._low_stock_notifications(products) + self._velocity_notifications(recommendations)
+        return self._sort_notifications(notifications)
+
+    def _low_stock_notifications(self, products: List[Dict]) -> List[Dict]:
+        """
+        Notifications for items with less than 15 units in stock
+        """
+        notifications = []
+        low_stock_items = [p for p in products if p.get('quantity', 0) < 15]
+        for item in low_stock_items:
+            notifications.append({
+                "type": "warning",
+                "message": f"Low stock alert: {item.get('name')} has only {item.get('quantity')} units left",
+                "timestamp": datetime.now().isoformat(),
+                "product_id": item.get('barcode_id')
+            })
+        return notifications
+
+    def _velocity_notifications(self, recommendations: Dict[str, Any]) -> List[Dict]:
+        """
+        Notifications for fast-moving and slow-moving items
+        """
+        notifications = []
+        
+        # Add notifications for fast-moving items
+        for item in recommendations.get('fast_moving', []):
+            notifications.append({
+                "type": "info",
+                "message": f"{item.get('name')} is selling well (~{item.get('daily_demand', 0):.1f} units/day, {self._cover_text(item)}). Consider ordering {item.get('recommended_order', 0)} more units.",
+                "timestamp": datetime.now().isoformat(),
+                "product_id": item.get('product_id')
+            })
+        
+        # Add notifications for slow-moving items
+        for item in recommendations.get('slow_moving', []):
+            notifications.append({
+                "type": "alert",
+                "message": f"{item.get('name')} is moving slowly ({self._cover_text(item)} at ~{item.get('daily_demand', 0):.1f} units/day). Consider reducing stock.",
+                "timestamp": datetime.now().isoformat(),
+                "product_id": item.get('product_id')
+            })
+        return notifications
+
+    def _expiry_notifications(self, products: List[Dict], lots: List) -> List[Dict]:
+        """
+        One notification per product for its expired lots (warning) and one
+        for lots about to expire (alert)
+        """
+        names = {p.get('barcode_id'): p.get('name') for p in products}
+        now = datetime.now().timestamp()
+        grouped: Dict[tuple, List] = {}
+        for lot in lots:
+            if lot.product_id in names:
+                grouped.setdefault((lot.product_id, lot.expiry_ts <= now), []).append(lot)
+        
+        notifications = []
+        for (product_id, expired), product_lots in grouped.items():
+            units = sum(lot.quantity for lot in product_lots)
+            expiries = [lot.expiry_ts for lot in product_lots]
+            if expired:
+                date = datetime.fromtimestamp(min(expiries)).date().isoformat()
+                message = f"{names[product_id]}: {units:g} units expired (since {date}). Remove them from the shelves and write them off."
+            else:
+                date = datetime.fromtimestamp(max(expiries)).date().isoformat()
+                message = f"{names[product_id]}: {units:g} units expire by {date}. Consider selling them first or discounting."
+            notifications.append({
+                "type": "warning" if expired else "alert",
+                "category": "expiry",
+                "message": message,
+                "timestamp": datetime.now().isoformat(),
+                "product_id": product_id,
+                "lots": [lot.lot_id for lot in product_lots]
+            })
+        return notifications
+
+    def generate_top_seller_notifications(self) -> Dict[str, Any]:
+        """
+        Generate one summary of the best sellers over the last
+        top_sellers_window days; ranked from the velocity index when it is
+        live, else from a full read of products and sales
+        """
+        try:
+            if self.velocity_index.ready:
+                index = self.velocity_index
+            else:
+                index = self._ranking_index(self._read_collection('products')[0],
+                                            self._read_collection('sales')[0])
+            return {
+                "notifications": self._top_seller_notifications(index),
+                "status": "success"
+            }
+        except Exception as e:
+            return {
+                "status": "error",
+                "error": f"Error generating notifications: {str(e)}"
+            }
+
+    def _top_seller_notifications(self, index: VelocityIndex) -> List[Dict]:
+        """
+        One summary of the best sellers over the last top_sellers_window days
+        """
+        top = [item for item in index.rank(self.ranking_size, 'units', self.top_sellers_window) if item['units_sold'] > 0]
+        if not top:
+            return []
+        sellers = ", ".join(f"{item['name']} ({item['units_sold']:g})" for item in top)
+        return [{
+            "type": "info",
+            "category": "top_sellers",
+            "message": f"Top sellers over the last {self.top_sellers_window} days: {sellers}",
+            "timestamp": datetime.now().isoformat()
+        }]
+
+    @staticmethod
+    def _cover_text(item: Dict[str, Any]) -> str:
+        cover = item.get('days_of_cover')
+        return "no recent sales" if cover is None else f"{cover:.0f} days of stock left"
+
+    def _sort_notifications(self, notifications: List[Dict]) -> List[Dict]:
+        """
+        Sort by notification type (warnings first, then alerts, then info)
+        """
+        def get_notification_priority(notification):
+            if notification["type"] == "warning":
+                return 0
+            elif notification["type"] == "alert":
+                return 1
+            else:
+                return 2
+                
+        notifications.sort(key=get_notification_priority)
+        return notifications
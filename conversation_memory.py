@@ -0,0 +1,209 @@
+import hashlib
+import re
+import threading
+import time
+import logging
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Dict, List, Any, Callable, Optional, Tuple
+
+logger = logging.getLogger("ConversationMemory")
+
+# Words too generic to identify a product on their own
+_STOPWORDS = {
+    "the", "and", "for", "with", "what", "about", "how", "many", "much", "stock", "price", "sold",
+    "sales", "pack", "premium", "original", "classic", "fresh", "new", "small", "large", "bottle",
+}
+
+
+@dataclass
+class Turn:
+    query: str
+    response: str
+    product_ids: List[str]
+    timestamp: float
+
+
+@dataclass
+class Session:
+    """Recent turns verbatim, older turns folded into a bounded summary"""
+    session_id: str
+    turns: deque
+    summary: List[str] = field(default_factory=list)
+    # Products discussed, most recent last; the context for follow-ups
+    focus: "OrderedDict[str, None]" = field(default_factory=OrderedDict)
+    last_active: float = field(default_factory=time.time)
+
+    def context_key(self) -> str:
+        """Changes whenever the context the next prompt would carry changes"""
+        digest = hashlib.blake2b(digest_size=8)
+        for line in self.summary:
+            digest.update(line.encode("utf-8"))
+        for turn in self.turns:
+            digest.update(f"{turn.query}\x00{turn.response}\x00".encode("utf-8"))
+        digest.update(",".join(self.focus).encode("utf-8"))
+        return digest.hexdigest()
+
+
+# Questions about the whole store, which need the full inventory even mid-conversation
+_FULL_INVENTORY = re.compile(
+    r"\b(all|every|list|which products|what products|top|best|worst|total|overall|compared?)\b"
+)
+
+
+def needs_full_inventory(query: str) -> bool:
+    """Whether a question is about the whole store rather than specific products"""
+    return bool(_FULL_INVENTORY.search(query.lower()))
+
+
+def _name_keys(name: str) -> Tuple[str, Optional[str]]:
+    """Full normalized name and the distinctive first word (usually the brand)"""
+    words = re.findall(r"[a-z0-9]+", name.lower())
+    brand = words[0] if words and len(words[0]) >= 4 and words[0] not in _STOPWORDS else None
+    return " ".join(words), brand
+
+
+def resolve_products(query: str, products: List[Dict]) -> List[str]:
+    """
+    Barcode ids of the products a query mentions
+
+    Matches barcodes, full product names, and the brand word on its own
+    ("and Colgate?"), preferring full-name matches when both occur.
+    """
+    text = " ".join(re.findall(r"[a-z0-9]+", query.lower()))
+    padded = f" {text} "
+    full, brand = [], []
+    for product in products:
+        barcode = product.get("barcode_id")
+        if not barcode:
+            continue
+        name, brand_word = _name_keys(product.get("name", ""))
+        if barcode in text or (name and f" {name} " in padded):
+            full.append(barcode)
+        elif brand_word and f" {brand_word} " in padded:
+            brand.append(barcode)
+    return full or brand
+
+
+class ConversationMemory:
+    """
+    Per-session chat memory with a rolling summary
+
+    Keeps the last `max_turns` turns of each session verbatim. Older turns are
+    folded into a short extractive summary (question plus the first sentence
+    of the answer) capped at `summary_chars`, so the context sent with each
+    turn stays bounded however long the conversation runs. Sessions live in an
+    LRU map; a session not in memory is rebuilt from stored history through
+    `loader` when given.
+    """
+    def __init__(self, max_turns: int = 4, summary_chars: int = 1200, turn_chars: int = 800, max_focus: int = 10,
+                 max_sessions: int = 1000, session_ttl: float = 6 * 3600,
+                 loader: Optional[Callable[[str, int], List[Dict[str, Any]]]] = None):
+        """
+        Args:
+            max_turns: Recent turns kept verbatim
+            summary_chars: Maximum size of the rolling summary
+            turn_chars: Longest answer text repeated verbatim from a recent turn
+            max_focus: Most products carried over as follow-up context
+            max_sessions: Sessions kept in memory (least recently used evicted)
+            session_ttl: Seconds of inactivity after which a session is forgotten
+            loader: Optional (session_id, limit) -> stored turns, oldest first
+        """
+        self.max_turns = max_turns
+        self.summary_chars = summary_chars
+        self.turn_chars = turn_chars
+        self.max_focus = max_focus
+        self.max_sessions = max_sessions
+        self.session_ttl = session_ttl
+        self.loader = loader
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str, fresh: bool = False) -> Session:
+        """
+        The session's memory, loading it from stored history if needed
+
+        fresh marks an id just created for a new conversation: it cannot have
+        stored history, so it starts empty without a loader round-trip.
+        """
+        now = time.time()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None and now - session.last_active > self.session_ttl:
+                del self._sessions[session_id]
+                session = None
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+                return session
+
+        session = Session(session_id, deque())
+        if self.loader is not None and not fresh:
+            try:
+                for stored in self.loader(session_id, self.max_turns * 3):
+                    self._append(session, stored.get("query", ""), stored.get("response", ""),
+                                 stored.get("product_ids") or [])
+            except Exception as e:
+                logger.error(f"Error loading history for session {session_id}: {str(e)}")
+
+        with self._lock:
+            # Another request may have loaded it meanwhile; keep that one
+            session = self._sessions.setdefault(session_id, session)
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        return session
+
+    def record(self, session_id: str, query: str, response: str, product_ids: List[str]):
+        """Add a finished turn"""
+        session = self.get(session_id)
+        with self._lock:
+            self._append(session, query, response, product_ids)
+            session.last_active = time.time()
+
+    def focus_products(self, session: Session, mentioned: List[str]) -> List[str]:
+        """
+        Products a turn is about: the ones it mentions, plus the session's
+        recent focus when it is a follow-up
+        """
+        focus = list(dict.fromkeys(mentioned))
+        for product_id in reversed(session.focus):
+            if len(focus) >= self.max_focus:
+                break
+            if product_id not in focus:
+                focus.append(product_id)
+        return focus
+
+    def render(self, session: Session) -> str:
+        """Prompt section describing the conversation so far ('' for a new session)"""
+        parts = []
+        if session.summary:
+            parts.append("Earlier in this conversation:\n" + "\n".join(session.summary))
+        if session.turns:
+            recent = "\n".join(f"User: {t.query}\nAssistant: {t.response[:self.turn_chars]}" for t in session.turns)
+            parts.append("Most recent turns:\n" + recent)
+        return "\n\n".join(parts)
+
+    def clear(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"sessions": len(self._sessions), "max_turns": self.max_turns}
+
+    def _append(self, session: Session, query: str, response: str, product_ids: List[str]):
+        session.turns.append(Turn(query, response, list(product_ids), time.time()))
+        for product_id in product_ids:
+            session.focus.pop(product_id, None)
+            session.focus[product_id] = None
+        while len(session.focus) > self.max_focus:
+            session.focus.popitem(last=False)
+        while len(session.turns) > self.max_turns:
+            self._summarize(session, session.turns.popleft())
+
+    def _summarize(self, session: Session, turn: Turn):
+        first_sentence = re.split(r"(?<=[.!?])\s", turn.response.strip(), maxsplit=1)[0]
+        session.summary.append(f"- Q: {turn.query.strip()[:160]} A: {first_sentence[:240]}")
+        # Drop the oldest summary lines once over budget
+        while len(session.summary) > 1 and sum(len(line) + 1 for line in session.summary) > self.summary_chars:
+            session.summary.pop(0)
@@ -0,0 +1,307 @@
+import json
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, List, Any, Optional
+
+from metrics_exporter import FIRESTORE_READS
+
+logger = logging.getLogger("DataTransfer")
+
+COLLECTIONS = ('products', 'sales', 'chat_history')
+MANIFEST = 'manifest.json'
+ID_COLUMN = '__id__'
+NULLS_COLUMN = '__nulls__'  # Fields set to an explicit None, per document
+MAX_BATCH = 500  # Firestore's limit on writes per batch
+
+
+def connect(emulator_host: Optional[str] = None):
+    """
+    Firestore client for the transfer
+
+    With FIRESTORE_EMULATOR_HOST set (or emulator_host given) this connects
+    to the local Firestore emulator without credentials, so production-sized
+    datasets can be replayed locally; otherwise the configured project is used.
+    """
+    if emulator_host:
+        os.environ['FIRESTORE_EMULATOR_HOST'] = emulator_host
+    if os.environ.get('FIRESTORE_EMULATOR_HOST'):
+        from google.auth.credentials import AnonymousCredentials
+        from google.cloud import firestore as gcloud_firestore
+        project = os.environ.get('FIREBASE_PROJECT_ID', 'demo-inventory')
+        return gcloud_firestore.Client(project=project, credentials=AnonymousCredentials())
+    from backend.firebase_config import db
+    return db
+
+
+def _normalize(value: Any) -> Any:
+    # Naive and aware datetimes cannot share an Arrow column; store everything as UTC
+    if isinstance(value, datetime):
+        return value.astimezone(timezone.utc) if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {'$date': value.isoformat()}
+    return str(value)  # Document references, geo points, ...
+
+
+def _json_object(value: Dict[str, Any]) -> Any:
+    if len(value) == 1 and '$date' in value:
+        return datetime.fromisoformat(value['$date'])
+    return value
+
+
+def _needs_json(values: List[Any]) -> bool:
+    """
+    Whether a column has to be stored as JSON to come back unchanged
+
+    Arrow would turn maps into structs (every row gaining every key, as
+    None) and widen ints mixed with floats (or bools) to floats.
+    """
+    kinds = set()
+    for value in values:
+        if isinstance(value, (dict, list, tuple)):
+            return True
+        if isinstance(value, (bool, int, float)):
+            kinds.add(type(value))
+    return len(kinds) > 1
+
+
+def _to_table(rows: List[Dict[str, Any]]):
+    """
+    Column-per-field Arrow table of documents
+
+    Fields holding maps or arrays, mixing numeric types or with values Arrow
+    cannot type (document references, ...) are stored as JSON strings and
+    marked in the field metadata so import can decode them. Fields set to
+    None are listed per document in NULLS_COLUMN, since a null cell
+    otherwise just means the document lacks the field.
+    """
+    import pyarrow as pa
+
+    names = [ID_COLUMN]
+    for row in rows:
+        for name in row:
+            if name not in names:
+                names.append(name)
+
+    arrays, fields = [], []
+    for name in names:
+        values = [_normalize(row.get(name)) for row in rows]
+        try:
+            if _needs_json(values):
+                raise TypeError("stored as JSON")
+            array = pa.array(values)
+            field = pa.field(name, array.type)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError, ValueError, OverflowError):
+            array = pa.array([None if v is None else json.dumps(v, default=_json_default) for v in values],
+                             pa.string())
+            field = pa.field(name, pa.string(), metadata={b'encoding': b'json'})
+        arrays.append(array)
+        fields.append(field)
+
+    nulls = [[name for name, value in row.items() if value is None] or None for row in rows]
+    if any(nulls):
+        arrays.append(pa.array(nulls, pa.list_(pa.string())))
+        fields.append(pa.field(NULLS_COLUMN, pa.list_(pa.string())))
+    return pa.Table.from_arrays(arrays, schema=pa.schema(fields))
+
+
+def _from_table(table) -> List[Dict[str, Any]]:
+    """Documents of a chunk; nulls are dropped unless the field was set to None"""
+    json_columns = {
+        field.name for field in table.schema
+        if field.metadata and field.metadata.get(b'encoding') == b'json'
+    }
+    docs = []
+    for row in table.to_pylist():
+        doc = {name: None for name in row.pop(NULLS_COLUMN, None) or ()}
+        for name, value in row.items():
+            if value is None:
+                continue
+            doc[name] = json.loads(value, object_hook=_json_object) if name in json_columns else value
+        docs.append(doc)
+    return docs
+
+
+def _write_chunk(rows: List[Dict[str, Any]], path: str, compression: str) -> int:
+    import pyarrow.parquet as pq
+    pq.write_table(_to_table(rows), path, compression=compression)
+    return len(rows)
+
+
+def _export_collection(db, name: str, out_dir: str, chunk_rows: int, page_size: int, compression: str,
+                       pool: ThreadPoolExecutor) -> Dict[str, Any]:
+    """
+    Page through one collection in document-id order, handing every full
+    chunk to the pool for encoding and compression while the next pages load
+    """
+    collection = db.collection(name)
+    pending, rows, last = [], [], None
+    while True:
+        query = collection.order_by('__name__').limit(page_size)
+        if last is not None:
+            query = query.start_after(last)
+        docs = list(query.stream())
+        FIRESTORE_READS.inc(len(docs), collection=name)
+        for doc in docs:
+            rows.append({ID_COLUMN: doc.id, **doc.to_dict()})
+        if docs:
+            last = docs[-1]
+        while len(rows) >= chunk_rows or (rows and len(docs) < page_size):
+            chunk, rows = rows[:chunk_rows], rows[chunk_rows:]
+            filename = f"{name}-{len(pending):05d}.parquet"
+            pending.append((filename, pool.submit(_write_chunk, chunk, os.path.join(out_dir, filename), compression)))
+        if len(docs) < page_size:
+            break
+
+    files = [{"file": filename, "rows": future.result()} for filename, future in pending]
+    return {"documents": sum(f["rows"] for f in files), "files": files}
+
+
+def export_collections(db, out_dir: str, collections=COLLECTIONS, chunk_rows: int = 50000,
+                       page_size: int = 1000, compression: str = 'zstd', workers: int = 4) -> Dict[str, Any]:
+    """
+    Dump collections to compressed, chunked Parquet files
+
+    Collections are read concurrently and chunks are encoded on a thread
+    pool (Arrow releases the GIL while compressing). A manifest listing every
+    chunk is written last, so an export without one is incomplete.
+
+    Args:
+        db: Firestore client
+        out_dir: Directory for the chunks and manifest
+        collections: Collections to export
+        chunk_rows: Documents per Parquet file
+        page_size: Documents per Firestore read
+        compression: Parquet codec
+        workers: Threads encoding chunks
+    """
+    import pyarrow as pa
+
+    started = time.time()
+    if not pa.Codec.is_available(compression):
+        return {"status": "error", "error": f"pyarrow was built without the {compression} codec; "
+                                            f"pass --compression snappy or install a pyarrow wheel with it"}
+    os.makedirs(out_dir, exist_ok=True)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool, \
+                ThreadPoolExecutor(max_workers=len(collections)) as readers:
+            futures = {
+                name: readers.submit(_export_collection, db, name, out_dir, chunk_rows, page_size, compression, pool)
+                for name in collections
+            }
+            exported = {name: future.result() for name, future in futures.items()}
+
+        manifest = {
+            "exported_at": datetime.now(timezone.utc).isoformat(),
+            "format": "parquet",
+            "compression": compression,
+            "collections": exported
+        }
+        with open(os.path.join(out_dir, MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+        counts = {name: info["documents"] for name, info in exported.items()}
+        logger.info(f"Exported {counts} to {out_dir} in {time.time() - started:.1f}s")
+        return {"status": "success", "documents": counts, "seconds": round(time.time() - started, 2)}
+    except Exception as e:
+        logger.error(f"Error exporting collections: {str(e)}")
+        return {"status": "error", "error": str(e)}
+
+
+def _commit(db, name: str, docs: List[Dict[str, Any]]) -> int:
+    batch = db.batch()
+    collection = db.collection(name)
+    for doc in docs:
+        doc_id = doc.pop(ID_COLUMN, None)
+        ref = collection.document(doc_id) if doc_id else collection.document()
+        batch.set(ref, doc)
+    batch.commit()
+    return len(docs)
+
+
+def import_collections(db, in_dir: str, collections=None, batch_size: int = MAX_BATCH,
+                       workers: int = 8) -> Dict[str, Any]:
+    """
+    Load an export back with batched writes, keeping document ids
+
+    Chunks are decoded one at a time and their batches committed on a
+    thread pool, finishing a chunk before the next is read so at most one
+    chunk is held in memory; existing documents with the same ids are
+    overwritten.
+
+    Args:
+        db: Firestore client (or the emulator, see connect())
+        in_dir: Directory of a complete export
+        collections: Subset of the exported collections to load
+        batch_size: Writes per batch (at most 500)
+        workers: Batches committed concurrently
+    """
+    import pyarrow.parquet as pq
+
+    started = time.time()
+    batch_size = min(batch_size, MAX_BATCH)
+    try:
+        with open(os.path.join(in_dir, MANIFEST)) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return {"status": "error", "error": f"No {MANIFEST} in {in_dir}; the export is incomplete"}
+
+    counts: Dict[str, int] = {}
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for name, info in manifest["collections"].items():
+                if collections and name not in collections:
+                    continue
+                counts[name] = 0
+                for chunk in info["files"]:
+                    docs = _from_table(pq.read_table(os.path.join(in_dir, chunk["file"])))
+                    futures = [pool.submit(_commit, db, name, docs[i:i + batch_size])
+                               for i in range(0, len(docs), batch_size)]
+                    counts[name] += sum(future.result() for future in futures)
+                logger.info(f"Imported {counts[name]} documents into {name}")
+        return {"status": "success", "documents": counts, "seconds": round(time.time() - started, 2)}
+    except Exception as e:
+        logger.error(f"Error importing collections: {str(e)}")
+        return {"status": "error", "documents": counts, "error": str(e)}
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export/import Firestore collections as compressed Parquet chunks")
+    parser.add_argument('--emulator', default=None, help="Firestore emulator host:port (or set FIRESTORE_EMULATOR_HOST)")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help="Dump collections to a directory")
+    export_parser.add_argument('out_dir')
+    export_parser.add_argument('--collections', nargs='+', default=list(COLLECTIONS))
+    export_parser.add_argument('--chunk-rows', type=int, default=50000, help="Documents per file")
+    export_parser.add_argument('--compression', default='zstd')
+    export_parser.add_argument('--workers', type=int, default=4)
+
+    import_parser = subparsers.add_parser('import', help="Load an export into Firestore")
+    import_parser.add_argument('in_dir')
+    import_parser.add_argument('--collections', nargs='+', default=None)
+    import_parser.add_argument('--batch-size', type=int, default=MAX_BATCH)
+    import_parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    db = connect(args.emulator)
+    if args.command == 'export':
+        result = export_collections(db, args.out_dir, args.collections, chunk_rows=args.chunk_rows,
+                                    compression=args.compression, workers=args.workers)
+    else:
+        result = import_collections(db, args.in_dir, args.collections, batch_size=args.batch_size,
+                                    workers=args.workers)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
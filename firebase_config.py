@@ -1,25 +1,58 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
 import os
+import threading
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
 
+_lock = threading.Lock()
+_app = None
+_db = None
+
 def initialize_firebase():
     """Initialize Firebase Admin SDK"""
+    import firebase_admin
+    from firebase_admin import credentials
+
     credentials_path = os.environ.get('FIREBASE_CREDENTIALS_PATH')
-    
+
     if not credentials_path:
         raise ValueError("FIREBASE_CREDENTIALS_PATH environment variable is not set")
-    
+
     if not os.path.exists(credentials_path):
         raise ValueError(f"Firebase credentials file not found at: {credentials_path}")
-    
+
     print(f"Loading Firebase credentials from: {credentials_path}")
     cred = credentials.Certificate(credentials_path)
-    firebase_admin.initialize_app(cred)
-    return firestore.client()
+    return firebase_admin.initialize_app(cred)
+
+def get_app():
+    """The Firebase app, initialized on first use"""
+    global _app
+    if _app is None:
+        with _lock:
+            if _app is None:
+                _app = initialize_firebase()
+    return _app
+
+def get_db():
+    """
+    Firestore client, created on first use
+
+    Importing this module no longer loads firebase_admin or reads the
+    credentials, so processes that never touch Firestore start faster.
+    """
+    global _db
+    if _db is None:
+        app = get_app()
+        with _lock:
+            if _db is None:
+                from firebase_admin import firestore
+                _db = firestore.client(app)
+    return _db
 
-# Initialize Firestore client
-db = initialize_firebase()
\ No newline at end of file
+def __getattr__(name):
+    # `from backend.firebase_config import db` keeps working, resolved lazily
+    if name == 'db':
+        return get_db()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,294 @@
+import math
+import time
+from dataclasses import dataclass
+from datetime import date, datetime
+from statistics import NormalDist
+from typing import Dict, List, Any, Optional, Sequence
+
+import numpy as np
+
+# Smoothing constants tried for every product; the best one-step-ahead fit wins
+DEFAULT_ALPHAS = (0.05, 0.1, 0.2, 0.3, 0.5)
+
+# Average demand interval above which demand counts as intermittent (Syntetos-Boylan)
+INTERMITTENT_ADI = 1.32
+
+SECONDS_PER_DAY = 86400
+
+
+@dataclass
+class ForecastResult:
+    """Per-product forecast arrays, aligned with the product ids passed in"""
+    product_ids: List[str]
+    daily_demand: np.ndarray      # Expected units per day (seasonally averaged)
+    lead_time_demand: np.ndarray  # Expected units over the lead time
+    safety_stock: np.ndarray
+    reorder_point: np.ndarray
+    order_quantity: np.ndarray    # Units to order now (0 unless at or below the reorder point)
+    days_of_cover: np.ndarray     # Days current stock lasts at the forecast rate (inf if no demand)
+    error_std: np.ndarray         # Std of one-step-ahead forecast errors
+    alpha: np.ndarray
+    intermittent: np.ndarray      # True where Croston was used instead of SES
+
+    def to_dict(self, index: int) -> Dict[str, Any]:
+        cover = float(self.days_of_cover[index])
+        return {
+            "daily_demand": round(float(self.daily_demand[index]), 3),
+            "lead_time_demand": round(float(self.lead_time_demand[index]), 2),
+            "safety_stock": round(float(self.safety_stock[index]), 2),
+            "reorder_point": round(float(self.reorder_point[index]), 2),
+            "order_quantity": int(self.order_quantity[index]),
+            "days_of_cover": None if math.isinf(cover) else round(cover, 1),
+            "model": "croston" if self.intermittent[index] else "ses",
+            "alpha": float(self.alpha[index])
+        }
+
+
+def to_timestamp(value) -> Optional[float]:
+    if hasattr(value, 'timestamp'):
+        return value.timestamp()
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value).timestamp()
+        except ValueError:
+            return None
+    return None
+
+
+def day_number(ts: float) -> int:
+    """Local calendar day of a timestamp, as a proleptic Gregorian ordinal"""
+    return date.fromtimestamp(ts).toordinal()
+
+
+def demand_matrix(sales: List[Dict], product_ids: Sequence[str], history_days: int = 56,
+                  now: Optional[float] = None) -> np.ndarray:
+    """
+    Units sold per product per calendar day over the last `history_days` days
+
+    Returns:
+        (products, days) array; the last column is today
+    """
+    today = day_number(time.time() if now is None else now)
+    index = {product_id: row for row, product_id in enumerate(product_ids)}
+    rows, days, quantities = [], [], []
+    for sale in sales:
+        row = index.get(sale.get('product_id'))
+        if row is None:
+            continue
+        ts = to_timestamp(sale.get('selling_date'))
+        if ts is None:
+            continue
+        age = today - day_number(ts)
+        if 0 <= age < history_days:
+            rows.append(row)
+            days.append(history_days - 1 - age)
+            quantities.append(sale.get('quantity_sold', 0) or 0)
+
+    matrix = np.zeros((len(product_ids), history_days), dtype=np.float64)
+    if rows:
+        np.add.at(matrix, (np.asarray(rows), np.asarray(days)), np.asarray(quantities, dtype=np.float64))
+    return matrix
+
+
+def weekly_profile(demand: np.ndarray, last_weekday: int, shrinkage_weeks: float = 4.0) -> np.ndarray:
+    """
+    Multiplicative day-of-week indices per product
+
+    Indices are shrunk towards 1 when there are few weeks of history, so a
+    single busy Saturday does not become a permanent pattern.
+
+    Args:
+        demand: (products, days) matrix
+        last_weekday: Weekday (Monday=0) of the last column
+
+    Returns:
+        (products, 7) array of indices averaging 1
+    """
+    num_products, num_days = demand.shape
+    weekdays = (last_weekday - (num_days - 1 - np.arange(num_days))) % 7
+    sums = np.zeros((num_products, 7))
+    counts = np.bincount(weekdays, minlength=7).astype(np.float64)
+    for weekday in range(7):
+        sums[:, weekday] = demand[:, weekdays == weekday].sum(axis=1)
+    means = sums / np.maximum(counts, 1)
+    overall = means.mean(axis=1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        raw = np.where(overall > 0, means / overall, 1.0)
+    weight = (num_days / 7) / (num_days / 7 + shrinkage_weeks)
+    return 1.0 + weight * (raw - 1.0)
+
+
+def fit_ses(demand: np.ndarray, alphas: Sequence[float] = DEFAULT_ALPHAS, warmup: int = 7):
+    """
+    Simple exponential smoothing for every product and alpha at once
+
+    Returns:
+        (level, error_std, alpha) arrays per product, using each product's
+        best alpha by one-step-ahead squared error
+    """
+    a = np.asarray(alphas, dtype=np.float64)[:, None]
+    num_products, num_days = demand.shape
+    warmup = min(warmup, num_days)
+    level = np.broadcast_to(demand[:, :max(warmup, 1)].mean(axis=1), (len(a), num_products)).copy()
+    sse = np.zeros((len(a), num_products))
+    for t in range(warmup, num_days):
+        error = demand[:, t] - level
+        sse += error * error
+        level += a * error
+    best = np.argmin(sse, axis=0)
+    columns = np.arange(num_products)
+    steps = max(num_days - warmup, 1)
+    return level[best, columns], np.sqrt(sse[best, columns] / steps), a[best, 0]
+
+
+def fit_croston(demand: np.ndarray, alphas: Sequence[float] = DEFAULT_ALPHAS):
+    """
+    Croston's method with the Syntetos-Boylan bias correction, for every
+    product and alpha at once
+
+    Sizes of non-zero demands and the intervals between them are smoothed
+    separately; the daily rate is size / interval.
+
+    Returns:
+        (rate, error_std, alpha) arrays per product
+    """
+    a = np.asarray(alphas, dtype=np.float64)[:, None]
+    num_products, num_days = demand.shape
+    nonzero = demand > 0
+    occurrences = nonzero.sum(axis=1)
+    first_size = np.where(occurrences > 0, demand.sum(axis=1) / np.maximum(occurrences, 1), 0.0)
+    first_interval = np.where(occurrences > 0, num_days / np.maximum(occurrences, 1), float(num_days))
+
+    size = np.broadcast_to(first_size, (len(a), num_products)).copy()
+    interval = np.broadcast_to(first_interval, (len(a), num_products)).copy()
+    since_last = np.ones(num_products)
+    sse = np.zeros((len(a), num_products))
+    correction = 1 - a / 2
+    for t in range(num_days):
+        rate = correction * size / interval
+        error = demand[:, t] - rate
+        sse += error * error
+        hit = nonzero[:, t]
+        size = np.where(hit, size + a * (demand[:, t] - size), size)
+        interval = np.where(hit, interval + a * (since_last - interval), interval)
+        since_last = np.where(hit, 1.0, since_last + 1.0)
+    best = np.argmin(sse, axis=0)
+    columns = np.arange(num_products)
+    rate = (correction * size / interval)[best, columns]
+    return rate, np.sqrt(sse[best, columns] / max(num_days, 1)), a[best, 0]
+
+
+def forecast(demand: np.ndarray, stock: np.ndarray, lead_time_days: float = 3, review_days: float = 7,
+             service_level: float = 0.95, last_weekday: Optional[int] = None,
+             alphas: Sequence[float] = DEFAULT_ALPHAS, product_ids: Optional[List[str]] = None,
+             active_days: Optional[np.ndarray] = None) -> ForecastResult:
+    """
+    Fit every product's demand model and derive reorder points and quantities
+
+    Smooth products use SES on deseasonalized demand; intermittent products
+    (average demand interval above 1.32 days) use Croston. Safety stock is
+    z(service_level) times the one-step forecast error scaled by the square
+    root of the exposure period. An order is suggested once stock is at or
+    below the reorder point, sized to cover lead time plus the review period.
+
+    Args:
+        demand: (products, days) daily demand matrix, most recent day last
+        stock: Units on hand per product
+        lead_time_days: Days from order to delivery
+        review_days: Days until stock is next reviewed
+        service_level: Target probability of not stocking out before delivery
+        last_weekday: Weekday (Monday=0) of the last column, for weekly seasonality
+        active_days: Days each product has been stocked, if shorter than the
+            history; earlier days are filled with the product's average so
+            new products are not forecast low
+    """
+    demand = np.array(demand, dtype=np.float64)
+    stock = np.asarray(stock, dtype=np.float64)
+    num_products, num_days = demand.shape
+    if last_weekday is None:
+        last_weekday = datetime.now().weekday()
+    if active_days is None:
+        active_days = np.full(num_products, num_days)
+    active_days = np.clip(np.asarray(active_days, dtype=np.int64), 1, num_days)
+
+    nonzero_days = (demand > 0).sum(axis=1)
+    with np.errstate(divide='ignore'):
+        adi = np.where(nonzero_days > 0, active_days / np.maximum(nonzero_days, 1), np.inf)
+    intermittent = adi > INTERMITTENT_ADI
+
+    inactive = np.arange(num_days)[None, :] < (num_days - active_days)[:, None]
+    if inactive.any():
+        average = demand.sum(axis=1) / active_days
+        demand = np.where(inactive, average[:, None], demand)
+
+    profile = weekly_profile(demand, last_weekday)
+    # Intermittent series are too sparse for a weekly pattern
+    profile[intermittent] = 1.0
+    weekdays = (last_weekday - (num_days - 1 - np.arange(num_days))) % 7
+    deseasonalized = demand / np.maximum(profile[:, weekdays], 1e-6)
+
+    level, level_std, level_alpha = fit_ses(deseasonalized, alphas)
+    rate, rate_std, rate_alpha = fit_croston(demand, alphas)
+    base = np.maximum(np.where(intermittent, rate, level), 0.0)
+    error_std = np.where(intermittent, rate_std, level_std)
+    alpha = np.where(intermittent, rate_alpha, level_alpha)
+
+    # Expected demand over the next n days follows the weekly pattern
+    def horizon_demand(days: float) -> np.ndarray:
+        whole = int(math.ceil(days))
+        future = (last_weekday + 1 + np.arange(whole)) % 7
+        weights = np.ones(whole)
+        if whole > days:
+            weights[-1] = days - (whole - 1)
+        return base * (profile[:, future] * weights).sum(axis=1)
+
+    z = NormalDist().inv_cdf(service_level)
+    lead_time_demand = horizon_demand(lead_time_days)
+    safety_stock = z * error_std * math.sqrt(lead_time_days)
+    reorder_point = lead_time_demand + safety_stock
+    order_up_to = horizon_demand(lead_time_days + review_days) + z * error_std * math.sqrt(lead_time_days + review_days)
+    order_quantity = np.where(stock <= reorder_point, np.ceil(np.maximum(order_up_to - stock, 0.0)), 0.0)
+
+    daily_demand = base * profile.mean(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        days_of_cover = np.where(daily_demand > 0, stock / np.maximum(daily_demand, 1e-12), np.inf)
+
+    return ForecastResult(
+        product_ids=list(product_ids) if product_ids is not None else [str(i) for i in range(num_products)],
+        daily_demand=daily_demand,
+        lead_time_demand=lead_time_demand,
+        safety_stock=safety_stock,
+        reorder_point=reorder_point,
+        order_quantity=order_quantity.astype(np.int64),
+        days_of_cover=days_of_cover,
+        error_std=error_std,
+        alpha=alpha,
+        intermittent=intermittent
+    )
+
+
+def forecast_products(products: List[Dict], sales: List[Dict], history_days: int = 56,
+                      now: Optional[datetime] = None, base_demand: Optional[np.ndarray] = None,
+                      **kwargs) -> ForecastResult:
+    """
+    Forecast every product with a barcode from raw Firestore products and sales
+
+    Args:
+        base_demand: Optional (products, history_days) demand already
+            aggregated elsewhere (e.g. an analytics snapshot); `sales` are
+            then only the sales on top of it
+    """
+    now = now or datetime.now()
+    products = [p for p in products if 'barcode_id' in p]
+    product_ids = [p['barcode_id'] for p in products]
+    stock = np.array([p.get('quantity', 0) or 0 for p in products], dtype=np.float64)
+    active_days = np.full(len(products), history_days)
+    for i, product in enumerate(products):
+        entered = to_timestamp(product.get('entry_date'))
+        if entered is not None:
+            active_days[i] = min(history_days, int((now.timestamp() - entered) // SECONDS_PER_DAY) + 1)
+    demand = demand_matrix(sales, product_ids, history_days, now=now.timestamp())
+    if base_demand is not None:
+        demand += base_demand
+    return forecast(demand, stock, last_weekday=now.weekday(), product_ids=product_ids,
+                    active_days=active_days, **kwargs)
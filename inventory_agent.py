@@ -1,11 +1,14 @@
 import time
-import threading
 import asyncio
-import json
+import functools
 import os
 import logging
-from datetime import datetime, timedelta
-from typing import Dict, List, Any
+from datetime import datetime
+
+from notification_store import NotificationStore
+from scheduler import AsyncScheduler
+from metrics_exporter import AGENT_CHECK_DURATION, start_http_server
+from analytics_snapshot import load_latest
 
 # Set up logging
 logging.basicConfig(
@@ -22,39 +25,132 @@ class InventoryAgent:
     """
     AI Agent that monitors inventory and generates notifications
     """
-    def __init__(self, chat_service):
+    def __init__(self, chat_service, max_notifications=500, notification_max_age_days=30, shard_coordinator=None,
+                 delivery_pipeline=None, history_store=None, history_retention_days=30,
+                 materialize_analytics=False):
+        """
+        Args:
+            chat_service: InventoryChatService used to read inventory and build notifications
+            max_notifications: Number of notifications kept in the local store
+            notification_max_age_days: Age after which stored notifications are dropped
+            shard_coordinator: Optional sharding.ShardCoordinator; when set this agent
+                only checks the partitions it holds a lease for
+            delivery_pipeline: Optional notification_delivery.DeliveryPipeline that
+                pushes newly added notifications to staff
+            history_store: Optional chat_history.ChatHistoryStore; when set, chat
+                turns older than history_retention_days are archived daily
+            history_retention_days: Days of chat history kept in Firestore
+            materialize_analytics: Rebuild the daily analytics snapshot once a day
+                (and at start) so checks only read the sales made since
+        """
         self.chat_service = chat_service
+        self.shard_coordinator = shard_coordinator
+        self.delivery_pipeline = delivery_pipeline
+        self.history_store = history_store
+        self.history_retention_days = history_retention_days
+        self.materialize_analytics = materialize_analytics
         self.is_running = False
-        self.agent_thread = None
+        self.scheduler = None
         self.check_interval = 3600  # Default: check every hour
-        self.notification_storage_path = os.path.join(os.path.dirname(__file__), '..', 'data', 'notifications.json')
         
-        # Create data directory if it doesn't exist
-        os.makedirs(os.path.dirname(self.notification_storage_path), exist_ok=True)
+        # Each check type runs as its own scheduled job at its own cadence;
+        # low stock only reads products, so it is cheap enough to run more often;
+        # expiry only reads the lots that are due
+        self.check_intervals = {
+            'low_stock': 900,
+            'velocity': 3600,
+            'expiry': 3600,
+        }
+        self.check_jitter = 0.1  # Spread runs by +/-10% of the interval
+        self.top_sellers_interval = 7 * 86400  # Weekly best-sellers summary
+        
+        # Event-driven mode: Firestore listeners mark products dirty and a
+        # debounced flush re-evaluates only those products
+        self.event_driven = False
+        self.debounce_seconds = 2.0  # Quiet period before evaluating a burst
+        self.max_debounce_seconds = 10.0  # Upper bound on delay during sustained bursts
+        self._listeners = []
+        self._snapshots_seen = set()
+        self._pending_products = set()
+        self._pending_since = None
+        self._debounce_handle = None
+        self._flush_lock = None
+        self._flush_tasks = set()
         
-        # Load existing notifications if file exists
-        self.notifications = []
-        self.load_notifications()
+        data_dir = os.path.join(os.path.dirname(__file__), '..', 'data')
+        if shard_coordinator:
+            # Workers may share a machine, so each keeps its own journal
+            self.notification_storage_path = os.path.join(data_dir, f'notifications-{shard_coordinator.worker_id}.jsonl')
+        else:
+            self.notification_storage_path = os.path.join(data_dir, 'notifications.jsonl')
+        
+        # Load existing notifications from the journal (importing the old
+        # notifications.json on first run)
+        self.notification_store = NotificationStore(
+            self.notification_storage_path,
+            max_count=max_notifications,
+            max_age_days=notification_max_age_days,
+            legacy_path=os.path.join(data_dir, 'notifications.json')
+        )
         
         logger.info("Inventory Agent initialized")
     
-    def start(self, check_interval=None):
-        """Start the agent in the background"""
+    def start(self, check_interval=None, event_driven=False, check_intervals=None):
+        """
+        Start the agent in the background
+        
+        Args:
+            check_interval: Run every check type at this interval (seconds)
+            event_driven: Also subscribe to product and sale changes and emit
+                notifications within seconds; the periodic checks keep running
+                as a fallback
+            check_intervals: Per check type intervals, e.g. {'low_stock': 300}
+        """
         if check_interval:
             self.check_interval = check_interval
+            self.check_intervals = {name: check_interval for name in self.check_intervals}
+        if check_intervals:
+            self.check_intervals.update(check_intervals)
             
         if self.is_running:
             logger.warning("Agent is already running")
             return
             
         self.is_running = True
-        self.agent_thread = threading.Thread(target=self._monitoring_loop)
-        self.agent_thread.daemon = True
-        self.agent_thread.start()
-        logger.info(f"Inventory monitoring started with interval of {self.check_interval} seconds")
         
-        # Run an immediate check
-        threading.Thread(target=self._run_check).start()
+        # One long-lived event loop runs every check; each job is scheduled
+        # only after its previous run finishes, so checks never overlap
+        self.scheduler = AsyncScheduler(name="inventory-agent")
+        if self.shard_coordinator:
+            # Take partitions before the first checks run, then keep leases fresh
+            self._shard_heartbeat_sync()
+            self.scheduler.add_job(
+                'shard_heartbeat',
+                self._shard_heartbeat,
+                self.shard_coordinator.lease_seconds / 3,
+                jitter=0.0,
+                run_immediately=False
+            )
+        for name, interval in self.check_intervals.items():
+            self.scheduler.add_job(
+                name,
+                lambda name=name: self._run_check(name),
+                interval,
+                jitter=self.check_jitter
+            )
+        if self.history_store:
+            self.scheduler.add_job('history_compaction', self._compact_history, 86400, jitter=self.check_jitter)
+        if self.materialize_analytics:
+            self.scheduler.add_job('analytics_snapshot', self._refresh_analytics, 86400, jitter=self.check_jitter)
+        self.scheduler.add_job('top_sellers', self._top_sellers, self.top_sellers_interval, jitter=self.check_jitter)
+        self.scheduler.start()
+        self.scheduler.submit(self._create_flush_lock()).result()
+        if self.delivery_pipeline:
+            self.delivery_pipeline.start()
+        logger.info(f"Inventory monitoring started with intervals {self.check_intervals}")
+        
+        if event_driven:
+            self._start_listeners()
     
     def stop(self):
         """Stop the agent"""
@@ -63,108 +159,365 @@ class InventoryAgent:
             return
             
         self.is_running = False
-        if self.agent_thread:
-            self.agent_thread.join(timeout=1.0)
+        self._stop_listeners()
+        if self.scheduler:
+            try:
+                self.scheduler.submit(self._cancel_flushes()).result(timeout=5.0)
+            except Exception as e:
+                logger.error(f"Error cancelling pending product checks: {str(e)}")
+            self.scheduler.stop()
+            self.scheduler = None
+        if self.shard_coordinator:
+            self.shard_coordinator.release()
+        if self.delivery_pipeline:
+            self.delivery_pipeline.stop()
         logger.info("Inventory monitoring stopped")
     
-    def _monitoring_loop(self):
-        """Main monitoring loop that runs checks periodically"""
-        while self.is_running:
+    def get_stats(self):
+        """Per-check timing and missed-run accounting"""
+        return {
+            "checks": self.scheduler.get_stats() if self.scheduler else {},
+            "event_driven": self.event_driven,
+            "sharding": self.shard_coordinator.get_status() if self.shard_coordinator else None,
+            "delivery": self.delivery_pipeline.get_stats() if self.delivery_pipeline else None,
+            "status": "success"
+        }
+    
+    def _shard_heartbeat_sync(self):
+        try:
+            self.shard_coordinator.heartbeat()
+        except Exception as e:
+            # Keep the partitions we had; leases expire on their own if this persists
+            logger.error(f"Shard heartbeat failed: {str(e)}")
+    
+    async def _shard_heartbeat(self):
+        # SQLite under a write lock; keep it off the loop the checks share
+        await self._in_executor(self._shard_heartbeat_sync)
+    
+    async def _in_executor(self, function, *args, **kwargs):
+        """
+        Run a blocking call (Firestore reads, SQLite writes) on the default
+        executor; on the scheduler loop a long scan would hold up the shard
+        heartbeat and debounced flushes
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(function, *args, **kwargs))
+    
+    def _owns(self, item):
+        """Whether this agent is responsible for a product or sale"""
+        return self.shard_coordinator is None or self.shard_coordinator.owns(item)
+    
+    async def _create_flush_lock(self):
+        # asyncio primitives must be created on the loop that uses them
+        self._flush_lock = asyncio.Lock()
+    
+    def _start_listeners(self):
+        """Subscribe to product and sale changes in Firestore"""
+        db = self.chat_service.db
+        self._snapshots_seen.clear()
+        try:
+            self._listeners = [
+                db.collection('products').on_snapshot(self._on_products_snapshot),
+                db.collection('sales').on_snapshot(self._on_sales_snapshot),
+            ]
+            self.event_driven = True
+            logger.info("Event-driven monitoring enabled (listening to products and sales)")
+            # Expiry checks then pop due lots from memory instead of querying
+            result = self.chat_service.start_expiry_index()
+            if result["status"] != "success":
+                logger.error(result["error"])
+        except Exception as e:
+            # Scheduled checks keep running, so just fall back to them
+            self._listeners = []
+            self.event_driven = False
+            logger.error(f"Could not start Firestore listeners, using polling only: {str(e)}")
+    
+    def _stop_listeners(self):
+        """Unsubscribe Firestore listeners and cancel any pending flush"""
+        for watch in self._listeners:
             try:
-                self._run_check()
-                
-                # Sleep for the check interval
-                for _ in range(self.check_interval):
-                    if not self.is_running:
-                        break
-                    time.sleep(1)
-                    
+                watch.unsubscribe()
             except Exception as e:
-                logger.error(f"Error in monitoring loop: {str(e)}")
-                time.sleep(60)  # Sleep for 1 minute on error
+                logger.error(f"Error unsubscribing listener: {str(e)}")
+        self._listeners = []
+        self.event_driven = False
+        self.chat_service.expiry_index.stop()
+        
+        if self.scheduler and self.scheduler.is_running:
+            self.scheduler.call_soon_threadsafe(self._clear_pending)
+    
+    def _clear_pending(self):
+        if self._debounce_handle:
+            self._debounce_handle.cancel()
+            self._debounce_handle = None
+        self._pending_products.clear()
+        self._pending_since = None
+    
+    def _is_initial_snapshot(self, collection_name):
+        """
+        The first snapshot of a listener replays every document as ADDED; the
+        immediate scheduled checks already cover that, so it is skipped
+        """
+        if collection_name in self._snapshots_seen:
+            return False
+        self._snapshots_seen.add(collection_name)
+        return True
+    
+    def _on_products_snapshot(self, docs, changes, read_time):
+        """Firestore callback for product changes"""
+        if self._is_initial_snapshot('products'):
+            return
+        product_ids = set()
+        for change in changes:
+            if change.type.name == 'REMOVED':
+                continue
+            data = change.document.to_dict() or {}
+            if self._owns(data):
+                product_ids.add(data.get('barcode_id', change.document.id))
+        self._mark_dirty(product_ids)
+    
+    def _on_sales_snapshot(self, docs, changes, read_time):
+        """Firestore callback for sale changes"""
+        if self._is_initial_snapshot('sales'):
+            return
+        product_ids = set()
+        for change in changes:
+            data = change.document.to_dict() or {}
+            if 'product_id' in data and self._owns(data):
+                product_ids.add(data['product_id'])
+        self._mark_dirty(product_ids)
+    
+    def _mark_dirty(self, product_ids):
+        """Queue products for re-evaluation; called from Firestore listener threads"""
+        if not product_ids or not self.is_running or not self.scheduler:
+            return
+        self.scheduler.call_soon_threadsafe(self._queue_products, product_ids)
+    
+    def _queue_products(self, product_ids):
+        """Add products to the pending set and (re)arm the debounce timer"""
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        self._pending_products.update(product_ids)
+        if self._pending_since is None:
+            self._pending_since = now
+        
+        if self._debounce_handle:
+            self._debounce_handle.cancel()
+        
+        # Wait for a quiet period, but never hold a burst longer than the cap
+        remaining = self.max_debounce_seconds - (now - self._pending_since)
+        delay = max(0.0, min(self.debounce_seconds, remaining))
+        self._debounce_handle = loop.call_later(delay, self._flush_pending)
+    
+    def _flush_pending(self):
+        """Evaluate all products that changed since the last flush"""
+        product_ids = list(self._pending_products)
+        self._pending_products.clear()
+        self._pending_since = None
+        self._debounce_handle = None
+        
+        if product_ids:
+            task = asyncio.get_running_loop().create_task(self._run_product_check(product_ids))
+            self._flush_tasks.add(task)
+            task.add_done_callback(self._flush_tasks.discard)
+    
+    async def _cancel_flushes(self):
+        tasks = list(self._flush_tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
     
-    def _run_check(self):
-        """Run a single inventory check"""
+    async def _run_check(self, check_type):
+        """Run a single inventory check of the given type"""
+        generators = {
+            'low_stock': 'generate_low_stock_notifications',
+            'velocity': 'generate_velocity_notifications',
+            'expiry': 'generate_expiry_notifications',
+        }
+        if check_type not in generators:
+            raise ValueError(f"Unknown check type: {check_type}")
+        generate = getattr(self.chat_service, generators[check_type])
+        
+        logger.info(f"Running {check_type} inventory check")
+        with AGENT_CHECK_DURATION.time(check=check_type):
+            if self.shard_coordinator:
+                notifications = await self._in_executor(generate, product_filter=self._owns)
+            else:
+                notifications = await self._in_executor(generate)
+        
+        if notifications.get("status") == "success":
+            await self._in_executor(self._process_new_notifications, notifications.get("notifications", []))
+            logger.info(f"Check completed: {len(notifications.get('notifications', []))} notifications generated")
+        else:
+            # Raise so the scheduler counts the run as failed
+            raise RuntimeError(f"Error generating notifications: {notifications.get('error', 'Unknown error')}")
+    
+    async def _compact_history(self):
+        """Archive old chat history; only one worker does this in sharded mode"""
+        if self.shard_coordinator and not self.shard_coordinator.is_leader:
+            return
+        with AGENT_CHECK_DURATION.time(check='history_compaction'):
+            result = await self._in_executor(self.history_store.compact, self.history_retention_days)
+        if result.get("status") != "success":
+            raise RuntimeError(f"Error compacting chat history: {result.get('error', 'Unknown error')}")
+    
+    async def _refresh_analytics(self):
+        """
+        Materialize a new analytics snapshot; in sharded mode only the leader
+        builds it and the other workers load it from the shared directory
+        """
+        if self.shard_coordinator and not self.shard_coordinator.is_leader:
+            self.chat_service.analytics = await self._in_executor(load_latest)
+            return
+        with AGENT_CHECK_DURATION.time(check='analytics_snapshot'):
+            result = await self._in_executor(self.chat_service.refresh_analytics)
+        if result.get("status") != "success":
+            raise RuntimeError(f"Error materializing analytics: {result.get('error', 'Unknown error')}")
+    
+    async def _top_sellers(self):
+        """
+        Weekly best-sellers summary; it ranks the whole catalogue, so in
+        sharded mode only the leader sends it
+        """
+        if self.shard_coordinator and not self.shard_coordinator.is_leader:
+            return
+        with AGENT_CHECK_DURATION.time(check='top_sellers'):
+            notifications = await self._in_executor(self.chat_service.generate_top_seller_notifications)
+        if notifications.get("status") != "success":
+            raise RuntimeError(f"Error generating notifications: {notifications.get('error', 'Unknown error')}")
+        await self._in_executor(self._process_new_notifications, notifications.get("notifications", []))
+    
+    async def _run_product_check(self, product_ids):
+        """Run an inventory check limited to the given products"""
         try:
-            logger.info("Running inventory check")
-            
-            # Create a new event loop for the async call
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            
-            # Run the notification generation
-            notifications = loop.run_until_complete(self.chat_service.generate_notifications())
-            
-            # Close the loop
-            loop.close()
+            # Flushes queue behind each other rather than overlapping
+            async with self._flush_lock:
+                logger.info(f"Running inventory check for {len(product_ids)} changed products")
+                with AGENT_CHECK_DURATION.time(check='event'):
+                    notifications = await self._in_executor(self.chat_service.generate_product_notifications,
+                                                            product_ids)
             
             if notifications.get("status") == "success":
-                self._process_new_notifications(notifications.get("notifications", []))
-                logger.info(f"Check completed: {len(notifications.get('notifications', []))} notifications generated")
+                await self._in_executor(self._process_new_notifications, notifications.get("notifications", []))
             else:
                 logger.error(f"Error generating notifications: {notifications.get('error', 'Unknown error')}")
                 
         except Exception as e:
-            logger.error(f"Error running inventory check: {str(e)}")
+            logger.error(f"Error running product check: {str(e)}")
     
     def _process_new_notifications(self, new_notifications):
-        """Process new notifications and save them"""
+        """
+        Process new notifications and save them; blocking (journal append and,
+        when sharded, a SQLite claim), so the loop runs it on the executor
+        """
         now = datetime.now()
         today_iso = now.date().isoformat()
         
-        # Add any new notifications that don't already exist
-        added = 0
         for notification in new_notifications:
-            # Generate a simple notification ID
-            notification_id = f"{notification['type']}_{notification.get('product_id', 'general')}_{today_iso}"
-            
-            # Check if this notification already exists for today
-            exists = False
-            for existing in self.notifications:
-                if existing.get('id') == notification_id and today_iso in existing.get('timestamp', ''):
-                    exists = True
-                    break
-            
-            if not exists:
-                # Add ID and make sure timestamp is present
-                notification['id'] = notification_id
-                if 'timestamp' not in notification:
-                    notification['timestamp'] = now.isoformat()
-                
-                # Add to the beginning of the list to show newest first
-                self.notifications.insert(0, notification)
-                added += 1
+            # One notification per type (and category, e.g. expiry) and product
+            # per day; the store drops ids it has already seen
+            kind = f"{notification['type']}_{notification['category']}" if notification.get('category') else notification['type']
+            notification['id'] = f"{kind}_{notification.get('product_id', 'general')}_{today_iso}"
+            if 'timestamp' not in notification:
+                notification['timestamp'] = now.isoformat()
         
-        # Limit to 50 most recent notifications
-        self.notifications = self.notifications[:50]
+        if self.shard_coordinator and new_notifications:
+            # Claim ids across workers so a partition moving between workers
+            # mid-day does not repeat an alert the previous owner already sent
+            claimed = set(self.shard_coordinator.claim_alerts(
+                n['id'] for n in new_notifications if n['id'] not in self.notification_store
+            ))
+            new_notifications = [n for n in new_notifications if n['id'] in claimed]
         
-        if added > 0:
-            logger.info(f"Added {added} new notifications")
-            self.save_notifications()
+        added = self.notification_store.add_many(new_notifications)
+        if added:
+            logger.info(f"Added {len(added)} new notifications")
+            if self.delivery_pipeline:
+                self.delivery_pipeline.enqueue_many(added)
+        return added
+    
+    @property
+    def notifications(self):
+        """All retained notifications, newest first"""
+        return self.notification_store.query(limit=None)
     
-    def get_notifications(self, limit=20):
-        """Get the most recent notifications"""
+    def get_notifications(self, limit=20, notification_type=None, product_id=None, since=None, until=None):
+        """
+        Get the most recent notifications
+        
+        Args:
+            limit: Maximum number of notifications to return
+            notification_type: Only return notifications of this type (warning, alert, info)
+            product_id: Only return notifications for this product
+            since: Only return notifications at or after this time (datetime or ISO string)
+            until: Only return notifications at or before this time (datetime or ISO string)
+        """
         return {
-            "notifications": self.notifications[:limit],
+            "notifications": self.notification_store.query(
+                limit=limit,
+                notification_type=notification_type,
+                product_id=product_id,
+                since=since,
+                until=until
+            ),
             "status": "success"
         }
+
+def main():
+    """Run the agent as a standalone worker process"""
+    import argparse
+    from chat_service import InventoryChatService
+    from sharding import ShardCoordinator
+    from notification_delivery import DeliveryPipeline, FCMTransport
+    from chat_history import ChatHistoryStore
     
-    def save_notifications(self):
-        """Save notifications to disk"""
-        try:
-            with open(self.notification_storage_path, 'w') as f:
-                json.dump(self.notifications, f)
-        except Exception as e:
-            logger.error(f"Error saving notifications: {str(e)}")
+    parser = argparse.ArgumentParser(description="Inventory monitoring agent")
+    parser.add_argument('--event-driven', action='store_true', help="React to Firestore changes within seconds")
+    parser.add_argument('--interval', type=int, default=None, help="Run every check at this interval (seconds)")
+    parser.add_argument('--shard-db', default=None, help="Shared SQLite file for sharded mode")
+    parser.add_argument('--partitions', type=int, default=16, help="Number of partitions in sharded mode")
+    parser.add_argument('--partition-by', choices=['barcode', 'store'], default='barcode')
+    parser.add_argument('--worker-id', default=None)
+    parser.add_argument('--push', action='store_true', help="Push new notifications to staff through FCM")
+    parser.add_argument('--metrics-port', type=int, default=None, help="Serve OpenMetrics on this port")
+    parser.add_argument('--archive-history-days', type=int, default=None,
+                        help="Archive chat history older than this many days, once a day")
+    parser.add_argument('--materialize-analytics', action='store_true',
+                        help="Rebuild the daily sales analytics snapshot once a day")
+    parser.add_argument('--velocity-index', action='store_true',
+                        help="Keep sales velocity current from Firestore listeners instead of reading all sales per check")
+    args = parser.parse_args()
     
-    def load_notifications(self):
-        """Load notifications from disk"""
-        try:
-            if os.path.exists(self.notification_storage_path):
-                with open(self.notification_storage_path, 'r') as f:
-                    self.notifications = json.load(f)
-                logger.info(f"Loaded {len(self.notifications)} notifications from storage")
-        except Exception as e:
-            logger.error(f"Error loading notifications: {str(e)}")
-            self.notifications = []
-```
\ No newline at end of file
+    if args.metrics_port:
+        start_http_server(args.metrics_port)
+    
+    coordinator = None
+    if args.shard_db:
+        coordinator = ShardCoordinator(
+            args.shard_db,
+            num_partitions=args.partitions,
+            partition_by=args.partition_by,
+            worker_id=args.worker_id
+        )
+    
+    pipeline = DeliveryPipeline(FCMTransport()) if args.push else None
+    
+    chat_service = InventoryChatService()
+    if args.velocity_index:
+        result = chat_service.start_velocity_index()
+        if result["status"] != "success":
+            logger.error(result["error"])
+    history_store = ChatHistoryStore(chat_service.db) if args.archive_history_days else None
+    agent = InventoryAgent(chat_service, shard_coordinator=coordinator, delivery_pipeline=pipeline,
+                           history_store=history_store, history_retention_days=args.archive_history_days or 30,
+                           materialize_analytics=args.materialize_analytics)
+    agent.start(check_interval=args.interval, event_driven=args.event_driven)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        agent.stop()
+        chat_service.velocity_index.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+import json
+import os
+import socket
+import sqlite3
+import time
+import uuid
+import logging
+from contextlib import contextmanager
+from typing import Dict, Any, Iterable, Optional, Tuple
+
+logger = logging.getLogger("JobQueue")
+
+DEFAULT_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'jobs.db')
+
+
+class JobTimeout(Exception):
+    """The job was not finished in time (no worker free, or the worker is too slow)"""
+
+
+class JobFailed(Exception):
+    """The worker raised while running the job"""
+
+
+class JobQueue:
+    """
+    Local job queue shared by the API processes and the feature workers
+
+    Jobs live in a SQLite file. Workers claim the oldest queued job of their
+    kind under a lease; if a worker dies mid-job its lease runs out and the
+    job is claimed again, up to max_attempts. Submitters poll for the result,
+    which at the sizes involved (one audio clip or image per job) costs far
+    less than the work itself.
+    """
+    def __init__(self, db_path: Optional[str] = None, worker_id: Optional[str] = None,
+                 lease_seconds: float = 120.0, max_attempts: int = 2):
+        """
+        Args:
+            db_path: Path of the SQLite queue file (defaults to JOB_QUEUE_DB or data/jobs.db)
+            worker_id: Id recorded on claimed jobs (defaults to host, pid and a random suffix)
+            lease_seconds: How long a worker may hold a job before it is handed out again
+            max_attempts: Claims per job before it is failed
+        """
+        self.db_path = db_path or os.environ.get('JOB_QUEUE_DB', DEFAULT_PATH)
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        with self._transaction() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL,
+                payload BLOB,
+                params TEXT,
+                result TEXT,
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                worker TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                lease_until REAL
+            )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_queued ON jobs (kind, status, created_at)")
+
+    @contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front so claiming is atomic
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+
+    def submit(self, kind: str, payload: bytes = b'', params: Optional[Dict[str, Any]] = None) -> str:
+        """Queue a job and return its id"""
+        job_id = uuid.uuid4().hex
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, status, payload, params, created_at) VALUES (?, ?, 'queued', ?, ?, ?)",
+                (job_id, kind, sqlite3.Binary(payload), json.dumps(params or {}), time.time())
+            )
+        return job_id
+
+    def claim(self, kinds: Iterable[str]) -> Optional[Tuple[str, str, bytes, Dict[str, Any]]]:
+        """
+        Take the oldest queued job of the given kinds
+
+        Jobs whose worker let the lease run out are queued again first.
+
+        Returns:
+            (job_id, kind, payload, params), or None if there is nothing to do
+        """
+        kinds = list(kinds)
+        marks = ",".join("?" * len(kinds))
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                f"UPDATE jobs SET status = 'failed', error = 'Worker lost too many times', finished_at = ? "
+                f"WHERE status = 'running' AND lease_until < ? AND attempts >= ? AND kind IN ({marks})",
+                (now, now, self.max_attempts, *kinds)
+            )
+            conn.execute(
+                f"UPDATE jobs SET status = 'queued', worker = NULL "
+                f"WHERE status = 'running' AND lease_until < ? AND kind IN ({marks})",
+                (now, *kinds)
+            )
+            row = conn.execute(
+                f"SELECT id, kind, payload, params FROM jobs WHERE status = 'queued' AND kind IN ({marks}) "
+                f"ORDER BY created_at LIMIT 1",
+                kinds
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1, started_at = ?, "
+                "lease_until = ? WHERE id = ?",
+                (self.worker_id, now, now + self.lease_seconds, row[0])
+            )
+        return row[0], row[1], bytes(row[2] or b''), json.loads(row[3] or '{}')
+
+    def complete(self, job_id: str, result: Any):
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'done', result = ?, payload = NULL, finished_at = ? "
+                "WHERE id = ? AND worker = ?",
+                (json.dumps(result, default=str), time.time(), job_id, self.worker_id)
+            )
+
+    def fail(self, job_id: str, error: str):
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, payload = NULL, finished_at = ? "
+                "WHERE id = ? AND worker = ?",
+                (error, time.time(), job_id, self.worker_id)
+            )
+
+    def cancel(self, job_id: str):
+        """Drop a job nobody is waiting for any more, unless a worker already has it"""
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM jobs WHERE id = ? AND status = 'queued'", (job_id,))
+
+    def wait(self, job_id: str, timeout: float = 30.0, poll_interval: float = 0.05) -> Any:
+        """
+        Block until a job finishes and return its result
+
+        Raises:
+            JobFailed: The worker reported an error
+            JobTimeout: Not finished within timeout; a still-queued job is cancelled
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            try:
+                row = conn.execute("SELECT status, result, error FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            finally:
+                conn.close()
+            if row is None:
+                raise JobFailed(f"Job {job_id} no longer exists")
+            status, result, error = row
+            if status == 'done':
+                return json.loads(result)
+            if status == 'failed':
+                raise JobFailed(error or "Job failed")
+            if time.monotonic() >= deadline:
+                self.cancel(job_id)
+                raise JobTimeout(f"Job {job_id} not finished within {timeout:g}s")
+            time.sleep(poll_interval)
+
+    def run(self, kind: str, payload: bytes = b'', params: Optional[Dict[str, Any]] = None,
+            timeout: float = 30.0) -> Any:
+        """Submit a job and wait for its result"""
+        return self.wait(self.submit(kind, payload, params), timeout=timeout)
+
+    def purge(self, older_than_seconds: float = 3600.0) -> int:
+        """Delete finished jobs older than the given age"""
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+                (time.time() - older_than_seconds,)
+            )
+            return cursor.rowcount
+
+    def get_stats(self) -> Dict[str, Any]:
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            counts: Dict[str, Dict[str, int]] = {}
+            for kind, status, count in conn.execute("SELECT kind, status, COUNT(*) FROM jobs GROUP BY kind, status"):
+                counts.setdefault(kind, {})[status] = count
+            oldest = conn.execute("SELECT MIN(created_at) FROM jobs WHERE status = 'queued'").fetchone()[0]
+        finally:
+            conn.close()
+        return {
+            "jobs": counts,
+            "oldest_queued_seconds": time.time() - oldest if oldest else None
+        }
@@ -0,0 +1,391 @@
+import os
+import random
+import threading
+import time
+import logging
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass
+from typing import Dict, List, Any, Callable, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics_store import LatencySketch
+
+logger = logging.getLogger("LLMClient")
+
+
+class LLMError(Exception):
+    """An LLM call failed"""
+    def __init__(self, message: str, provider: Optional[str] = None, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.provider = provider
+        self.status_code = status_code
+
+
+class LLMRateLimited(LLMError):
+    """The provider answered 429"""
+
+
+class LLMTimeout(LLMError):
+    """The call did not finish before its deadline"""
+
+
+@dataclass
+class LLMResponse:
+    text: str
+    provider: str
+    model: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    total_tokens: int = 0
+    latency: float = 0.0
+    hedged: bool = False
+
+
+def pooled_session(pool_size: int = 32) -> requests.Session:
+    """Session with a keep-alive connection pool sized for concurrent calls"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class LLMProvider(ABC):
+    """A single model endpoint"""
+    name = "provider"
+    model = ""
+
+    @abstractmethod
+    def generate(self, prompt: str, timeout: float, max_tokens: Optional[int] = None) -> LLMResponse:
+        ...
+
+
+class GeminiProvider(LLMProvider):
+    """Google Gemini over the generateContent REST API"""
+    def __init__(self, api_key: str, model: str = "gemini-1.5-flash",
+                 base_url: str = "https://generativelanguage.googleapis.com/v1beta",
+                 session: Optional[requests.Session] = None):
+        self.name = "gemini"
+        self.api_key = api_key
+        self.model = model
+        self.url = f"{base_url.rstrip('/')}/models/{model}:generateContent"
+        self.session = session or pooled_session()
+
+    def generate(self, prompt: str, timeout: float, max_tokens: Optional[int] = None) -> LLMResponse:
+        body: Dict[str, Any] = {"contents": [{"role": "user", "parts": [{"text": prompt}]}]}
+        if max_tokens:
+            body["generationConfig"] = {"maxOutputTokens": max_tokens}
+        started = time.perf_counter()
+        data = _post_json(self.session, self.url, body, timeout, self.name,
+                          params={"key": self.api_key})
+
+        candidates = data.get("candidates") or []
+        parts = candidates[0].get("content", {}).get("parts", []) if candidates else []
+        if not parts:
+            reason = (data.get("promptFeedback") or {}).get("blockReason") or \
+                (candidates[0].get("finishReason") if candidates else "no candidates")
+            raise LLMError(f"Gemini returned no text ({reason})", provider=self.name)
+
+        usage = data.get("usageMetadata", {})
+        prompt_tokens = int(usage.get("promptTokenCount", 0))
+        completion_tokens = int(usage.get("candidatesTokenCount", 0))
+        return LLMResponse(
+            text="".join(part.get("text", "") for part in parts),
+            provider=self.name,
+            model=self.model,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=int(usage.get("totalTokenCount", prompt_tokens + completion_tokens)),
+            latency=time.perf_counter() - started
+        )
+
+
+class OpenAICompatibleProvider(LLMProvider):
+    """Any OpenAI-style /chat/completions endpoint (Groq, local servers, the probe mock)"""
+    def __init__(self, base_url: str, model: str, api_key: Optional[str] = None, name: str = "openai",
+                 session: Optional[requests.Session] = None):
+        self.name = name
+        self.model = model
+        self.url = base_url.rstrip("/") + "/chat/completions"
+        self.session = session or pooled_session()
+        self.headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+
+    def generate(self, prompt: str, timeout: float, max_tokens: Optional[int] = None) -> LLMResponse:
+        body: Dict[str, Any] = {"model": self.model, "messages": [{"role": "user", "content": prompt}]}
+        if max_tokens:
+            body["max_tokens"] = max_tokens
+        started = time.perf_counter()
+        data = _post_json(self.session, self.url, body, timeout, self.name, headers=self.headers)
+
+        choices = data.get("choices") or []
+        if not choices:
+            raise LLMError("Response has no choices", provider=self.name)
+        usage = data.get("usage", {})
+        return LLMResponse(
+            text=choices[0].get("message", {}).get("content", ""),
+            provider=self.name,
+            model=data.get("model", self.model),
+            prompt_tokens=int(usage.get("prompt_tokens", 0)),
+            completion_tokens=int(usage.get("completion_tokens", 0)),
+            total_tokens=int(usage.get("total_tokens", 0)),
+            latency=time.perf_counter() - started
+        )
+
+
+class FakeProvider(LLMProvider):
+    """
+    In-process provider for tests and local runs
+
+    Answers with `respond(prompt)` after a simulated latency, failing with the
+    given probability.
+    """
+    def __init__(self, name: str = "fake", latency: float = 0.0, jitter: float = 0.0, failure_rate: float = 0.0,
+                 respond: Optional[Callable[[str], str]] = None, seed: Optional[int] = None):
+        self.name = name
+        self.model = name
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.respond = respond or (lambda prompt: f"[{name}] answer to: {prompt.strip()[-80:]}")
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def generate(self, prompt: str, timeout: float, max_tokens: Optional[int] = None) -> LLMResponse:
+        with self._lock:
+            self.calls += 1
+            delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+            fail = self._random.random() < self.failure_rate
+        if delay > timeout:
+            time.sleep(timeout)
+            raise LLMTimeout(f"{self.name} timed out", provider=self.name)
+        time.sleep(delay)
+        if fail:
+            raise LLMError(f"{self.name} simulated failure", provider=self.name, status_code=500)
+        text = self.respond(prompt)
+        prompt_tokens = max(1, len(prompt) // 4)
+        completion_tokens = max(1, len(text) // 4)
+        return LLMResponse(text, self.name, self.model, prompt_tokens, completion_tokens,
+                           prompt_tokens + completion_tokens, latency=delay)
+
+
+def _post_json(session: requests.Session, url: str, body: Dict, timeout: float, provider: str,
+               params: Optional[Dict] = None, headers: Optional[Dict] = None) -> Dict:
+    try:
+        response = session.post(url, json=body, params=params, headers=headers,
+                                timeout=(min(5.0, timeout), timeout))
+    except requests.Timeout:
+        raise LLMTimeout(f"{provider} timed out after {timeout:.1f}s", provider=provider)
+    except requests.RequestException as e:
+        raise LLMError(f"{provider} request failed: {str(e)}", provider=provider)
+    if response.status_code == 429:
+        raise LLMRateLimited(f"{provider} rate limited", provider=provider, status_code=429)
+    if response.status_code >= 400:
+        raise LLMError(f"{provider} returned HTTP {response.status_code}: {response.text[:200]}",
+                       provider=provider, status_code=response.status_code)
+    return response.json()
+
+
+class _ProviderStats:
+    """Latency over a sliding window of recent successful calls"""
+    def __init__(self, window: int = 200):
+        self.latencies = deque(maxlen=window)
+        self.sketch = LatencySketch()
+        self.calls = 0
+        self.errors = 0
+        self.hedges_won = 0
+
+    def add_latency(self, seconds: float):
+        if len(self.latencies) == self.latencies.maxlen:
+            self.sketch.remove(self.latencies[0])
+        self.latencies.append(seconds)
+        self.sketch.add(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        return self.sketch.quantiles((q,))[q]
+
+
+class LLMClient:
+    """
+    LLM client with per-call deadlines, hedging and failover across providers
+
+    The first provider is the primary. If it has not answered within its own
+    recent `hedge_quantile` latency, the same prompt is also sent to the next
+    provider and whichever answers first wins. If the primary fails outright,
+    the remaining providers are tried in order while the deadline allows.
+    """
+    def __init__(self, providers: List[LLMProvider], deadline: float = 30.0, hedge_quantile: Optional[float] = 0.95,
+                 hedge_min_samples: int = 20, max_workers: int = 32):
+        """
+        Args:
+            providers: Primary first, then fallbacks
+            deadline: Default seconds allowed per generate call
+            hedge_quantile: Primary latency quantile after which a hedge is sent (None disables hedging)
+            hedge_min_samples: Primary calls needed before hedging kicks in
+            max_workers: Maximum concurrent provider calls
+        """
+        if not providers:
+            raise ValueError("At least one LLM provider is required")
+        self.providers = providers
+        self.deadline = deadline
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-call")
+        self._lock = threading.Lock()
+        self._stats = {p.name: _ProviderStats() for p in providers}
+        self.hedges = 0
+        self.failovers = 0
+
+    @property
+    def primary(self) -> LLMProvider:
+        return self.providers[0]
+
+    def generate(self, prompt: str, deadline: Optional[float] = None, max_tokens: Optional[int] = None) -> LLMResponse:
+        """
+        Answer a prompt, hedging or failing over as needed
+
+        Raises:
+            LLMTimeout: no provider answered before the deadline
+            LLMError: every provider failed
+        """
+        started = time.monotonic()
+        expires = started + (deadline if deadline is not None else self.deadline)
+        pending: Dict[Any, bool] = {}
+        errors: List[LLMError] = []
+        next_index = 0
+
+        def launch(hedge: bool):
+            nonlocal next_index
+            provider = self.providers[next_index]
+            next_index += 1
+            remaining = max(0.01, expires - time.monotonic())
+            future = self._executor.submit(self._call, provider, prompt, remaining, max_tokens)
+            pending[future] = hedge
+
+        launch(hedge=False)
+        hedge_delay = self._hedge_delay()
+        hedge_at = started + hedge_delay if hedge_delay is not None else None
+
+        while pending:
+            now = time.monotonic()
+            if now >= expires:
+                break
+            timeout = expires - now
+            can_hedge = hedge_at is not None and next_index < len(self.providers)
+            if can_hedge:
+                timeout = min(timeout, max(0.0, hedge_at - now))
+
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                if can_hedge and time.monotonic() >= hedge_at:
+                    # Primary is slower than usual; race the next provider against it
+                    with self._lock:
+                        self.hedges += 1
+                    hedge_at = None
+                    launch(hedge=True)
+                continue
+
+            for future in done:
+                hedge = pending.pop(future)
+                try:
+                    response = future.result()
+                except LLMError as e:
+                    errors.append(e)
+                    continue
+                if hedge:
+                    response.hedged = True
+                    with self._lock:
+                        self._stats[response.provider].hedges_won += 1
+                return response
+
+            if not pending and next_index < len(self.providers) and time.monotonic() < expires:
+                with self._lock:
+                    self.failovers += 1
+                logger.warning(f"Failing over to {self.providers[next_index].name} after: {errors[-1]}")
+                hedge_at = None
+                launch(hedge=False)
+
+        if errors and not pending:
+            raise errors[-1]
+        raise LLMTimeout("No LLM provider answered within the deadline", provider=self.primary.name)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            providers = {}
+            for provider in self.providers:
+                stats = self._stats[provider.name]
+                quantiles = stats.sketch.quantiles((0.5, 0.95))
+                providers[provider.name] = {
+                    "model": provider.model,
+                    "calls": stats.calls,
+                    "errors": stats.errors,
+                    "hedges_won": stats.hedges_won,
+                    "p50_latency": quantiles[0.5],
+                    "p95_latency": quantiles[0.95]
+                }
+            return {"providers": providers, "hedges": self.hedges, "failovers": self.failovers}
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    def _hedge_delay(self) -> Optional[float]:
+        """Seconds to wait on the primary before hedging, or None if hedging does not apply"""
+        if self.hedge_quantile is None or len(self.providers) < 2:
+            return None
+        with self._lock:
+            stats = self._stats[self.primary.name]
+            if len(stats.latencies) < self.hedge_min_samples:
+                return None
+            return stats.quantile(self.hedge_quantile)
+
+    def _call(self, provider: LLMProvider, prompt: str, timeout: float, max_tokens: Optional[int]) -> LLMResponse:
+        started = time.perf_counter()
+        try:
+            response = provider.generate(prompt, timeout=timeout, max_tokens=max_tokens)
+        except LLMError:
+            with self._lock:
+                self._stats[provider.name].calls += 1
+                self._stats[provider.name].errors += 1
+            raise
+        except Exception as e:
+            with self._lock:
+                self._stats[provider.name].calls += 1
+                self._stats[provider.name].errors += 1
+            raise LLMError(f"{provider.name} failed: {str(e)}", provider=provider.name)
+        with self._lock:
+            stats = self._stats[provider.name]
+            stats.calls += 1
+            stats.add_latency(time.perf_counter() - started)
+        return response
+
+
+def build_default_client(deadline: Optional[float] = None) -> LLMClient:
+    """
+    Client configured from the environment
+
+    LLM_FAKE=1 uses the in-process fake provider only. Otherwise Gemini
+    (GEMINI_API_KEY, GEMINI_MODEL) is primary and Groq (GROQ_API_KEY,
+    GROQ_MODEL) is the hedge/failover provider when a key is set.
+    """
+    deadline = deadline if deadline is not None else float(os.environ.get("LLM_DEADLINE_SECONDS", 30))
+    if os.environ.get("LLM_FAKE") == "1":
+        return LLMClient([FakeProvider(latency=0.05)], deadline=deadline)
+
+    session = pooled_session()
+    providers: List[LLMProvider] = []
+    if os.environ.get("GEMINI_API_KEY"):
+        providers.append(GeminiProvider(os.environ["GEMINI_API_KEY"],
+                                        model=os.environ.get("GEMINI_MODEL", "gemini-1.5-flash"),
+                                        session=session))
+    if os.environ.get("GROQ_API_KEY"):
+        providers.append(OpenAICompatibleProvider("https://api.groq.com/openai/v1",
+                                                  model=os.environ.get("GROQ_MODEL", "llama3-8b-8192"),
+                                                  api_key=os.environ["GROQ_API_KEY"], name="groq",
+                                                  session=session))
+    if not providers:
+        raise ValueError("Set GEMINI_API_KEY and/or GROQ_API_KEY (or LLM_FAKE=1)")
+    return LLMClient(providers, deadline=deadline)
@@ -1,19 +1,14 @@
+import os
 import time
 import logging
 from datetime import datetime
 from typing import Dict, List, Optional
-import groq
-from firebase_admin import credentials, messaging
 import json
 from dataclasses import dataclass
-from config import GORQ_API_KEY, FIREBASE_CREDENTIALS
-
-# Configure logging
-logging.basicConfig(
-    filename='logs/llm_monitor.log',
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+from metrics_store import MetricsStore, WINDOWS
+from llm_client import LLMClient, OpenAICompatibleProvider
+from llm_tracing import estimate_cost
+from anomaly_detection import AnomalyDetector, DetectorConfig
 
 @dataclass
 class LLMMetrics:
@@ -25,43 +20,94 @@ class LLMMetrics:
     timestamp: datetime
 
 class LLMMonitor:
-    def __init__(self, api_key: str, notification_topic: str = "llm_alerts"):
+    def __init__(self, api_key: Optional[str] = None, notification_topic: str = "llm_alerts", delivery_pipeline=None,
+                 history_size: int = 10000, alert_dedup_window: float = 900.0, llm_client: Optional[LLMClient] = None):
         self.api_key = api_key
+        # Shared llm_client.LLMClient used by monitor_request; built for Groq
+        # on first use when not given
+        self.llm_client = llm_client
         self.notification_topic = notification_topic
-        self.metrics_history: List[LLMMetrics] = []
+        # Optional notification_delivery.DeliveryPipeline; alerts are then
+        # coalesced and rate limited instead of sent one by one
+        self.delivery_pipeline = delivery_pipeline
+        # Fixed-size ring buffer with running aggregates and per-minute
+        # windows; memory stays constant no matter how long we run
+        self.metrics_store = MetricsStore(capacity=history_size)
         self.thresholds = {
             "response_time": 5.0,  # seconds
             "error_rate": 0.1,     # 10%
             "cost": 0.50,          # dollars per request
         }
         
-        # Initialize Firebase
-        cred = credentials.Certificate(FIREBASE_CREDENTIALS)
-        # firebase_admin.initialize_app(cred)
+        # Alerts compare the recent level of each metric with its rolling
+        # baseline; the fixed thresholds above only act as hard ceilings on
+        # the smoothed level, so a single slow request no longer pages anyone
+        self.anomaly_detector = AnomalyDetector({
+            "response_time": DetectorConfig(floor=1.0, ceiling=self.thresholds["response_time"], min_std=0.05),
+            # Errors are 0/1 per request, so smooth over ~40 requests and
+            # require the old 10% threshold before alerting
+            "error_rate": DetectorConfig(fast_alpha=0.05, floor=self.thresholds["error_rate"],
+                                         ceiling=self.thresholds["error_rate"] * 3, min_std=0.05),
+            "cost": DetectorConfig(floor=0.01, ceiling=self.thresholds["cost"], min_std=1e-4),
+        }, dedup_window=alert_dedup_window)
 
     def record_metrics(self, metrics: LLMMetrics):
         """Record metrics and check for anomalies"""
-        self.metrics_history.append(metrics)
+        self.metrics_store.record(
+            metrics.response_time,
+            metrics.token_count,
+            metrics.error_rate,
+            metrics.cost,
+            timestamp=metrics.timestamp.timestamp()
+        )
         self._check_anomalies(metrics)
 
     def _check_anomalies(self, metrics: LLMMetrics):
-        """Check if metrics exceed thresholds and send notifications"""
-        alerts = []
-
-        if metrics.response_time > self.thresholds["response_time"]:
-            alerts.append(f"High response time: {metrics.response_time:.2f}s")
+        """Update rolling baselines and send notifications for new anomalies"""
+        anomalies = self.anomaly_detector.observe({
+            "response_time": metrics.response_time,
+            "error_rate": metrics.error_rate,
+            "cost": metrics.cost,
+        }, now=metrics.timestamp.timestamp())
+        if not anomalies:
+            return
 
-        if metrics.error_rate > self.thresholds["error_rate"]:
-            alerts.append(f"High error rate: {metrics.error_rate:.2%}")
-
-        if metrics.cost > self.thresholds["cost"]:
-            alerts.append(f"High cost: ${metrics.cost:.2f}")
-
-        if alerts:
-            self._send_notification(alerts)
+        formats = {
+            "response_time": lambda v: f"{v:.2f}s",
+            "error_rate": lambda v: f"{v:.2%}",
+            "cost": lambda v: f"${v:.4f}",
+        }
+        labels = {
+            "response_time": "High response time",
+            "error_rate": "High error rate",
+            "cost": "High cost",
+        }
+        alerts = []
+        for anomaly in anomalies:
+            fmt = formats[anomaly["metric"]]
+            alerts.append(
+                f"{labels[anomaly['metric']]}: {fmt(anomaly['recent'])} "
+                f"(baseline {fmt(anomaly['baseline'])}, z={anomaly['z_score']:.1f})"
+            )
+        self._send_notification(alerts)
 
     def _send_notification(self, alerts: List[str]):
         """Send notification through Firebase"""
+        if self.delivery_pipeline:
+            now = datetime.now().isoformat()
+            self.delivery_pipeline.enqueue_many([
+                {
+                    "id": f"llm_{now}_{i}",
+                    "type": "alert",
+                    "message": alert,
+                    "timestamp": now,
+                    "topic": self.notification_topic
+                }
+                for i, alert in enumerate(alerts)
+            ])
+            logging.info(f"Notification queued: {alerts}")
+            return
+        
         message = {
             "topic": self.notification_topic,
             "notification": {
@@ -75,47 +121,70 @@ class LLMMonitor:
         }
         
         try:
+            from firebase_admin import messaging
             messaging.send(message)
             logging.info(f"Notification sent: {alerts}")
         except Exception as e:
             logging.error(f"Failed to send notification: {str(e)}")
 
-    def get_performance_report(self) -> Dict:
-        """Generate a performance report"""
-        if not self.metrics_history:
-            return {"error": "No metrics recorded"}
+    @property
+    def metrics_history(self) -> List[LLMMetrics]:
+        """Metrics still held in the ring buffer, oldest first"""
+        timestamps, values = self.metrics_store.recent()
+        return [
+            LLMMetrics(
+                response_time=float(row[0]),
+                token_count=int(row[1]),
+                error_rate=float(row[2]),
+                success_rate=1.0 - float(row[2]),
+                cost=float(row[3]),
+                timestamp=datetime.fromtimestamp(ts)
+            )
+            for ts, row in zip(timestamps, values)
+        ]
 
-        recent_metrics = self.metrics_history[-100:]  # Last 100 metrics
+    def get_performance_report(self, window: Optional[str] = None) -> Dict:
+        """
+        Generate a performance report
         
-        return {
-            "average_response_time": sum(m.response_time for m in recent_metrics) / len(recent_metrics),
-            "average_token_count": sum(m.token_count for m in recent_metrics) / len(recent_metrics),
-            "average_error_rate": sum(m.error_rate for m in recent_metrics) / len(recent_metrics),
-            "average_cost": sum(m.cost for m in recent_metrics) / len(recent_metrics),
-            "total_requests": len(recent_metrics),
-            "timestamp": datetime.now().isoformat()
-        }
+        Args:
+            window: None for every request in the ring buffer, or one of
+                "5m", "1h", "24h" for a time-windowed report
+        """
+        if len(self.metrics_store) == 0:
+            return {"error": "No metrics recorded"}
+
+        if window is None:
+            report = self.metrics_store.summary()
+            report["windows"] = {name: self.metrics_store.window_summary(seconds) for name, seconds in WINDOWS.items()}
+        else:
+            report = self.metrics_store.window_summary(WINDOWS[window])
+            report["window"] = window
+
+        report["anomalies"] = self.anomaly_detector.status()
+        report["timestamp"] = datetime.now().isoformat()
+        return report
 
     def monitor_request(self, prompt: str, max_tokens: int = 1000) -> Dict:
         """Monitor a single LLM request"""
         start_time = time.time()
         try:
             # Make the actual LLM request
-            response = groq.query(
-                prompt,
-                max_tokens=max_tokens,
-                api_key=self.api_key
-            )
+            if self.llm_client is None:
+                self.llm_client = LLMClient([OpenAICompatibleProvider(
+                    "https://api.groq.com/openai/v1", "llama3-8b-8192", api_key=self.api_key, name="groq"
+                )])
+            response = self.llm_client.generate(prompt, max_tokens=max_tokens)
             
             end_time = time.time()
             response_time = end_time - start_time
             
             metrics = LLMMetrics(
                 response_time=response_time,
-                token_count=len(response.get("text", "").split()),
+                token_count=response.total_tokens,
                 error_rate=0.0,
                 success_rate=1.0,
-                cost=0.0,  # Calculate based on your pricing model
+                cost=estimate_cost(response.model, response.prompt_tokens, response.completion_tokens),
                 timestamp=datetime.now()
             )
             
@@ -140,24 +209,56 @@ class LLMMonitor:
 
 def main():
     """Main function to demonstrate usage"""
-    monitor = LLMMonitor(api_key=GORQ_API_KEY)
+    import argparse
+    import asyncio
+    from llm_probe import ProbeRunner, MockLLMServer, INVENTORY_PROMPTS
+    
+    parser = argparse.ArgumentParser(description="LLM performance monitor")
+    parser.add_argument('--concurrency', type=int, default=1, help="Probes fired at once per check")
+    parser.add_argument('--interval', type=int, default=300, help="Seconds between checks")
+    parser.add_argument('--base-url', default="https://api.groq.com/openai/v1")
+    parser.add_argument('--model', default="llama3-8b-8192")
+    parser.add_argument('--mock', action='store_true', help="Probe a local mock LLM server instead")
+    args = parser.parse_args()
+    
+    # Configure logging here rather than at import time, so importing the
+    # monitor from the API process does not redirect its logs
+    os.makedirs('logs', exist_ok=True)
+    logging.basicConfig(
+        filename='logs/llm_monitor.log',
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+    
+    base_url = args.base_url
+    api_key = None
+    if args.mock:
+        base_url = MockLLMServer(port=0).start().base_url
+    else:
+        from config import GORQ_API_KEY
+        api_key = GORQ_API_KEY
+    
+    monitor = LLMMonitor(api_key=api_key)
+    runner = ProbeRunner(base_url, args.model, api_key=api_key, prompts=INVENTORY_PROMPTS,
+                         monitor=monitor, time_series_path='logs/llm_probe.bin')
     
     # Example monitoring loop
     while True:
         try:
-            # Monitor a test request
-            result = monitor.monitor_request("What is the weather today?")
+            # Fire a burst of representative inventory questions
+            burst = asyncio.run(runner.run_burst(args.concurrency))
+            logging.info(f"Probe burst: {json.dumps(burst)}")
             
             # Generate and log performance report
             report = monitor.get_performance_report()
             logging.info(f"Performance Report: {json.dumps(report, indent=2)}")
             
-            # Wait for 5 minutes before next check
-            time.sleep(300)
+            # Wait before the next check
+            time.sleep(args.interval)
             
         except Exception as e:
             logging.error(f"Error in monitoring loop: {str(e)}")
             time.sleep(60)  # Wait 1 minute before retrying
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
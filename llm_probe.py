@@ -0,0 +1,336 @@
+import asyncio
+import json
+import os
+import random
+import struct
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Any, Optional
+
+from llm_client import (LLMProvider, OpenAICompatibleProvider, LLMError, LLMRateLimited, LLMTimeout,
+                        pooled_session)
+from token_bucket import TokenBucket
+
+logger = logging.getLogger("LLMProbe")
+
+# Representative questions from the store's chat traffic
+INVENTORY_PROMPTS = [
+    "How many Dove Shampoo bottles do we have in stock?",
+    "What's the price of Tata Tea Premium?",
+    "List all products with less than 20 items in stock",
+    "Based on sales trends, which products should I restock soon?",
+    "Which products are moving slowly and shouldn't be restocked?",
+    "What quantity of Maggi Noodles should I order next time?",
+    "Show me the sales velocity for our top products",
+    "Based on current sales, what's my projected inventory in 2 weeks?",
+]
+
+STATUS_OK = 0
+STATUS_RATE_LIMITED = 1
+STATUS_ERROR = 2
+STATUS_TIMEOUT = 3
+STATUS_NAMES = {STATUS_OK: "ok", STATUS_RATE_LIMITED: "rate_limited", STATUS_ERROR: "error", STATUS_TIMEOUT: "timeout"}
+
+# Time-series record: start timestamp, latency (s), status, burst size, total tokens
+RECORD = struct.Struct("<dfBHI")
+
+
+@dataclass
+class ProbeResult:
+    started: float
+    latency: float
+    status: int
+    tokens: int = 0
+    error: Optional[str] = None
+
+
+class TimeSeriesWriter:
+    """Append-only binary file of fixed-size probe records (19 bytes each)"""
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def append(self, results: List[ProbeResult], burst_size: int):
+        with open(self.path, "ab") as f:
+            f.write(b"".join(
+                RECORD.pack(r.started, r.latency, r.status, min(burst_size, 0xFFFF), min(r.tokens, 0xFFFFFFFF))
+                for r in results
+            ))
+
+
+def read_time_series(path: str) -> List[Dict[str, Any]]:
+    """Load probe records written by TimeSeriesWriter"""
+    with open(path, "rb") as f:
+        data = f.read()
+    usable = len(data) - len(data) % RECORD.size
+    return [
+        {"timestamp": ts, "latency": latency, "status": STATUS_NAMES.get(status, str(status)),
+         "burst_size": burst_size, "tokens": tokens}
+        for ts, latency, status, burst_size, tokens in RECORD.iter_unpack(data[:usable])
+    ]
+
+
+def summarize(results: List[ProbeResult], wall_time: float) -> Dict[str, Any]:
+    """Latency distribution, throughput and error breakdown of a burst"""
+    latencies = sorted(r.latency for r in results if r.status == STATUS_OK)
+
+    def percentile(q):
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+    counts = {name: 0 for name in STATUS_NAMES.values()}
+    for r in results:
+        counts[STATUS_NAMES[r.status]] += 1
+    return {
+        "requests": len(results),
+        **counts,
+        "throughput_rps": counts["ok"] / wall_time if wall_time > 0 else None,
+        "p50_latency": percentile(0.5),
+        "p95_latency": percentile(0.95),
+        "p99_latency": percentile(0.99),
+        "max_latency": latencies[-1] if latencies else None,
+        "wall_time": wall_time
+    }
+
+
+class ProbeRunner:
+    """
+    Fires concurrent bursts of probe requests at an OpenAI-compatible chat endpoint
+
+    Each probe runs the blocking HTTP call on a pooled worker thread, sharing
+    one keep-alive connection pool, so a burst of N probes really is N
+    requests in flight at once.
+    """
+    def __init__(self, base_url: Optional[str], model: str, api_key: Optional[str] = None, timeout: float = 30.0,
+                 max_tokens: int = 256, prompts: Optional[List[str]] = None, monitor=None,
+                 time_series_path: Optional[str] = None, provider: Optional[LLMProvider] = None):
+        """
+        Args:
+            base_url: e.g. https://api.groq.com/openai/v1 or http://127.0.0.1:8089/v1 for the mock
+            model: Model name sent with each request
+            api_key: Bearer token, if the endpoint needs one
+            timeout: Per-request timeout in seconds
+            max_tokens: Completion limit per probe
+            prompts: Prompts to sample from (defaults to INVENTORY_PROMPTS)
+            monitor: Optional llm_moniter.LLMMonitor that receives every result
+            time_series_path: Optional file to append results to
+            provider: Probe this llm_client provider instead of building one from base_url
+        """
+        # Probes go to the provider directly, not through LLMClient, so
+        # hedging and failover do not hide the endpoint's own latency
+        self.provider = provider or OpenAICompatibleProvider(base_url, model, api_key=api_key, name="probe",
+                                                             session=pooled_session(64))
+        self.model = model
+        self.timeout = timeout
+        self.max_tokens = max_tokens
+        self.prompts = prompts or INVENTORY_PROMPTS
+        self.monitor = monitor
+        self.writer = TimeSeriesWriter(time_series_path) if time_series_path else None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._workers = 0
+
+    def _probe_blocking(self, prompt: str) -> ProbeResult:
+        started = time.time()
+        t0 = time.perf_counter()
+        try:
+            response = self.provider.generate(prompt, timeout=self.timeout, max_tokens=self.max_tokens)
+            return ProbeResult(started, time.perf_counter() - t0, STATUS_OK, tokens=response.total_tokens)
+        except LLMRateLimited:
+            return ProbeResult(started, time.perf_counter() - t0, STATUS_RATE_LIMITED, error="429 Too Many Requests")
+        except LLMTimeout:
+            return ProbeResult(started, time.perf_counter() - t0, STATUS_TIMEOUT, error="timeout")
+        except LLMError as e:
+            error = f"HTTP {e.status_code}" if e.status_code else str(e)
+            return ProbeResult(started, time.perf_counter() - t0, STATUS_ERROR, error=error)
+        except Exception as e:
+            return ProbeResult(started, time.perf_counter() - t0, STATUS_ERROR, error=str(e))
+
+    async def run_burst(self, concurrency: int) -> Dict[str, Any]:
+        """Send `concurrency` probes at once and wait for all of them"""
+        if self._executor is None or self._workers < concurrency:
+            if self._executor:
+                self._executor.shutdown(wait=False)
+            self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="llm-probe")
+            self._workers = concurrency
+
+        loop = asyncio.get_running_loop()
+        prompts = [random.choice(self.prompts) for _ in range(concurrency)]
+        t0 = time.perf_counter()
+        results = await asyncio.gather(*(
+            loop.run_in_executor(self._executor, self._probe_blocking, prompt) for prompt in prompts
+        ))
+        wall_time = time.perf_counter() - t0
+
+        if self.writer:
+            self.writer.append(results, concurrency)
+        if self.monitor is not None:
+            self._record(results)
+
+        summary = summarize(results, wall_time)
+        summary["concurrency"] = concurrency
+        return summary
+
+    async def run(self, concurrency_levels: List[int], bursts_per_level: int = 1,
+                  pause: float = 1.0) -> List[Dict[str, Any]]:
+        """Run bursts at each concurrency level in turn"""
+        summaries = []
+        for concurrency in concurrency_levels:
+            for _ in range(bursts_per_level):
+                summary = await self.run_burst(concurrency)
+                logger.info(f"Probe burst: {json.dumps(summary)}")
+                summaries.append(summary)
+                await asyncio.sleep(pause)
+        return summaries
+
+    def close(self):
+        if self._executor:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+            self._workers = 0
+
+    def _record(self, results: List[ProbeResult]):
+        from datetime import datetime
+        from llm_moniter import LLMMetrics
+        for r in results:
+            failed = r.status != STATUS_OK
+            self.monitor.record_metrics(LLMMetrics(
+                response_time=r.latency,
+                token_count=r.tokens,
+                error_rate=1.0 if failed else 0.0,
+                success_rate=0.0 if failed else 1.0,
+                cost=0.0,
+                timestamp=datetime.fromtimestamp(r.started)
+            ))
+
+
+class MockLLMServer:
+    """
+    Local OpenAI-compatible chat completions server for probe runs
+
+    Latency is log-normal around `median_latency`; requests beyond the
+    token-bucket rate limit get HTTP 429, like a real provider.
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 8089, median_latency: float = 0.3,
+                 latency_sigma: float = 0.4, rate_limit: float = 20.0, burst: float = 10.0,
+                 error_rate: float = 0.0):
+        self.host = host
+        self.port = port
+        self.median_latency = median_latency
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.bucket = TokenBucket(rate_limit, capacity=burst)
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self._server.server_address[1] if self._server else self.port}/v1"
+
+    def start(self) -> "MockLLMServer":
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                if not mock.bucket.try_acquire():
+                    return self._reply(429, {"error": {"message": "Rate limit reached"}})
+                time.sleep(random.lognormvariate(0, mock.latency_sigma) * mock.median_latency)
+                if random.random() < mock.error_rate:
+                    return self._reply(500, {"error": {"message": "Internal error"}})
+                prompt = " ".join(m.get("content", "") for m in body.get("messages", []))
+                prompt_tokens = max(1, len(prompt) // 4)
+                completion_tokens = min(int(body.get("max_tokens", 256)), 120)
+                self._reply(200, {
+                    "id": "mock-completion",
+                    "object": "chat.completion",
+                    "model": body.get("model", "mock"),
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": "Mock answer."},
+                                 "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                              "total_tokens": prompt_tokens + completion_tokens}
+                })
+
+            def _reply(self, status, payload):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="mock-llm", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def main():
+    """Run probe bursts against a provider or the local mock"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Concurrent LLM probe runner")
+    parser.add_argument("--base-url", default="https://api.groq.com/openai/v1")
+    parser.add_argument("--model", default="llama3-8b-8192")
+    parser.add_argument("--api-key-env", default="GROQ_API_KEY", help="Environment variable holding the API key")
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma-separated burst sizes")
+    parser.add_argument("--bursts", type=int, default=3, help="Bursts per concurrency level")
+    parser.add_argument("--pause", type=float, default=1.0, help="Seconds between bursts")
+    parser.add_argument("--output", default="logs/llm_probe.bin", help="Time-series file to append to")
+    parser.add_argument("--mock", action="store_true", help="Start a local mock LLM server and probe it")
+    parser.add_argument("--mock-port", type=int, default=0)
+    parser.add_argument("--serve-mock", action="store_true", help="Only run the mock server")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    if args.serve_mock:
+        server = MockLLMServer(port=args.mock_port or 8089).start()
+        print(f"Mock LLM server listening on {server.base_url}")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            server.stop()
+        return
+
+    server = None
+    base_url = args.base_url
+    if args.mock:
+        server = MockLLMServer(port=args.mock_port).start()
+        base_url = server.base_url
+
+    runner = ProbeRunner(base_url, args.model, api_key=os.environ.get(args.api_key_env),
+                         time_series_path=args.output)
+    levels = [int(level) for level in args.concurrency.split(",") if level]
+    try:
+        summaries = asyncio.run(runner.run(levels, bursts_per_level=args.bursts, pause=args.pause))
+    finally:
+        runner.close()
+        if server:
+            server.stop()
+
+    print(f"{'conc':>5} {'ok':>5} {'429':>5} {'err':>5} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for s in summaries:
+        fmt = lambda v: f"{v:8.3f}" if v is not None else f"{'-':>8}"
+        print(f"{s['concurrency']:>5} {s['ok']:>5} {s['rate_limited']:>5} {s['error'] + s['timeout']:>5} "
+              f"{fmt(s['throughput_rps'])} {fmt(s['p50_latency'])} {fmt(s['p95_latency'])} {fmt(s['p99_latency'])}")
+
+
+if __name__ == "__main__":
+    main()
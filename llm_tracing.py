@@ -0,0 +1,220 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+from metrics_store import LatencySketch
+
+# USD per million tokens (prompts up to 128k tokens)
+MODEL_PRICING = {
+    "gemini-1.5-flash": {"input": 0.075, "output": 0.30},
+    "gemini-1.5-pro": {"input": 1.25, "output": 5.00},
+    "llama3-8b-8192": {"input": 0.05, "output": 0.08},
+    "llama3-70b-8192": {"input": 0.59, "output": 0.79},
+}
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """Dollar cost of a call; 0 for models without known pricing"""
+    pricing = MODEL_PRICING.get(model)
+    if not pricing:
+        return 0.0
+    return (prompt_tokens * pricing["input"] + completion_tokens * pricing["output"]) / 1_000_000
+
+
+def usage_from_response(response) -> Dict[str, int]:
+    """Token counts from an LLMResponse or a Gemini SDK response's usage metadata (zeros if missing)"""
+    if hasattr(response, "prompt_tokens"):
+        return {
+            "prompt_tokens": response.prompt_tokens,
+            "completion_tokens": response.completion_tokens,
+            "total_tokens": response.total_tokens or response.prompt_tokens + response.completion_tokens
+        }
+    usage = getattr(response, "usage_metadata", None)
+    prompt_tokens = int(getattr(usage, "prompt_token_count", 0) or 0)
+    completion_tokens = int(getattr(usage, "candidates_token_count", 0) or 0)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": int(getattr(usage, "total_token_count", 0) or 0) or prompt_tokens + completion_tokens
+    }
+
+
+class RequestTrace:
+    """Timings and token usage of a single chat request"""
+    def __init__(self, name: str, model: str):
+        self.name = name
+        self.model = model
+        self.started = time.perf_counter()
+        self.timestamp = datetime.now()
+        self.stages: Dict[str, float] = {}
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.total_tokens = 0
+        self.error: Optional[str] = None
+        self.duration: Optional[float] = None
+        # Set when the LLM answer came from another request's in-flight call
+        self.coalesced = False
+        # Set when the answer came from the semantic cache without an LLM call
+        self.cache_hit = False
+        # Set when the answer was computed from the data without an LLM call
+        self.local_answer = False
+        self.provider: Optional[str] = None
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time a block of work; repeated stages accumulate"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - started
+
+    def set_usage(self, response):
+        usage = usage_from_response(response)
+        self.prompt_tokens = usage["prompt_tokens"]
+        self.completion_tokens = usage["completion_tokens"]
+        self.total_tokens = usage["total_tokens"]
+        # Price the model that actually answered, which differs after a failover
+        self.model = getattr(response, "model", None) or self.model
+        self.provider = getattr(response, "provider", None)
+
+    @property
+    def cost(self) -> float:
+        return estimate_cost(self.model, self.prompt_tokens, self.completion_tokens)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "model": self.model,
+            "provider": self.provider,
+            "timestamp": self.timestamp.isoformat(),
+            "duration": self.duration,
+            "stages": dict(self.stages),
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.total_tokens,
+            "cost": self.cost,
+            "coalesced": self.coalesced,
+            "cache_hit": self.cache_hit,
+            "local_answer": self.local_answer,
+            "error": self.error
+        }
+
+
+class StageStats:
+    """Running count, total and latency sketch for one stage"""
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.sketch = LatencySketch(min_value=1e-5)
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.sketch.add(seconds)
+
+    def to_dict(self) -> Dict[str, Any]:
+        percentiles = self.sketch.quantiles((0.5, 0.95, 0.99))
+        return {
+            "count": self.count,
+            "average": self.total / self.count if self.count else None,
+            "max": self.max,
+            "p50": percentiles[0.5],
+            "p95": percentiles[0.95],
+            "p99": percentiles[0.99]
+        }
+
+
+class ChatTracer:
+    """
+    Collects per-stage timings, token usage and cost of chat requests
+
+    Finished traces are aggregated per stage and, when a monitor is given,
+    recorded as LLMMetrics so LLMMonitor reports and anomaly checks cover
+    real chat traffic.
+    """
+    def __init__(self, monitor=None, model: str = "gemini-1.5-flash", recent_size: int = 50):
+        """
+        Args:
+            monitor: Optional llm_moniter.LLMMonitor to feed
+            model: Model name used for cost estimates
+            recent_size: Number of recent traces kept for inspection
+        """
+        self.monitor = monitor
+        self.model = model
+        self._lock = threading.Lock()
+        self._stages: Dict[str, StageStats] = {}
+        self._recent = deque(maxlen=recent_size)
+        self.requests = 0
+        self.errors = 0
+        self.coalesced = 0
+        self.cache_hits = 0
+        self.local_answers = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+
+    def start(self, name: str = "chat") -> RequestTrace:
+        return RequestTrace(name, self.model)
+
+    def finish(self, trace: RequestTrace, error: Optional[str] = None):
+        """Close a trace and record it"""
+        trace.duration = time.perf_counter() - trace.started
+        trace.error = error
+
+        with self._lock:
+            self.requests += 1
+            if error:
+                self.errors += 1
+            if trace.coalesced:
+                self.coalesced += 1
+            if trace.cache_hit:
+                self.cache_hits += 1
+            if trace.local_answer:
+                self.local_answers += 1
+            self.prompt_tokens += trace.prompt_tokens
+            self.completion_tokens += trace.completion_tokens
+            self.cost += trace.cost
+            for name, seconds in trace.stages.items():
+                self._stages.setdefault(name, StageStats()).add(seconds)
+            self._stages.setdefault("total", StageStats()).add(trace.duration)
+            self._recent.append(trace.to_dict())
+
+        if self.monitor is not None and not (trace.cache_hit or trace.local_answer):
+            # Cache hits and local answers made no LLM call and would skew the monitor's latency
+            # baseline. Imported here so the tracer has no hard dependency on
+            # the monitor module
+            from llm_moniter import LLMMetrics
+            self.monitor.record_metrics(LLMMetrics(
+                response_time=trace.duration,
+                token_count=trace.total_tokens,
+                error_rate=1.0 if error else 0.0,
+                success_rate=0.0 if error else 1.0,
+                cost=trace.cost,
+                timestamp=trace.timestamp
+            ))
+
+    def get_metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            stages = {name: stats.to_dict() for name, stats in self._stages.items()}
+            metrics = {
+                "requests": self.requests,
+                "errors": self.errors,
+                "coalesced_requests": self.coalesced,
+                "cache_hits": self.cache_hits,
+                "local_answers": self.local_answers,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "cost": self.cost,
+                "model": self.model,
+                "stages": stages,
+                "recent": list(self._recent)
+            }
+        if self.monitor is not None:
+            metrics["monitor"] = self.monitor.get_performance_report()
+        return metrics
@@ -0,0 +1,98 @@
+import re
+from typing import Dict, List, Optional
+
+from conversation_memory import resolve_products
+
+# Questions answered from the data alone. Each pattern must match the whole
+# question, so anything phrased beyond these simple lookups (comparisons,
+# "why", advice) still goes to the LLM.
+_COUNT = re.compile(r"how many (different |distinct )?(products|items|skus)( do (we|i) have| are there)?"
+                    r"( in (stock|inventory|the store))?")
+_TOTAL_UNITS = re.compile(r"how many (units|items) (are )?(in stock|in total|do (we|i) have in stock)( in total)?")
+_PRICE = re.compile(r"(what is |whats )?(the )?(price|cost) of (?P<product>.+)|how much (is|does) (?P<product2>.+?)( cost)?")
+_STOCK = re.compile(r"(what is |whats )?(the )?(stock|quantity|stock level) of (?P<product>.+)"
+                    r"|how many (?P<product2>.+?) (are |do (we|i) have )?(left|in stock)")
+_BELOW = re.compile(r"(which |what |list |show )?(all )?(products|items)( (have|are|with|that have))? "
+                    r"(less|fewer|under|below) (than )?(?P<limit>\d+)( (units|items|pieces))?( (in stock|left))?")
+_OUT_OF_STOCK = re.compile(r"(which |what |list |show )?(all )?(products|items)( are)? out of stock")
+
+_MAX_LISTED = 20
+
+
+def _normalize(query: str) -> str:
+    text = query.lower().replace("what's", "whats").replace("'", "")
+    text = re.sub(r"[?.!]+\s*$", "", text.strip())
+    return re.sub(r"\s+", " ", text)
+
+
+def _single_product(text: str, products: List[Dict]) -> Optional[Dict]:
+    ids = resolve_products(text, products)
+    if len(ids) != 1:
+        return None
+    return next((p for p in products if p.get('barcode_id') == ids[0]), None)
+
+
+def _products(count: int) -> str:
+    return f"{count} product" if count == 1 else f"{count} products"
+
+
+def _listing(products: List[Dict]) -> str:
+    lines = [f"- {p.get('name', 'Unknown Product')}: {p.get('quantity', 0)} in stock"
+             for p in sorted(products, key=lambda p: p.get('quantity', 0))[:_MAX_LISTED]]
+    if len(products) > _MAX_LISTED:
+        lines.append(f"- ... and {len(products) - _MAX_LISTED} more")
+    return "\n".join(lines)
+
+
+def answer_locally(query: str, products: List[Dict]) -> Optional[str]:
+    """
+    Answer simple lookup questions (product counts, a product's price or
+    stock, products below a stock level, out-of-stock products) directly
+    from the product data
+
+    Returns:
+        The answer, or None if the question needs the LLM
+    """
+    text = _normalize(query)
+
+    if _COUNT.fullmatch(text):
+        units = sum(p.get('quantity', 0) or 0 for p in products)
+        return f"There are {_products(len(products))} in inventory, with {units} units in stock in total."
+
+    if _TOTAL_UNITS.fullmatch(text):
+        units = sum(p.get('quantity', 0) or 0 for p in products)
+        return f"There are {units} units in stock across {_products(len(products))}."
+
+    match = _PRICE.fullmatch(text)
+    if match:
+        product = _single_product(match.group('product') or match.group('product2'), products)
+        if product is None or product.get('price') is None:
+            return None
+        try:
+            price = float(product['price'])
+        except (TypeError, ValueError):
+            return None  # e.g. a price stored as text like "3 for 5"; let the LLM read it
+        return f"{product.get('name', 'Unknown Product')} is priced at {price:.2f}."
+
+    match = _STOCK.fullmatch(text)
+    if match:
+        product = _single_product(match.group('product') or match.group('product2'), products)
+        if product is not None:
+            return f"{product.get('name', 'Unknown Product')} has {product.get('quantity', 0)} units in stock."
+        return None
+
+    match = _BELOW.fullmatch(text)
+    if match:
+        limit = int(match.group('limit'))
+        low = [p for p in products if (p.get('quantity', 0) or 0) < limit]
+        if not low:
+            return f"No products have fewer than {limit} units in stock."
+        return f"{_products(len(low))} with fewer than {limit} units in stock:\n{_listing(low)}"
+
+    if _OUT_OF_STOCK.fullmatch(text):
+        empty = [p for p in products if (p.get('quantity', 0) or 0) <= 0]
+        if not empty:
+            return "No products are out of stock."
+        return f"{_products(len(empty))} out of stock:\n{_listing(empty)}"
+
+    return None
@@ -0,0 +1,341 @@
+import heapq
+import threading
+import time
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Tuple
+
+from forecasting import to_timestamp
+from metrics_exporter import FIRESTORE_READS
+
+logger = logging.getLogger("Lots")
+
+LOTS_COLLECTION = 'lots'
+
+
+@dataclass
+class Lot:
+    """One received batch of a product"""
+    lot_id: str  # Firestore document id
+    product_id: str  # barcode_id of the product
+    quantity: float  # Units of this batch still in stock
+    quantity_received: float
+    received_date: Optional[datetime]
+    expiry_date: Optional[datetime]
+    lot_code: Optional[str] = None  # Batch number printed on the pack
+
+    @classmethod
+    def from_doc(cls, doc_id: str, data: Dict[str, Any]) -> "Lot":
+        return cls(
+            lot_id=doc_id,
+            product_id=data.get('product_id'),
+            quantity=data.get('quantity', 0) or 0,
+            quantity_received=data.get('quantity_received', 0) or 0,
+            received_date=data.get('received_date'),
+            expiry_date=data.get('expiry_date'),
+            lot_code=data.get('lot_code')
+        )
+
+    @property
+    def expiry_ts(self) -> Optional[float]:
+        return to_timestamp(self.expiry_date)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'lot_id': self.lot_id,
+            'product_id': self.product_id,
+            'lot_code': self.lot_code,
+            'quantity': self.quantity,
+            'quantity_received': self.quantity_received,
+            'received_date': self.received_date.isoformat() if self.received_date else None,
+            'expiry_date': self.expiry_date.isoformat() if self.expiry_date else None
+        }
+
+
+def deplete_fifo(lots: List[Lot], quantity: float,
+                 now: Optional[float] = None) -> Tuple[List[Tuple[Lot, float]], float]:
+    """
+    Take `quantity` units from the oldest lots first
+
+    Lots received on the same day go oldest expiry first. Expired lots are
+    skipped: they cannot be sold and stay in stock until written off.
+
+    Returns:
+        ([(lot, units taken)], units no lot covered), e.g. stock that was on
+        the shelf before lot tracking started
+    """
+    def order(lot: Lot):
+        return (to_timestamp(lot.received_date) or 0, lot.expiry_ts or float('inf'), lot.lot_id)
+
+    now = time.time() if now is None else now
+    taken = []
+    remaining = quantity
+    for lot in sorted(lots, key=order):
+        if remaining <= 0:
+            break
+        if lot.expiry_ts is not None and lot.expiry_ts <= now:
+            continue
+        take = min(lot.quantity, remaining)
+        if take > 0:
+            taken.append((lot, take))
+            remaining -= take
+    return taken, max(remaining, 0)
+
+
+class LotStore:
+    """
+    Receiving stock and recording sales against lots in Firestore
+
+    Both keep the product's `quantity` equal to what it was before lots
+    existed (units on hand), so every reader of products is unaffected.
+    """
+    def __init__(self, db):
+        self.db = db
+
+    def receive(self, product_id: str, quantity: float, expiry_date: Optional[datetime] = None,
+                received_date: Optional[datetime] = None, lot_code: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Add a received batch and its units to the product's stock
+
+        Raises:
+            ValueError: Unknown product or non-positive quantity
+        """
+        from firebase_admin import firestore
+
+        if quantity <= 0:
+            raise ValueError("quantity must be positive")
+        product_ref = self.db.collection('products').document(product_id)
+        lot_ref = self.db.collection(LOTS_COLLECTION).document()
+        lot = Lot(lot_ref.id, product_id, quantity, quantity, received_date or datetime.now(), expiry_date, lot_code)
+
+        @firestore.transactional
+        def apply(transaction):
+            if not product_ref.get(transaction=transaction).exists:
+                raise ValueError(f"Unknown product {product_id}")
+            FIRESTORE_READS.inc(collection='products')
+            transaction.set(lot_ref, {
+                'product_id': product_id,
+                'lot_code': lot_code,
+                'quantity': quantity,
+                'quantity_received': quantity,
+                'received_date': lot.received_date,
+                'expiry_date': expiry_date
+            })
+            transaction.update(product_ref, {'quantity': firestore.Increment(quantity)})
+
+        apply(self.db.transaction())
+        return lot.to_dict()
+
+    def record_sale(self, product_id: str, quantity: float, selling_date: Optional[datetime] = None,
+                    total_price: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Write a sale, taking its units from the product's lots oldest first
+
+        The sale document lists the lots it drew from. Expired lots are not
+        drawn from. Units beyond what the unexpired lots hold are still sold
+        from the product's quantity and reported as `untracked`.
+
+        Raises:
+            ValueError: Unknown product, non-positive quantity, or more units
+                than the product has in stock outside expired lots
+        """
+        from firebase_admin import firestore
+
+        if quantity <= 0:
+            raise ValueError("quantity must be positive")
+        product_ref = self.db.collection('products').document(product_id)
+        sale_ref = self.db.collection('sales').document()
+        lots_query = (self.db.collection(LOTS_COLLECTION)
+                      .where('product_id', '==', product_id)
+                      .where('quantity', '>', 0))
+
+        @firestore.transactional
+        def apply(transaction):
+            product = product_ref.get(transaction=transaction)
+            if not product.exists:
+                raise ValueError(f"Unknown product {product_id}")
+            lots = [Lot.from_doc(doc.id, doc.to_dict()) for doc in transaction.get(lots_query)]
+            FIRESTORE_READS.inc(collection='products')
+            FIRESTORE_READS.inc(len(lots), collection=LOTS_COLLECTION)
+
+            # Expired units stay in the product's stock until written off, but cannot be sold
+            sold_at = to_timestamp(selling_date) or time.time()
+            expired = sum(lot.quantity for lot in lots if lot.expiry_ts is not None and lot.expiry_ts <= sold_at)
+            sellable = (product.to_dict().get('quantity', 0) or 0) - expired
+            if quantity > sellable:
+                held = f" ({expired:g} more are in expired lots)" if expired else ""
+                raise ValueError(f"Only {max(sellable, 0):g} units of {product_id} can be sold{held}")
+
+            taken, untracked = deplete_fifo(lots, quantity, sold_at)
+            for lot, take in taken:
+                transaction.update(self.db.collection(LOTS_COLLECTION).document(lot.lot_id),
+                                   {'quantity': lot.quantity - take})
+            transaction.update(product_ref, {'quantity': firestore.Increment(-quantity)})
+            price = product.to_dict().get('price', 0) or 0
+            sale = {
+                'product_id': product_id,
+                'quantity_sold': quantity,
+                'selling_date': selling_date or datetime.now(),
+                'total_price': total_price if total_price is not None else quantity * price,
+                'lots': [{'lot_id': lot.lot_id, 'quantity': take} for lot, take in taken]
+            }
+            transaction.set(sale_ref, sale)
+            return sale, untracked
+
+        sale, untracked = apply(self.db.transaction())
+        return {**sale, 'id': sale_ref.id, 'untracked': untracked}
+
+    def write_off(self, lot_id: str) -> Dict[str, Any]:
+        """
+        Dispose of what is left of a lot, e.g. once it has expired
+
+        Sets the lot's quantity to 0 and takes its units off the product's
+        stock (never below 0), so the lot stops being reported as expired.
+
+        Raises:
+            ValueError: Unknown lot or a lot with no stock left
+        """
+        from firebase_admin import firestore
+
+        lot_ref = self.db.collection(LOTS_COLLECTION).document(lot_id)
+
+        @firestore.transactional
+        def apply(transaction):
+            doc = lot_ref.get(transaction=transaction)
+            if not doc.exists:
+                raise ValueError(f"Unknown lot {lot_id}")
+            FIRESTORE_READS.inc(collection=LOTS_COLLECTION)
+            lot = Lot.from_doc(doc.id, doc.to_dict())
+            if lot.quantity <= 0:
+                raise ValueError(f"Lot {lot_id} has no stock left")
+            product_ref = self.db.collection('products').document(lot.product_id)
+            product = product_ref.get(transaction=transaction)
+            FIRESTORE_READS.inc(collection='products')
+            on_hand = ((product.to_dict() or {}).get('quantity', 0) or 0) if product.exists else 0
+            transaction.update(lot_ref, {
+                'quantity': 0,
+                'quantity_written_off': lot.quantity,
+                'written_off_date': datetime.now()
+            })
+            if on_hand > 0:
+                transaction.update(product_ref, {'quantity': firestore.Increment(-min(lot.quantity, on_hand))})
+            return lot
+
+        lot = apply(self.db.transaction())
+        return {**lot.to_dict(), 'quantity': 0, 'quantity_written_off': lot.quantity}
+
+    def expiring(self, before: datetime) -> List[Lot]:
+        """Lots with stock left expiring before the given time, read with a range query"""
+        docs = (self.db.collection(LOTS_COLLECTION)
+                .where('quantity', '>', 0)
+                .where('expiry_date', '<=', before)
+                .stream())
+        lots = [Lot.from_doc(doc.id, doc.to_dict()) for doc in docs]
+        FIRESTORE_READS.inc(len(lots), collection=LOTS_COLLECTION)
+        return lots
+
+
+class ExpiryIndex:
+    """
+    Lots with stock left, in a min-heap by expiry date
+
+    due() pops only the lots expiring within the horizon, so a check costs
+    O(D log N) for D due lots instead of a pass over every lot. Entries are
+    never removed in place: a lot that sells out, is deleted or is re-dated
+    leaves a stale entry that is dropped when it reaches the top (or when
+    stale entries outnumber live ones and the heap is rebuilt).
+
+    Fed by a Firestore listener on the lots collection (start()).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._heap: List[Tuple[float, str]] = []
+        self._lots: Dict[str, Lot] = {}  # lot id -> lot with stock and an expiry date
+        self._loaded = False
+        self._listener = None
+
+    @property
+    def ready(self) -> bool:
+        """Whether the lots collection has been loaded"""
+        return self._loaded
+
+    def upsert(self, lot: Lot):
+        with self._lock:
+            self._upsert(lot)
+
+    def _upsert(self, lot: Lot):
+        previous = self._lots.pop(lot.lot_id, None)
+        expiry = lot.expiry_ts
+        if lot.quantity <= 0 or expiry is None:
+            return
+        self._lots[lot.lot_id] = lot
+        if previous is None or previous.expiry_ts != expiry:
+            heapq.heappush(self._heap, (expiry, lot.lot_id))
+
+    def remove(self, lot_id: str):
+        with self._lock:
+            self._lots.pop(lot_id, None)
+
+    def rebuild(self, lots: List[Lot]):
+        with self._lock:
+            self._lots.clear()
+            self._heap.clear()
+            for lot in lots:
+                self._upsert(lot)
+            self._loaded = True
+
+    def apply_changes(self, changes):
+        """Apply Firestore DocumentChanges of the lots collection"""
+        with self._lock:
+            for change in changes:
+                if change.type.name == 'REMOVED':
+                    self._lots.pop(change.document.id, None)
+                else:
+                    self._upsert(Lot.from_doc(change.document.id, change.document.to_dict() or {}))
+            if len(self._heap) > 2 * len(self._lots) + 64:
+                self._heap = [(lot.expiry_ts, lot_id) for lot_id, lot in self._lots.items()]
+                heapq.heapify(self._heap)
+            self._loaded = True
+
+    def due(self, within_seconds: float, now: Optional[float] = None) -> List[Lot]:
+        """Lots with stock left expiring within the given time (already expired ones included), soonest first"""
+        horizon = (time.time() if now is None else now) + within_seconds
+        with self._lock:
+            due, live, seen = [], [], set()
+            while self._heap and self._heap[0][0] <= horizon:
+                entry = heapq.heappop(self._heap)
+                expiry, lot_id = entry
+                lot = self._lots.get(lot_id)
+                if lot is None or lot.expiry_ts != expiry or lot_id in seen:
+                    continue  # Stale: sold out, removed, re-dated or duplicated
+                seen.add(lot_id)
+                due.append(lot)
+                live.append(entry)
+            for entry in live:
+                heapq.heappush(self._heap, entry)
+            return due
+
+    def start(self, db):
+        """Subscribe to the lots collection"""
+        self._listener = db.collection(LOTS_COLLECTION).on_snapshot(
+            lambda docs, changes, read_time: self.apply_changes(changes))
+        logger.info("Expiry index listening to lots")
+
+    def stop(self):
+        if self._listener is not None:
+            try:
+                self._listener.unsubscribe()
+            except Exception as e:
+                logger.error(f"Error unsubscribing listener: {str(e)}")
+            self._listener = None
+        self._loaded = False
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "ready": self._loaded,
+                "lots": len(self._lots),
+                "heap_entries": len(self._heap),
+                "next_expiry": datetime.fromtimestamp(self._heap[0][0]).isoformat() if self._heap else None
+            }
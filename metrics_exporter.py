@@ -0,0 +1,345 @@
+import bisect
+import threading
+import time
+import logging
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Any, Optional, Sequence, Tuple
+
+logger = logging.getLogger("MetricsExporter")
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class _ThreadShards:
+    """
+    One private shard per writing thread
+
+    Writers only ever touch their own shard, so the hot path needs no lock.
+    Readers merge all shards; shards of threads that have exited are folded
+    into a retired shard so short-lived request threads do not pile up.
+    Folding happens on every read and, so that a process nobody scrapes
+    stays bounded too, whenever registrations double the shard count.
+    """
+    def __init__(self, factory, merge):
+        self._factory = factory
+        self._merge = merge
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards: List[Tuple[threading.Thread, Any]] = []
+        self._retired = factory()
+        self._prune_at = 64
+
+    def get(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._factory()
+            self._local.shard = shard
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+                if len(self._shards) >= self._prune_at:
+                    self._prune()
+                    self._prune_at = max(64, 2 * len(self._shards))
+        return shard
+
+    def _prune(self):
+        # Called with the lock held
+        live, dead = [], []
+        for thread, shard in self._shards:
+            (live if thread.is_alive() else dead).append((thread, shard))
+        if dead:
+            # The threads are gone, so nothing writes these shards any more.
+            # Fold into a new retired shard: a reader may still be merging
+            # the old one from an earlier snapshot
+            retired = self._factory()
+            self._merge(retired, self._retired)
+            for _, shard in dead:
+                self._merge(retired, shard)
+            self._retired = retired
+        self._shards = live
+
+    def snapshot(self) -> List[Any]:
+        with self._lock:
+            self._prune()
+            return [self._retired] + [shard for _, shard in self._shards]
+
+
+def _copy_items(shard: Dict) -> List:
+    # Another thread may be inserting a new label set while we copy
+    while True:
+        try:
+            return list(shard.items())
+        except RuntimeError:
+            continue
+
+
+class _Metric(ABC):
+    metric_type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _format_labels(self, key: Tuple[str, ...], extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = list(zip(self.labelnames, key))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ""
+        escaped = []
+        for name, value in pairs:
+            value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            escaped.append(f'{name}="{value}"')
+        return "{" + ",".join(escaped) + "}"
+
+    @abstractmethod
+    def render(self) -> List[str]:
+        ...
+
+
+class Counter(_Metric):
+    """Monotonic counter with optional labels"""
+    metric_type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._shards = _ThreadShards(dict, self._merge)
+
+    @staticmethod
+    def _merge(into: Dict, shard: Dict):
+        for key, value in _copy_items(shard):
+            into[key] = into.get(key, 0) + value
+
+    def inc(self, amount: float = 1, **labels):
+        shard = self._shards.get()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def values(self) -> Dict[Tuple[str, ...], float]:
+        totals: Dict[Tuple[str, ...], float] = {}
+        for shard in self._shards.snapshot():
+            self._merge(totals, shard)
+        return totals
+
+    def get(self, **labels) -> float:
+        return self.values().get(self._key(labels), 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# TYPE {self.name} counter", f"# HELP {self.name} {self.documentation}"]
+        for key, value in sorted(self.values().items()):
+            lines.append(f"{self.name}_total{self._format_labels(key)} {value}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Point-in-time value; either set directly or read from a callback at scrape time"""
+    metric_type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        # A single dict store is atomic, so gauges need neither shards nor a lock
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._functions: Dict[Tuple[str, ...], Any] = {}
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def set_function(self, function, **labels):
+        self._functions[self._key(labels)] = function
+
+    def render(self) -> List[str]:
+        lines = [f"# TYPE {self.name} gauge", f"# HELP {self.name} {self.documentation}"]
+        values = dict(_copy_items(self._values))
+        for key, function in _copy_items(self._functions):
+            try:
+                values[key] = function()
+            except Exception as e:
+                logger.error(f"Gauge {self.name} callback failed: {str(e)}")
+        for key, value in sorted(values.items()):
+            if value is not None:
+                lines.append(f"{self.name}{self._format_labels(key)} {value}")
+        return lines
+
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram with optional labels"""
+    metric_type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._shards = _ThreadShards(dict, self._merge)
+
+    def _merge(self, into: Dict, shard: Dict):
+        for key, (counts, total, count) in _copy_items(shard):
+            merged = into.get(key)
+            if merged is None:
+                into[key] = [list(counts), total, count]
+            else:
+                for i, c in enumerate(counts):
+                    merged[0][i] += c
+                merged[1] += total
+                merged[2] += count
+
+    def observe(self, value: float, **labels):
+        shard = self._shards.get()
+        key = self._key(labels)
+        state = shard.get(key)
+        if state is None:
+            # One slot per bucket plus +Inf
+            state = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            shard[key] = state
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of a block in seconds"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def values(self) -> Dict[Tuple[str, ...], List]:
+        totals: Dict[Tuple[str, ...], List] = {}
+        for shard in self._shards.snapshot():
+            self._merge(totals, shard)
+        return totals
+
+    def render(self) -> List[str]:
+        lines = [f"# TYPE {self.name} histogram", f"# HELP {self.name} {self.documentation}"]
+        for key, (counts, total, count) in sorted(self.values().items()):
+            cumulative = 0
+            for bound, c in zip(self.buckets + (float("inf"),), counts):
+                cumulative += c
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                lines.append(f"{self.name}_bucket{self._format_labels(key, ('le', le))} {cumulative}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {count}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {total}")
+        return lines
+
+
+class Registry:
+    """Collection of metrics rendered together in the OpenMetrics text format"""
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                # Re-imports (e.g. module reloads) get the existing metric back
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Backend hot paths
+HTTP_REQUEST_DURATION = REGISTRY.histogram(
+    "http_request_duration_seconds", "Flask request latency by route",
+    ("route", "method", "status")
+)
+WHISPER_INFERENCE = REGISTRY.histogram(
+    "whisper_inference_seconds", "Whisper speech-to-text inference time",
+    buckets=(0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0, 60.0)
+)
+BARCODE_DECODE = REGISTRY.histogram(
+    "barcode_decode_seconds", "Image decode plus barcode detection time",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+)
+FIRESTORE_READS = REGISTRY.counter(
+    "firestore_document_reads", "Firestore documents read", ("collection",)
+)
+CACHE_REQUESTS = REGISTRY.counter(
+    "cache_requests", "Cache lookups by cache and result (hit/miss)", ("cache", "result")
+)
+LLM_COALESCED = REGISTRY.counter(
+    "llm_coalesced_requests", "Chat requests that shared an identical in-flight LLM call"
+)
+SEMANTIC_CACHE_LOOKUP = REGISTRY.histogram(
+    "semantic_cache_lookup_seconds", "Query embedding plus nearest-neighbour search time",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+)
+AGENT_CHECK_DURATION = REGISTRY.histogram(
+    "inventory_agent_check_duration_seconds", "Inventory agent check duration by check type",
+    ("check",), buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+)
+
+ADMISSION_QUEUE_TIME = REGISTRY.histogram(
+    "http_admission_queue_seconds", "Time requests waited for a concurrency slot, by route",
+    ("route",), buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+ADMISSION_REJECTED = REGISTRY.counter(
+    "http_admission_rejected", "Requests turned away by route and reason (rate_limited/queue_full/queue_timeout)",
+    ("route", "reason")
+)
+ADMISSION_IN_FLIGHT = REGISTRY.gauge(
+    "http_admission_in_flight", "Admitted requests currently running, by route", ("route",)
+)
+ADMISSION_QUEUED = REGISTRY.gauge(
+    "http_admission_queued", "Requests waiting for a concurrency slot, by route", ("route",)
+)
+
+VELOCITY_INDEX_DRIFT = REGISTRY.gauge(
+    "velocity_index_drift_products", "Products whose incrementally maintained velocity differed at the last full check"
+)
+
+
+def record_cache(cache: str, hit: bool):
+    """Count a cache lookup; hit rate = hits / (hits + misses)"""
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def start_http_server(port: int, host: str = "0.0.0.0", registry: Registry = REGISTRY) -> ThreadingHTTPServer:
+    """Serve /metrics from a background thread, for processes without Flask (e.g. the agent)"""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info(f"Serving metrics on {host}:{port}/metrics")
+    return server
@@ -0,0 +1,189 @@
+import math
+import threading
+import time
+from typing import Dict, Any, Optional, Iterable
+
+import numpy as np
+
+# Fields tracked for every LLM request, in storage column order
+FIELDS = ("response_time", "token_count", "error_rate", "cost")
+
+# Named report windows in seconds
+WINDOWS = {
+    "5m": 5 * 60,
+    "1h": 60 * 60,
+    "24h": 24 * 60 * 60,
+}
+
+
+class LatencySketch:
+    """
+    Fixed-size log-bucketed histogram for streaming quantiles
+
+    Values are counted in buckets whose bounds grow geometrically, so any
+    quantile is returned within `relative_accuracy` of the true value. Counts
+    can be removed as well as added, which lets a ring buffer keep the sketch
+    in sync with exactly the samples it holds.
+    """
+    def __init__(self, relative_accuracy: float = 0.01, min_value: float = 1e-3, max_value: float = 3600.0):
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.max_value = max_value
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.num_buckets = self.bucket_of(max_value) + 1
+        self.counts = np.zeros(self.num_buckets, dtype=np.int64)
+
+    def bucket_of(self, value: float) -> int:
+        """Bucket index of a value; values outside the range go to the end buckets"""
+        if value <= self.min_value:
+            return 0
+        value = min(value, self.max_value)
+        return int(math.ceil(math.log(value / self.min_value) / self._log_gamma))
+
+    def bucket_value(self, index) -> np.ndarray:
+        """Representative value of a bucket (midpoint in relative terms)"""
+        return self.min_value * self.gamma ** np.asarray(index) * 2 / (1 + self.gamma)
+
+    def add(self, value: float, count: int = 1):
+        self.counts[self.bucket_of(value)] += count
+
+    def remove(self, value: float, count: int = 1):
+        self.counts[self.bucket_of(value)] -= count
+
+    @property
+    def total(self) -> int:
+        return int(self.counts.sum())
+
+    def quantiles(self, qs: Iterable[float], counts: Optional[np.ndarray] = None) -> Dict[float, Optional[float]]:
+        """Quantiles of this sketch, or of a compatible counts array (e.g. merged windows)"""
+        counts = self.counts if counts is None else counts
+        cumulative = np.cumsum(counts)
+        total = cumulative[-1] if len(cumulative) else 0
+        if total <= 0:
+            return {q: None for q in qs}
+        result = {}
+        for q in qs:
+            index = int(np.searchsorted(cumulative, q * (total - 1) + 1))
+            result[q] = float(self.bucket_value(min(index, self.num_buckets - 1)))
+        return result
+
+
+class MetricsStore:
+    """
+    Bounded store of LLM request metrics with O(1) reports
+
+    Keeps the last `capacity` samples in preallocated NumPy ring buffers, with
+    running sums and a latency sketch that are updated as samples enter and
+    leave the buffer. Separately, per-slot (default per-minute) aggregates over
+    the last day back the time-windowed reports, so their cost depends on the
+    window length in slots rather than on the request rate.
+    """
+    def __init__(self, capacity: int = 10000, slot_seconds: int = 60, retention_seconds: int = WINDOWS["24h"],
+                 relative_accuracy: float = 0.01):
+        """
+        Args:
+            capacity: Number of most recent samples kept
+            slot_seconds: Granularity of the time-windowed aggregates
+            retention_seconds: Longest window that can be reported on
+            relative_accuracy: Relative error of reported latency quantiles
+        """
+        self.capacity = capacity
+        self._lock = threading.Lock()
+
+        # Ring buffer of raw samples
+        self._timestamps = np.zeros(capacity, dtype=np.float64)
+        self._values = np.zeros((capacity, len(FIELDS)), dtype=np.float64)
+        self._next = 0
+        self._size = 0
+        self._sums = np.zeros(len(FIELDS), dtype=np.float64)
+        self._sketch = LatencySketch(relative_accuracy)
+        self.total_recorded = 0
+
+        # Time slots: slot i holds aggregates for epoch slot _slot_ids[i]
+        self.slot_seconds = slot_seconds
+        self.num_slots = int(math.ceil(retention_seconds / slot_seconds)) + 1
+        self._slot_ids = np.full(self.num_slots, -1, dtype=np.int64)
+        self._slot_counts = np.zeros(self.num_slots, dtype=np.int64)
+        self._slot_sums = np.zeros((self.num_slots, len(FIELDS)), dtype=np.float64)
+        self._slot_hist = np.zeros((self.num_slots, self._sketch.num_buckets), dtype=np.int32)
+
+    def __len__(self):
+        return self._size
+
+    def record(self, response_time: float, token_count: float, error_rate: float, cost: float,
+               timestamp: Optional[float] = None):
+        """Add one request's metrics; O(1)"""
+        timestamp = time.time() if timestamp is None else timestamp
+        row = np.array((response_time, token_count, error_rate, cost), dtype=np.float64)
+
+        with self._lock:
+            i = self._next
+            if self._size == self.capacity:
+                # Evict the oldest sample from the running aggregates
+                self._sums -= self._values[i]
+                self._sketch.remove(self._values[i, 0])
+            else:
+                self._size += 1
+            self._timestamps[i] = timestamp
+            self._values[i] = row
+            self._sums += row
+            self._sketch.add(response_time)
+            self._next = (i + 1) % self.capacity
+            self.total_recorded += 1
+
+            slot_id = int(timestamp // self.slot_seconds)
+            s = slot_id % self.num_slots
+            if self._slot_ids[s] != slot_id:
+                # Slot still holds an older period; reuse it
+                self._slot_ids[s] = slot_id
+                self._slot_counts[s] = 0
+                self._slot_sums[s] = 0
+                self._slot_hist[s] = 0
+            self._slot_counts[s] += 1
+            self._slot_sums[s] += row
+            self._slot_hist[s, self._sketch.bucket_of(response_time)] += 1
+
+    def recent(self, n: Optional[int] = None):
+        """The last n samples as (timestamps, values) arrays, oldest first"""
+        with self._lock:
+            n = self._size if n is None else min(n, self._size)
+            indexes = (self._next - n + np.arange(n)) % self.capacity
+            return self._timestamps[indexes].copy(), self._values[indexes].copy()
+
+    def summary(self) -> Dict[str, Any]:
+        """Averages and latency percentiles over every sample in the buffer"""
+        with self._lock:
+            count = self._size
+            sums = self._sums.copy()
+            counts = self._sketch.counts.copy()
+        return self._report(count, sums, counts)
+
+    def window_summary(self, window_seconds: float, now: Optional[float] = None) -> Dict[str, Any]:
+        """Averages and latency percentiles over the last `window_seconds`, at slot granularity"""
+        now = time.time() if now is None else now
+        current = int(now // self.slot_seconds)
+        oldest = current - int(math.ceil(window_seconds / self.slot_seconds)) + 1
+
+        with self._lock:
+            mask = (self._slot_ids >= oldest) & (self._slot_ids <= current)
+            count = int(self._slot_counts[mask].sum())
+            sums = self._slot_sums[mask].sum(axis=0)
+            counts = self._slot_hist[mask].sum(axis=0, dtype=np.int64)
+        return self._report(count, sums, counts)
+
+    def _report(self, count: int, sums: np.ndarray, counts: np.ndarray) -> Dict[str, Any]:
+        if count == 0:
+            return {"total_requests": 0}
+        averages = sums / count
+        percentiles = self._sketch.quantiles((0.5, 0.95, 0.99), counts)
+        return {
+            "average_response_time": float(averages[0]),
+            "average_token_count": float(averages[1]),
+            "average_error_rate": float(averages[2]),
+            "average_cost": float(averages[3]),
+            "p50_response_time": percentiles[0.5],
+            "p95_response_time": percentiles[0.95],
+            "p99_response_time": percentiles[0.99],
+            "total_requests": count
+        }
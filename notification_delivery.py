@@ -0,0 +1,381 @@
+import random
+import threading
+import time
+import logging
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, List, Any, Callable, Optional, Tuple
+
+from token_bucket import TokenBucket
+
+logger = logging.getLogger("NotificationDelivery")
+
+# FCM accepts at most 500 messages per batch call
+MAX_FCM_BATCH = 500
+
+# Digest bodies list the most urgent notification types first
+TYPE_ORDER = {"warning": 0, "alert": 1, "info": 2}
+
+
+@dataclass
+class Digest:
+    """One push message summarising several notifications for a topic or recipient group"""
+    topic: Optional[str]
+    tokens: Tuple[str, ...]
+    notifications: List[Dict]
+    attempts: int = 0
+    next_attempt: float = 0.0
+
+    def to_message(self) -> Dict[str, Any]:
+        ordered = sorted(self.notifications, key=lambda n: TYPE_ORDER.get(n.get("type"), 3))
+        if len(ordered) == 1:
+            title = "Inventory Alert"
+        else:
+            title = f"{len(ordered)} Inventory Alerts"
+        body_lines = [n.get("message", "") for n in ordered[:5]]
+        if len(ordered) > 5:
+            body_lines.append(f"...and {len(ordered) - 5} more")
+        return {
+            "topic": self.topic,
+            "tokens": list(self.tokens),
+            "notification": {
+                "title": title,
+                "body": "\n".join(body_lines)
+            },
+            "data": {
+                "notification_ids": ",".join(n.get("id", "") for n in ordered),
+                "alert_count": str(len(ordered)),
+                "timestamp": ordered[0].get("timestamp", "")
+            }
+        }
+
+
+class Transport(ABC):
+    """Sends a batch of push messages; returns one error (or None) per message"""
+    @abstractmethod
+    def send_batch(self, messages: List[Dict[str, Any]]) -> List[Optional[str]]:
+        ...
+
+
+class FCMTransport(Transport):
+    """
+    Firebase Cloud Messaging transport
+
+    Topic messages go out in a single send_all call per batch; token groups use
+    send_multicast. Firebase is initialised on the first send.
+    """
+    def __init__(self, dry_run: bool = False):
+        self.dry_run = dry_run
+
+    def send_batch(self, messages: List[Dict[str, Any]]) -> List[Optional[str]]:
+        from firebase_admin import messaging
+        from backend.firebase_config import get_app
+
+        get_app()
+        errors: List[Optional[str]] = [None] * len(messages)
+
+        topic_indexes = [i for i, m in enumerate(messages) if m.get("topic")]
+        for start in range(0, len(topic_indexes), MAX_FCM_BATCH):
+            chunk = topic_indexes[start:start + MAX_FCM_BATCH]
+            fcm_messages = [
+                messaging.Message(
+                    topic=messages[i]["topic"],
+                    notification=messaging.Notification(**messages[i]["notification"]),
+                    data=messages[i]["data"]
+                )
+                for i in chunk
+            ]
+            try:
+                batch = messaging.send_all(fcm_messages, dry_run=self.dry_run)
+                for i, response in zip(chunk, batch.responses):
+                    if not response.success:
+                        errors[i] = str(response.exception)
+            except Exception as e:
+                for i in chunk:
+                    errors[i] = str(e)
+
+        for i, message in enumerate(messages):
+            if message.get("topic") or not message.get("tokens"):
+                continue
+            tokens = message["tokens"]
+            failed = []
+            for start in range(0, len(tokens), MAX_FCM_BATCH):
+                try:
+                    batch = messaging.send_multicast(
+                        messaging.MulticastMessage(
+                            tokens=tokens[start:start + MAX_FCM_BATCH],
+                            notification=messaging.Notification(**message["notification"]),
+                            data=message["data"]
+                        ),
+                        dry_run=self.dry_run
+                    )
+                    failed.extend(str(r.exception) for r in batch.responses if not r.success)
+                except Exception as e:
+                    failed.append(str(e))
+            if failed:
+                errors[i] = "; ".join(failed)
+
+        return errors
+
+
+class StubTransport(Transport):
+    """
+    Local transport that records messages instead of pushing them
+
+    Useful for tests and throughput measurements without Firebase.
+    """
+    def __init__(self, latency: float = 0.0, failure_rate: float = 0.0, seed: Optional[int] = None):
+        """
+        Args:
+            latency: Simulated seconds per batch call
+            failure_rate: Probability that an individual message fails
+            seed: Random seed for reproducible failures
+        """
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.sent: List[Dict[str, Any]] = []
+        self.batch_calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def send_batch(self, messages: List[Dict[str, Any]]) -> List[Optional[str]]:
+        if self.latency:
+            time.sleep(self.latency)
+        errors = []
+        with self._lock:
+            self.batch_calls += 1
+            for message in messages:
+                if self._random.random() < self.failure_rate:
+                    errors.append("simulated failure")
+                else:
+                    self.sent.append(message)
+                    errors.append(None)
+        return errors
+
+
+def default_route(notification: Dict[str, Any]) -> Tuple[Optional[str], Tuple[str, ...]]:
+    """
+    Send to the notification's device tokens if it has any, else to its own
+    topic, else to a topic per notification type
+    """
+    tokens = tuple(notification.get("recipients") or ())
+    if tokens:
+        return None, tokens
+    if notification.get("topic"):
+        return notification["topic"], ()
+    return f"inventory_{notification.get('type', 'info')}", ()
+
+
+class DeliveryPipeline:
+    """
+    Coalesces notifications into per-topic digests and pushes them in batches
+
+    Notifications are buffered per topic (or recipient group) for
+    `digest_window` seconds and then sent as one digest. Each topic is rate
+    limited with a token bucket; while a topic is out of tokens its
+    notifications keep accumulating into the next digest. Failed digests are
+    retried with exponential backoff and jitter.
+    """
+    def __init__(self, transport: Transport, digest_window: float = 30.0, max_batch_size: int = MAX_FCM_BATCH,
+                 messages_per_minute: float = 6.0, max_retries: int = 4, backoff_base: float = 2.0,
+                 backoff_max: float = 300.0,
+                 route: Callable[[Dict[str, Any]], Tuple[Optional[str], Tuple[str, ...]]] = default_route):
+        """
+        Args:
+            transport: Where digests are sent (FCMTransport, StubTransport, ...)
+            digest_window: Seconds to collect notifications before sending a digest
+            max_batch_size: Maximum messages per transport call
+            messages_per_minute: Rate limit per topic / recipient group
+            max_retries: Attempts after the first before a digest is dropped
+            backoff_base: First retry delay in seconds; doubles each attempt
+            backoff_max: Upper bound on the retry delay
+            route: Maps a notification to (topic, device tokens)
+        """
+        self.transport = transport
+        self.digest_window = digest_window
+        self.max_batch_size = max_batch_size
+        self.messages_per_minute = messages_per_minute
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.route = route
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pending: Dict[Tuple, List[Dict]] = defaultdict(list)
+        self._pending_since: Dict[Tuple, float] = {}
+        self._retry_queue: List[Digest] = []
+        self._buckets: Dict[Tuple, TokenBucket] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+
+        self.stats = {
+            "enqueued": 0,
+            "digests_sent": 0,
+            "notifications_sent": 0,
+            "batch_calls": 0,
+            "retries": 0,
+            "dropped": 0,
+            "rate_limited": 0
+        }
+
+    def enqueue(self, notification: Dict[str, Any]):
+        """Buffer a notification for the next digest of its topic"""
+        self.enqueue_many([notification])
+
+    def enqueue_many(self, notifications: List[Dict[str, Any]]):
+        now = time.monotonic()
+        with self._lock:
+            for notification in notifications:
+                key = self.route(notification)
+                self._pending[key].append(notification)
+                self._pending_since.setdefault(key, now)
+                self.stats["enqueued"] += 1
+
+    def start(self, tick: float = 1.0):
+        """Deliver in a background thread, checking for due digests every `tick` seconds"""
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, args=(tick,), name="notification-delivery", daemon=True)
+        self._thread.start()
+
+    def stop(self, flush: bool = True):
+        """Stop the background thread, optionally sending everything still buffered"""
+        self._running = False
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout=5.0)
+            self._thread = None
+        if flush:
+            self.flush(force=True)
+
+    def flush(self, force: bool = False) -> int:
+        """
+        Send every digest that is due
+
+        Args:
+            force: Ignore the digest window, rate limits and retry backoff
+
+        Returns:
+            Number of digests sent successfully
+        """
+        digests = self._collect_due(force)
+        sent = 0
+        for start in range(0, len(digests), self.max_batch_size):
+            sent += self._send(digests[start:start + self.max_batch_size])
+        return sent
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self.stats,
+                "pending_notifications": sum(len(v) for v in self._pending.values()),
+                "pending_retries": len(self._retry_queue)
+            }
+
+    def _bucket(self, key: Tuple) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(self.messages_per_minute / 60.0, capacity=max(1.0, self.messages_per_minute / 6.0))
+            self._buckets[key] = bucket
+        return bucket
+
+    def _collect_due(self, force: bool) -> List[Digest]:
+        now = time.monotonic()
+        due = []
+        with self._lock:
+            for key in list(self._pending):
+                if not force:
+                    if now - self._pending_since[key] < self.digest_window:
+                        continue
+                    if not self._bucket(key).try_acquire():
+                        self.stats["rate_limited"] += 1
+                        continue
+                topic, tokens = key
+                due.append(Digest(topic=topic, tokens=tokens, notifications=self._pending.pop(key)))
+                del self._pending_since[key]
+
+            retry_later = []
+            for digest in self._retry_queue:
+                if force or digest.next_attempt <= now:
+                    due.append(digest)
+                else:
+                    retry_later.append(digest)
+            self._retry_queue = retry_later
+        return due
+
+    def _send(self, digests: List[Digest]) -> int:
+        try:
+            errors = self.transport.send_batch([d.to_message() for d in digests])
+        except Exception as e:
+            errors = [str(e)] * len(digests)
+
+        sent = 0
+        now = time.monotonic()
+        with self._lock:
+            self.stats["batch_calls"] += 1
+            for digest, error in zip(digests, errors):
+                if error is None:
+                    sent += 1
+                    self.stats["digests_sent"] += 1
+                    self.stats["notifications_sent"] += len(digest.notifications)
+                    continue
+
+                digest.attempts += 1
+                if digest.attempts > self.max_retries:
+                    self.stats["dropped"] += 1
+                    logger.error(f"Dropping digest for {digest.topic or 'device group'} after {digest.attempts} attempts: {error}")
+                    continue
+
+                delay = min(self.backoff_max, self.backoff_base * (2 ** (digest.attempts - 1)))
+                digest.next_attempt = now + random.uniform(0.5 * delay, delay)
+                self._retry_queue.append(digest)
+                self.stats["retries"] += 1
+                logger.warning(f"Digest delivery failed ({error}), retry {digest.attempts} in {delay:.0f}s")
+        return sent
+
+    def _run(self, tick: float):
+        while self._running:
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error in delivery loop: {str(e)}")
+            self._wakeup.wait(tick)
+            self._wakeup.clear()
+
+
+def main():
+    """Measure pipeline throughput against the stub transport"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Notification delivery throughput test")
+    parser.add_argument('--notifications', type=int, default=100000)
+    parser.add_argument('--topics', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.05, help="Simulated seconds per batch call")
+    parser.add_argument('--failure-rate', type=float, default=0.01)
+    args = parser.parse_args()
+
+    transport = StubTransport(latency=args.latency, failure_rate=args.failure_rate, seed=0)
+    pipeline = DeliveryPipeline(transport, digest_window=0.0, messages_per_minute=float('inf'),
+                                backoff_base=0.0, route=lambda n: (f"topic_{n['product_id'] % args.topics}", ()))
+
+    started = time.perf_counter()
+    pipeline.enqueue_many([
+        {"id": str(i), "type": "warning", "message": f"Low stock alert #{i}", "product_id": i}
+        for i in range(args.notifications)
+    ])
+    while pipeline.get_stats()["pending_notifications"] or pipeline.get_stats()["pending_retries"]:
+        pipeline.flush()
+    elapsed = time.perf_counter() - started
+
+    stats = pipeline.get_stats()
+    print(f"Delivered {stats['notifications_sent']} notifications in {stats['digests_sent']} digests "
+          f"using {transport.batch_calls} batch calls in {elapsed:.3f}s "
+          f"({stats['notifications_sent'] / elapsed:,.0f} notifications/s, {stats['retries']} retries, "
+          f"{stats['dropped']} dropped)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+import json
+import os
+import threading
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Union
+
+logger = logging.getLogger("NotificationStore")
+
+TimeBound = Optional[Union[datetime, str]]
+
+
+class NotificationStore:
+    """
+    Notification store backed by an append-only JSONL journal
+
+    Notifications are kept in memory in insertion (time) order, keyed by id
+    for O(1) dedup, with secondary indexes by type and product. Each new
+    notification is appended to the journal; the journal is only rewritten
+    (compacted) once retention has dropped enough entries to make it worthwhile.
+    """
+    def __init__(self, journal_path: str, max_count: int = 500, max_age_days: Optional[float] = 30,
+                 legacy_path: Optional[str] = None):
+        """
+        Args:
+            journal_path: Path of the JSONL journal file
+            max_count: Maximum number of notifications kept (None for no limit)
+            max_age_days: Drop notifications older than this many days (None for no limit)
+            legacy_path: Optional notifications.json to import when the journal does not exist yet
+        """
+        self.journal_path = journal_path
+        self.max_count = max_count
+        self.max_age_days = max_age_days
+
+        self._lock = threading.Lock()
+        self._by_id: "OrderedDict[str, Dict]" = OrderedDict()
+        self._by_type: Dict[str, "OrderedDict[str, None]"] = {}
+        self._by_product: Dict[str, "OrderedDict[str, None]"] = {}
+        self._journal_lines = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(journal_path)), exist_ok=True)
+        self._load(legacy_path)
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __contains__(self, notification_id):
+        return notification_id in self._by_id
+
+    def add(self, notification: Dict) -> bool:
+        """Add a single notification; returns False if its id is already stored"""
+        return len(self.add_many([notification])) == 1
+
+    def add_many(self, notifications: List[Dict]) -> List[Dict]:
+        """
+        Add notifications that are not already stored and append them to the journal
+
+        Returns:
+            The notifications that were actually added
+        """
+        with self._lock:
+            added = []
+            for notification in notifications:
+                notification_id = notification.get('id')
+                if not notification_id or notification_id in self._by_id:
+                    continue
+                self._index(notification)
+                added.append(notification)
+
+            if added:
+                self._append(added)
+                self._apply_retention()
+            return added
+
+    def query(self, limit: Optional[int] = 20, notification_type: Optional[str] = None,
+              product_id: Optional[str] = None, since: TimeBound = None, until: TimeBound = None) -> List[Dict]:
+        """
+        Get notifications newest first, optionally filtered by type, product and time range
+        """
+        since = self._as_iso(since)
+        until = self._as_iso(until)
+
+        with self._lock:
+            # Start from the smallest candidate set
+            candidates = [self._by_id]
+            if notification_type is not None:
+                candidates.append(self._by_type.get(notification_type, {}))
+            if product_id is not None:
+                candidates.append(self._by_product.get(product_id, {}))
+            ids = min(candidates, key=len)
+
+            results = []
+            for notification_id in reversed(ids):
+                notification = self._by_id[notification_id]
+                timestamp = notification.get('timestamp', '')
+                if until is not None and timestamp > until:
+                    continue
+                if since is not None and timestamp < since:
+                    # Entries are in time order, so nothing older can match
+                    break
+                if notification_type is not None and notification.get('type') != notification_type:
+                    continue
+                if product_id is not None and notification.get('product_id') != product_id:
+                    continue
+                results.append(notification)
+                if limit is not None and len(results) >= limit:
+                    break
+            return results
+
+    def apply_retention(self):
+        """Drop notifications past the configured age or count limits"""
+        with self._lock:
+            self._apply_retention()
+
+    def compact(self):
+        """Rewrite the journal with only the notifications still retained"""
+        with self._lock:
+            self._compact()
+
+    def _index(self, notification: Dict):
+        notification_id = notification['id']
+        self._by_id[notification_id] = notification
+        self._by_type.setdefault(notification.get('type'), OrderedDict())[notification_id] = None
+        self._by_product.setdefault(notification.get('product_id'), OrderedDict())[notification_id] = None
+
+    def _unindex(self, notification: Dict):
+        notification_id = notification['id']
+        for index, key in ((self._by_type, notification.get('type')), (self._by_product, notification.get('product_id'))):
+            bucket = index.get(key)
+            if bucket is not None:
+                bucket.pop(notification_id, None)
+                if not bucket:
+                    del index[key]
+
+    def _apply_retention(self):
+        """Evict from the oldest end; caller holds the lock"""
+        cutoff = None
+        if self.max_age_days is not None:
+            cutoff = (datetime.now() - timedelta(days=self.max_age_days)).isoformat()
+
+        removed = 0
+        while self._by_id:
+            notification_id, oldest = next(iter(self._by_id.items()))
+            too_many = self.max_count is not None and len(self._by_id) > self.max_count
+            too_old = cutoff is not None and oldest.get('timestamp', '') < cutoff
+            if not (too_many or too_old):
+                break
+            del self._by_id[notification_id]
+            self._unindex(oldest)
+            removed += 1
+
+        # Only rewrite once the journal is mostly dead entries
+        if removed and self._journal_lines > 2 * max(len(self._by_id), 1):
+            self._compact()
+
+    def _append(self, notifications: List[Dict]):
+        try:
+            with open(self.journal_path, 'a') as f:
+                f.write(''.join(json.dumps(n) + '\n' for n in notifications))
+            self._journal_lines += len(notifications)
+        except Exception as e:
+            logger.error(f"Error appending to notification journal: {str(e)}")
+
+    def _compact(self):
+        tmp_path = self.journal_path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                f.write(''.join(json.dumps(n) + '\n' for n in self._by_id.values()))
+            os.replace(tmp_path, self.journal_path)
+            self._journal_lines = len(self._by_id)
+        except Exception as e:
+            logger.error(f"Error compacting notification journal: {str(e)}")
+
+    def _load(self, legacy_path: Optional[str]):
+        """Replay the journal (or import the legacy JSON file) into memory"""
+        entries = []
+        try:
+            if os.path.exists(self.journal_path):
+                with open(self.journal_path, 'r') as f:
+                    for line in f:
+                        self._journal_lines += 1
+                        try:
+                            entries.append(json.loads(line))
+                        except ValueError:
+                            # A torn write at the end of the journal; skip it
+                            logger.warning("Skipping corrupt notification journal line")
+            elif legacy_path and os.path.exists(legacy_path):
+                with open(legacy_path, 'r') as f:
+                    # The legacy file is stored newest first
+                    entries = list(reversed(json.load(f)))
+                self._append(entries)
+        except Exception as e:
+            logger.error(f"Error loading notifications: {str(e)}")
+
+        for notification in entries:
+            if notification.get('id') and notification['id'] not in self._by_id:
+                self._index(notification)
+        self._apply_retention()
+        logger.info(f"Loaded {len(self._by_id)} notifications from storage")
+
+    @staticmethod
+    def _as_iso(value: TimeBound) -> Optional[str]:
+        if isinstance(value, datetime):
+            return value.isoformat()
+        return value
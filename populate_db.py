@@ -100,6 +100,38 @@ sample_products = [
     }
 ]
 
+# Shelf life in days of the perishable products; the rest are not tracked by expiry
+shelf_life_days = {
+    "8901063010283": 365,  # Tata Tea Premium 1kg
+    "8901719110016": 30,   # Aashirvaad Atta 5kg
+    "8901058851298": 270,  # Maggi Noodles 12 Pack
+    "8901725121938": 120,  # Parle-G Biscuits 800g
+    "8901262150378": 7,    # Amul Butter 500g
+    "8901725121846": 180,  # Fortune Sunflower Oil 5L
+}
+
+def generate_lots():
+    """Split each product's stock into received batches with expiry dates"""
+    lots = []
+    now = datetime.datetime.now()
+    for product in sample_products:
+        # An older batch from the product's entry date and a newer one received since
+        older = product["quantity"] // 3
+        batches = [(product["entry_date"], older), (now - datetime.timedelta(days=random.randint(0, 3)), product["quantity"] - older)]
+        for i, (received_date, quantity) in enumerate(batches):
+            if quantity <= 0:
+                continue
+            shelf_life = shelf_life_days.get(product["barcode_id"])
+            lots.append({
+                "product_id": product["barcode_id"],
+                "lot_code": f"{product['barcode_id'][-4:]}-{received_date:%y%m%d}-{i + 1}",
+                "quantity": quantity,
+                "quantity_received": quantity,
+                "received_date": received_date,
+                "expiry_date": received_date + datetime.timedelta(days=shelf_life) if shelf_life else None
+            })
+    return lots
+
 def generate_sales():
     """Generate sample sales data"""
     sales = []
@@ -131,7 +163,7 @@ def populate_database():
     # Clear existing data (optional)
     delete_collections = input("Do you want to delete existing collections before adding new data? (y/n): ")
     if delete_collections.lower() == 'y':
-        collections = ['products', 'sales']
+        collections = ['products', 'sales', 'lots']
         for collection in collections:
             docs = db.collection(collection).stream()
             for doc in docs:
@@ -145,6 +177,11 @@ def populate_database():
         doc_ref.set(product)
         print(f"Added product: {product['name']} with barcode {product['barcode_id']}")
     
+    # Add the batches making up each product's stock
+    for lot in generate_lots():
+        db.collection('lots').document().set(lot)
+        print(f"Added lot {lot['lot_code']} of {lot['product_id']}: {lot['quantity']} units, expires {lot['expiry_date']}")
+    
     # Add sales
     sales = generate_sales()
     for sale in sales:
@@ -0,0 +1,45 @@
+from bisect import bisect_left, insort
+from typing import Dict, List, Hashable, Optional, Tuple
+
+
+class Ranking:
+    """
+    Scores per key kept in sorted order, for top-K and bottom-K reads
+
+    A bisect-maintained list of (score, key): locating a key is O(log N) and
+    reading K entries from either end is O(K), independent of N. Moving a key
+    shifts the tail of the list, which at catalogue sizes is a short memmove
+    and far cheaper than re-sorting on every read.
+    """
+    def __init__(self):
+        self._scores: Dict[Hashable, float] = {}
+        self._order: List[Tuple[float, Hashable]] = []
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def set(self, key: Hashable, score: Optional[float]):
+        """Insert or move a key; a score of None removes it"""
+        self.discard(key)
+        if score is None:
+            return
+        self._scores[key] = score
+        insort(self._order, (score, key))
+
+    def discard(self, key: Hashable):
+        if key not in self._scores:
+            return
+        score = self._scores.pop(key)
+        del self._order[bisect_left(self._order, (score, key))]
+
+    def clear(self):
+        self._scores.clear()
+        self._order.clear()
+
+    def top(self, k: int) -> List[Tuple[Hashable, float]]:
+        """The k highest (key, score) pairs, highest first"""
+        return [(key, score) for score, key in reversed(self._order[max(len(self._order) - k, 0):])] if k > 0 else []
+
+    def bottom(self, k: int) -> List[Tuple[Hashable, float]]:
+        """The k lowest (key, score) pairs, lowest first"""
+        return [(key, score) for score, key in self._order[:max(k, 0)]]
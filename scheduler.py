@@ -0,0 +1,187 @@
+import asyncio
+import threading
+import random
+import time
+import logging
+from dataclasses import dataclass, asdict
+from typing import Dict, Any, Callable, Awaitable, Optional
+
+logger = logging.getLogger("Scheduler")
+
+
+@dataclass
+class JobStats:
+    runs: int = 0
+    failures: int = 0
+    missed_runs: int = 0
+    last_started: Optional[float] = None
+    last_duration: Optional[float] = None
+    total_duration: float = 0.0
+    max_duration: float = 0.0
+    next_run: Optional[float] = None
+    last_error: Optional[str] = None
+
+
+class ScheduledJob:
+    """
+    A periodic coroutine job
+
+    Runs of the same job never overlap: the next run is only scheduled after
+    the current one finishes. Runs that could not start on time because the
+    previous run overran its interval are counted as missed, not queued up.
+    """
+    def __init__(self, name: str, func: Callable[[], Awaitable[Any]], interval: float,
+                 jitter: float = 0.1, run_immediately: bool = True):
+        """
+        Args:
+            name: Job name used for logging and stats
+            func: Coroutine function to run
+            interval: Seconds between run starts
+            jitter: Fraction of the interval to randomly add or subtract per run
+            run_immediately: Run once as soon as the scheduler starts
+        """
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.jitter = jitter
+        self.run_immediately = run_immediately
+        self.stats = JobStats()
+        self.task: Optional[asyncio.Task] = None
+
+    def _next_delay(self) -> float:
+        spread = self.interval * self.jitter
+        return max(0.0, self.interval + random.uniform(-spread, spread))
+
+    async def _run_once(self):
+        started = time.monotonic()
+        self.stats.last_started = time.time()
+        try:
+            await self.func()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.stats.failures += 1
+            self.stats.last_error = str(e)
+            logger.error(f"Job '{self.name}' failed: {str(e)}")
+        finally:
+            duration = time.monotonic() - started
+            self.stats.runs += 1
+            self.stats.last_duration = duration
+            self.stats.total_duration += duration
+            self.stats.max_duration = max(self.stats.max_duration, duration)
+        return started
+
+    async def run_forever(self):
+        loop = asyncio.get_running_loop()
+        if not self.run_immediately:
+            delay = self._next_delay()
+            self.stats.next_run = time.time() + delay
+            await asyncio.sleep(delay)
+
+        while True:
+            scheduled = loop.time()
+            await self._run_once()
+
+            # If the run overran, skip the slots it ate instead of running back-to-back
+            elapsed = loop.time() - scheduled
+            if elapsed > self.interval:
+                missed = int(elapsed // self.interval)
+                self.stats.missed_runs += missed
+                logger.warning(f"Job '{self.name}' took {elapsed:.1f}s, missed {missed} run(s)")
+
+            delay = max(0.0, self._next_delay() - elapsed % self.interval)
+            self.stats.next_run = time.time() + delay
+            await asyncio.sleep(delay)
+
+
+class AsyncScheduler:
+    """
+    Runs periodic jobs on a single long-lived asyncio event loop in a background thread
+    """
+    def __init__(self, name: str = "scheduler"):
+        self.name = name
+        self.jobs: Dict[str, ScheduledJob] = {}
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._ready = threading.Event()
+
+    @property
+    def is_running(self) -> bool:
+        return self.loop is not None and self.loop.is_running()
+
+    def add_job(self, name: str, func: Callable[[], Awaitable[Any]], interval: float,
+                jitter: float = 0.1, run_immediately: bool = True) -> ScheduledJob:
+        """Register a periodic job; jobs added while running start right away"""
+        if name in self.jobs:
+            raise ValueError(f"Job '{name}' is already registered")
+
+        job = ScheduledJob(name, func, interval, jitter=jitter, run_immediately=run_immediately)
+        self.jobs[name] = job
+        if self.is_running:
+            self.loop.call_soon_threadsafe(self._start_job, job)
+        return job
+
+    def start(self):
+        """Start the event loop thread and all registered jobs"""
+        if self.is_running:
+            logger.warning("Scheduler is already running")
+            return
+
+        self._ready.clear()
+        self._thread = threading.Thread(target=self._run_loop, name=self.name, daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+    def stop(self, timeout: float = 5.0):
+        """Cancel all jobs and stop the event loop"""
+        if not self.is_running:
+            return
+
+        async def _shutdown():
+            tasks = [job.task for job in self.jobs.values() if job.task]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        try:
+            asyncio.run_coroutine_threadsafe(_shutdown(), self.loop).result(timeout=timeout)
+        except Exception as e:
+            logger.error(f"Error cancelling scheduled jobs: {str(e)}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        if self._thread:
+            self._thread.join(timeout=timeout)
+
+    def call_soon_threadsafe(self, callback: Callable, *args):
+        """Schedule a plain callback on the scheduler loop from any thread"""
+        self.loop.call_soon_threadsafe(callback, *args)
+
+    def submit(self, coro):
+        """Run a coroutine on the scheduler loop from any thread; returns a concurrent Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-job timing and missed-run accounting"""
+        stats = {}
+        for name, job in self.jobs.items():
+            job_stats = asdict(job.stats)
+            job_stats['interval'] = job.interval
+            job_stats['average_duration'] = (
+                job.stats.total_duration / job.stats.runs if job.stats.runs else None
+            )
+            stats[name] = job_stats
+        return stats
+
+    def _start_job(self, job: ScheduledJob):
+        job.task = self.loop.create_task(job.run_forever())
+
+    def _run_loop(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        for job in self.jobs.values():
+            self._start_job(job)
+        self.loop.call_soon(self._ready.set)
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+            self.loop = None
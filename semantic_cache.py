@@ -0,0 +1,233 @@
+import hashlib
+import re
+import threading
+import time
+import logging
+from typing import Dict, List, Any, Hashable, Optional, Tuple
+
+import numpy as np
+
+from metrics_exporter import SEMANTIC_CACHE_LOOKUP, record_cache
+
+logger = logging.getLogger("SemanticCache")
+
+
+class SentenceTransformerEmbedder:
+    """Small local CPU sentence-embedding model (sentence-transformers)"""
+    name = "sentence-transformers"
+    default_threshold = 0.88
+
+    def __init__(self, model_name: str = "all-MiniLM-L6-v2"):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        return self.model.encode(texts, normalize_embeddings=True, convert_to_numpy=True).astype(np.float32)
+
+
+# Words that flip or change what a question asks while barely moving its
+# embedding ("best selling" vs "worst selling", "price of X" vs "stock of X"),
+# mapped to the terms compared exactly
+_GUARD_TERMS = {
+    'best': 'most', 'top': 'most', 'most': 'most', 'highest': 'most', 'maximum': 'most', 'max': 'most',
+    'fastest': 'most', 'popular': 'most', 'biggest': 'most', 'largest': 'most',
+    'worst': 'least', 'bottom': 'least', 'least': 'least', 'lowest': 'least', 'minimum': 'least', 'min': 'least',
+    'slowest': 'least', 'fewest': 'least', 'smallest': 'least', 'unpopular': 'least',
+    'more': 'above', 'above': 'above', 'over': 'above', 'greater': 'above',
+    'less': 'below', 'fewer': 'below', 'below': 'below', 'under': 'below',
+    'not': 'not', 'no': 'not', 'without': 'not', 'never': 'not',
+    'price': 'price', 'prices': 'price', 'priced': 'price', 'cost': 'price', 'costs': 'price',
+    'expensive': 'price', 'cheap': 'price', 'cheapest': 'price',
+    'stock': 'stock', 'stocks': 'stock', 'quantity': 'stock', 'quantities': 'stock', 'units': 'stock', 'left': 'stock',
+    'sales': 'sales', 'sale': 'sales', 'selling': 'sales', 'sold': 'sales', 'sell': 'sales', 'sells': 'sales',
+    'revenue': 'revenue', 'profit': 'revenue', 'margin': 'revenue',
+    'expiry': 'expiry', 'expire': 'expiry', 'expired': 'expiry', 'expiring': 'expiry',
+}
+
+
+def query_guard(query: str) -> Tuple[str, ...]:
+    """
+    Details that must match exactly for two questions to share an answer
+
+    Embeddings rate "less than 20 items" and "less than 10 items", or "best
+    sellers" and "worst sellers", as nearly identical, so the numbers and
+    the polarity and attribute words of a question are compared separately.
+    """
+    text = query.lower()
+    numbers = re.findall(r"\d+(?:\.\d+)?", text)
+    terms = sorted({_GUARD_TERMS[w] for w in re.findall(r"[a-z]+", text) if w in _GUARD_TERMS})
+    return tuple(numbers) + ('|',) + tuple(terms)
+
+
+def default_embedder():
+    """The sentence-transformer model, or None when it cannot be loaded"""
+    try:
+        return SentenceTransformerEmbedder()
+    except Exception as e:
+        logger.warning(f"sentence-transformers unavailable ({str(e)}); semantic cache disabled")
+        return None
+
+
+class SemanticCache:
+    """
+    Answers to earlier questions, looked up by meaning rather than exact text
+
+    Query embeddings live in a preallocated NumPy matrix and lookups are a
+    single brute-force matrix-vector product, which for a few thousand
+    entries takes well under a millisecond. Every entry is tied to the data
+    version it was answered against; when the version moves on, the whole
+    index is dropped, since no older entry can be valid again. Entries only
+    match questions with the same guard (numbers and polarity/attribute
+    words, plus whatever the caller adds, e.g. the products mentioned).
+
+    Without an embedding model the cache is disabled: lookups always miss
+    and nothing is stored. Word-overlap similarity was tried and rates
+    opposite questions ("highest price" / "lowest price") as the same. The
+    default model (and torch with it) is only loaded by load_embedder(),
+    never on a lookup, so no request stalls on it.
+    """
+    def __init__(self, embedder=None, threshold: Optional[float] = None, capacity: int = 2000, ttl: float = 3600.0):
+        """
+        Args:
+            embedder: Object with encode(texts) -> L2-normalized rows; without
+                one the cache stays disabled until load_embedder() is called
+            threshold: Cosine similarity needed for a hit (defaults to the embedder's)
+            capacity: Entries kept; the oldest are overwritten first
+            ttl: Seconds an answer stays usable even if the data does not change
+        """
+        self._embedder = embedder
+        self._threshold = threshold
+        self.capacity = capacity
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._vectors: Optional[np.ndarray] = None
+        self._created = np.zeros(capacity, dtype=np.float64)
+        self._guard_ids = np.zeros(capacity, dtype=np.int64)
+        self._entries: List[Optional[Tuple[str, Any]]] = [None] * capacity
+        self._size = 0
+        self._next = 0
+        self._version: Optional[Hashable] = None
+        self._embedder_loaded = embedder is not None
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def embedder(self):
+        """The embedding model, or None if it is not (or could not be) loaded"""
+        return self._embedder
+
+    def load_embedder(self, wait: bool = True):
+        """
+        Load the default embedding model, once
+
+        With wait=False it loads on a background thread; lookups miss until
+        it is ready instead of waiting for it.
+        """
+        if self._embedder_loaded:
+            return
+        if not wait:
+            threading.Thread(target=self.load_embedder, name="semantic-cache-load", daemon=True).start()
+            return
+        with self._load_lock:
+            if not self._embedder_loaded:
+                self._embedder = default_embedder()
+                self._embedder_loaded = True
+
+    @property
+    def enabled(self) -> bool:
+        return self.embedder is not None
+
+    @property
+    def threshold(self) -> Optional[float]:
+        if self._threshold is not None:
+            return self._threshold
+        return self.embedder.default_threshold if self.enabled else None
+
+    def embed(self, query: str) -> np.ndarray:
+        return self.embedder.encode([query])[0]
+
+    @staticmethod
+    def _guard_id(query: str, guard: Hashable) -> int:
+        # A 63-bit digest rather than an interned id, so nothing grows per distinct guard
+        digest = hashlib.blake2b(repr((query_guard(query), guard)).encode('utf-8'), digest_size=8).digest()
+        return int.from_bytes(digest, 'big') >> 1
+
+    def lookup(self, query: str, version: Hashable,
+               guard: Hashable = None) -> Tuple[Optional[Dict[str, Any]], np.ndarray]:
+        """
+        Cached answer for a question with the same meaning
+
+        Args:
+            query: The question
+            version: Data version the answer must have been given against
+            guard: Extra details that must match exactly
+
+        Returns:
+            (hit, vector): hit is {"query", "answer", "similarity"} or None;
+            vector is the query embedding, to pass to store() on a miss
+            (None when the cache is disabled)
+        """
+        if not self.enabled:
+            return None, None
+        with SEMANTIC_CACHE_LOOKUP.time():
+            vector = self.embed(query)
+            with self._lock:
+                hit = None
+                if self._version == version and self._size:
+                    similarities = self._vectors[:self._size] @ vector
+                    # Expired entries and entries with other guards can never win
+                    similarities[self._created[:self._size] < time.time() - self.ttl] = -1.0
+                    similarities[self._guard_ids[:self._size] != self._guard_id(query, guard)] = -1.0
+                    best = int(np.argmax(similarities))
+                    if similarities[best] >= self.threshold:
+                        cached_query, answer = self._entries[best]
+                        hit = {"query": cached_query, "answer": answer, "similarity": float(similarities[best])}
+                if hit:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+        record_cache("semantic", hit is not None)
+        return hit, vector
+
+    def store(self, query: str, answer: Any, version: Hashable, vector: Optional[np.ndarray] = None,
+              guard: Hashable = None):
+        """Remember an answer given against a data version"""
+        if not self.enabled:
+            return
+        vector = self.embed(query) if vector is None else vector
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.capacity, vector.shape[0]), dtype=np.float32)
+            if version != self._version:
+                # The data changed; every cached answer may now be wrong
+                self._version = version
+                self._size = 0
+                self._next = 0
+            self._vectors[self._next] = vector
+            self._guard_ids[self._next] = self._guard_id(query, guard)
+            self._created[self._next] = time.time()
+            self._entries[self._next] = (query, answer)
+            self._next = (self._next + 1) % self.capacity
+            self._size = min(self._size + 1, self.capacity)
+
+    def clear(self):
+        with self._lock:
+            self._size = 0
+            self._next = 0
+            self._version = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": self._size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else None,
+                "enabled": self._embedder is not None,
+                "embedder": self._embedder.name if self._embedder is not None else None,
+                "threshold": self._threshold if self._threshold is not None
+                else (self._embedder.default_threshold if self._embedder is not None else None)
+            }
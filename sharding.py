@@ -0,0 +1,196 @@
+import os
+import socket
+import sqlite3
+import time
+import uuid
+import zlib
+import logging
+from contextlib import contextmanager
+from typing import Dict, List, Any, Iterable, Optional, Set
+
+logger = logging.getLogger("Sharding")
+
+LEADER_LEASE = 'leader'
+
+
+def partition_for(product: Dict[str, Any], num_partitions: int, partition_by: str = 'barcode') -> int:
+    """
+    Map a product (or sale) to a partition
+
+    Args:
+        product: Product or sale document; uses store_id or barcode_id/product_id
+        num_partitions: Total number of partitions
+        partition_by: 'store' to keep each store on one worker, 'barcode' to spread by product
+    """
+    if partition_by == 'store':
+        key = str(product.get('store_id', 'default'))
+    else:
+        key = str(product.get('barcode_id') or product.get('product_id') or product.get('id', ''))
+    # crc32 is stable across processes, unlike hash()
+    return zlib.crc32(key.encode('utf-8')) % num_partitions
+
+
+class ShardCoordinator:
+    """
+    Lease-based partition assignment between agent workers sharing a SQLite file
+
+    Every worker heartbeats into the database. Whoever holds the leader lease
+    spreads partitions round-robin across live workers; each worker then holds
+    a lease per assigned partition and only works on partitions it holds, so a
+    partition is never checked by two workers at once. Alert ids are also
+    claimed in the database so a partition changing hands mid-day does not
+    produce the same alert twice.
+    """
+    def __init__(self, db_path: str, num_partitions: int = 16, partition_by: str = 'barcode',
+                 worker_id: Optional[str] = None, lease_seconds: float = 30.0):
+        """
+        Args:
+            db_path: Path of the shared SQLite coordination file
+            num_partitions: Number of partitions products are spread over
+            partition_by: 'store' or 'barcode', see partition_for
+            worker_id: Unique id of this worker (defaults to host, pid and a random suffix)
+            lease_seconds: How long leases last without a heartbeat
+        """
+        self.db_path = db_path
+        self.num_partitions = num_partitions
+        self.partition_by = partition_by
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.lease_seconds = lease_seconds
+        self.owned_partitions: Set[int] = set()
+        self.is_leader = False
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._transaction() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS workers (worker_id TEXT PRIMARY KEY, heartbeat REAL NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS assignments (partition INTEGER PRIMARY KEY, owner TEXT NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS emitted_alerts (id TEXT PRIMARY KEY, owner TEXT NOT NULL, emitted_at REAL NOT NULL)")
+
+    @contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front so read-modify-write is atomic
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+
+    def heartbeat(self) -> Set[int]:
+        """
+        Renew this worker's membership and leases, rebalance if leader
+
+        Call this well within lease_seconds (e.g. every third of it).
+
+        Returns:
+            The partitions this worker currently owns
+        """
+        now = time.time()
+        expires_at = now + self.lease_seconds
+        with self._transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO workers (worker_id, heartbeat) VALUES (?, ?)", (self.worker_id, now))
+            conn.execute("DELETE FROM workers WHERE heartbeat < ?", (now - self.lease_seconds,))
+
+            was_leader = self.is_leader
+            self.is_leader = self._try_lease(conn, LEADER_LEASE, now, expires_at)
+            if self.is_leader:
+                if not was_leader:
+                    logger.info(f"Worker {self.worker_id} became leader")
+                self._rebalance(conn)
+
+            assigned = {row[0] for row in conn.execute(
+                "SELECT partition FROM assignments WHERE owner = ?", (self.worker_id,))}
+
+            # Give up partitions no longer assigned, then take the assigned ones
+            # whose previous holder has released them or let them expire
+            for partition in self.owned_partitions - assigned:
+                conn.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (self._lease_name(partition), self.worker_id))
+            owned = set()
+            for partition in assigned:
+                if self._try_lease(conn, self._lease_name(partition), now, expires_at):
+                    owned.add(partition)
+
+        if owned != self.owned_partitions:
+            logger.info(f"Worker {self.worker_id} owns partitions {sorted(owned)}")
+        self.owned_partitions = owned
+        return owned
+
+    def release(self):
+        """Drop all leases and membership so other workers can take over at once"""
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM leases WHERE owner = ?", (self.worker_id,))
+            conn.execute("DELETE FROM workers WHERE worker_id = ?", (self.worker_id,))
+        self.owned_partitions = set()
+        self.is_leader = False
+
+    def partition_of(self, item: Dict[str, Any]) -> int:
+        return partition_for(item, self.num_partitions, self.partition_by)
+
+    def owns(self, item: Dict[str, Any]) -> bool:
+        """Whether this worker is responsible for the given product or sale"""
+        return self.partition_of(item) in self.owned_partitions
+
+    def claim_alerts(self, alert_ids: Iterable[str], retention_seconds: float = 2 * 86400) -> List[str]:
+        """
+        Claim alert ids across all workers
+
+        Returns:
+            The ids no worker had emitted before; only these should be emitted
+        """
+        now = time.time()
+        claimed = []
+        with self._transaction() as conn:
+            for alert_id in alert_ids:
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO emitted_alerts (id, owner, emitted_at) VALUES (?, ?, ?)",
+                    (alert_id, self.worker_id, now)
+                )
+                if cursor.rowcount:
+                    claimed.append(alert_id)
+            conn.execute("DELETE FROM emitted_alerts WHERE emitted_at < ?", (now - retention_seconds,))
+        return claimed
+
+    def get_status(self) -> Dict[str, Any]:
+        with self._transaction() as conn:
+            workers = [row[0] for row in conn.execute("SELECT worker_id FROM workers ORDER BY worker_id")]
+            leader = conn.execute("SELECT owner FROM leases WHERE name = ? AND expires_at >= ?",
+                                  (LEADER_LEASE, time.time())).fetchone()
+        return {
+            "worker_id": self.worker_id,
+            "is_leader": self.is_leader,
+            "leader": leader[0] if leader else None,
+            "workers": workers,
+            "owned_partitions": sorted(self.owned_partitions),
+            "num_partitions": self.num_partitions,
+            "partition_by": self.partition_by
+        }
+
+    def _try_lease(self, conn, name: str, now: float, expires_at: float) -> bool:
+        row = conn.execute("SELECT owner, expires_at FROM leases WHERE name = ?", (name,)).fetchone()
+        if row is None or row[0] == self.worker_id or row[1] < now:
+            conn.execute("INSERT OR REPLACE INTO leases (name, owner, expires_at) VALUES (?, ?, ?)",
+                         (name, self.worker_id, expires_at))
+            return True
+        return False
+
+    def _rebalance(self, conn):
+        """Spread partitions round-robin over live workers; leader only"""
+        workers = [row[0] for row in conn.execute("SELECT worker_id FROM workers ORDER BY worker_id")]
+        if not workers:
+            return
+        current = dict(conn.execute("SELECT partition, owner FROM assignments"))
+        for partition in range(self.num_partitions):
+            owner = workers[partition % len(workers)]
+            if current.get(partition) != owner:
+                conn.execute("INSERT OR REPLACE INTO assignments (partition, owner) VALUES (?, ?)", (partition, owner))
+        conn.execute("DELETE FROM assignments WHERE partition >= ?", (self.num_partitions,))
+
+    @staticmethod
+    def _lease_name(partition: int) -> str:
+        return f"partition:{partition}"
@@ -0,0 +1,78 @@
+import asyncio
+import re
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+
+def normalize_query(query: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation so trivially different phrasings match"""
+    query = re.sub(r"\s+", " ", query.strip().lower())
+    return query.rstrip(" ?!.")
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one execution
+
+    The first caller for a key (the leader) runs the function; callers that
+    arrive while it is still running wait for and share its result instead of
+    making their own call. Works across threads and across event loops, since
+    Flask runs each request's coroutine on its own loop.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, Future] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Run fn once per in-flight key
+
+        Args:
+            key: Identity of the call (e.g. normalized query plus data version)
+            fn: Blocking callable to run if no identical call is in flight; it
+                runs on the loop's default executor so other coroutines on the
+                same loop (e.g. the rest of a batch) keep going meanwhile
+
+        Returns:
+            (result, shared) where shared is True if another caller's result was reused
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            return await asyncio.wrap_future(future), True
+
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(None, fn)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            # Later callers start a fresh call rather than reusing a finished one
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._calls)
+            }
@@ -6,11 +6,13 @@ import os
 # Add parent directory to path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-def chat_with_database(query):
+def chat_with_database(query, session_id=None):
     url = "http://localhost:5000/api/chat"
     payload = {
         "query": query
     }
+    if session_id:
+        payload["session_id"] = session_id
     headers = {
         "Content-Type": "application/json"
     }
@@ -18,8 +20,32 @@ def chat_with_database(query):
     response = requests.post(url, json=payload, headers=headers)
     return response.json()
 
-def print_example_questions():
-    """Print some example questions for inventory trend analysis"""
+def chat_batch(queries, local_answers=True):
+    """Answer many queries in one request; the data is loaded once for all of them"""
+    url = "http://localhost:5000/api/chat/batch"
+    response = requests.post(url, json={"queries": queries, "local_answers": local_answers})
+    return response.json()
+
+def run_batch(path):
+    """Answer every non-empty line of a file (or the example questions for '-') and print the results"""
+    if path == '-':
+        simple_examples, trend_examples = example_questions()
+        queries = simple_examples + trend_examples
+    else:
+        with open(path) as f:
+            queries = [line.strip() for line in f if line.strip()]
+    
+    result = chat_batch(queries)
+    if result.get("status") != "success":
+        print("\nError:", result.get("error") or "Unknown error occurred")
+        return
+    for i, (query, answer) in enumerate(zip(queries, result["results"]), 1):
+        source = " (answered locally)" if answer.get("answered_locally") else ""
+        print(f"\n{i}. {query}{source}")
+        print(answer.get("response") if answer.get("status") == "success" else f"Error: {answer.get('response')}")
+
+def example_questions():
+    """Example questions without and with trend analysis"""
     simple_examples = [
         "How many Dove Shampoo bottles do we have in stock?",
         "What's the price of Tata Tea Premium?",
@@ -38,6 +64,11 @@ def print_example_questions():
         "Is Maggi Noodles selling well compared to other products?",
         "Based on current sales, what's my projected inventory in 2 weeks?"
     ]
+    return simple_examples, trend_examples
+
+def print_example_questions():
+    """Print some example questions for inventory trend analysis"""
+    simple_examples, trend_examples = example_questions()
     
     print("\nSimple inventory questions (without trend analysis):")
     for i, example in enumerate(simple_examples, 1):
@@ -52,8 +83,15 @@ def print_example_questions():
     print()
 
 if __name__ == "__main__":
+    # python test_chat.py --batch questions.txt (or --batch - for the examples)
+    if len(sys.argv) == 3 and sys.argv[1] == '--batch':
+        run_batch(sys.argv[2])
+        sys.exit(0)
+    
     print_example_questions()
     
+    # Keep one conversation going so follow-up questions have context
+    session_id = None
     while True:
         user_query = input("\nAsk about your inventory (type 'exit' to quit, 'examples' to see sample questions): ")
         if user_query.lower() == 'exit':
@@ -63,7 +101,8 @@ if __name__ == "__main__":
             continue
             
         print("\nProcessing your query...")
-        result = chat_with_database(user_query)
+        result = chat_with_database(user_query, session_id)
+        session_id = result.get("session_id") or session_id
         
         if result.get("status") == "success":
             print("\nResponse:")
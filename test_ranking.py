@@ -0,0 +1,31 @@
+from ranking import Ranking
+
+
+def make_ranking():
+    ranking = Ranking()
+    for key, score in (('a', 3.0), ('b', 1.0), ('c', 2.0)):
+        ranking.set(key, score)
+    return ranking
+
+
+def test_top_and_bottom_order():
+    ranking = make_ranking()
+    assert ranking.top(2) == [('a', 3.0), ('c', 2.0)]
+    assert ranking.bottom(2) == [('b', 1.0), ('c', 2.0)]
+
+
+def test_k_larger_than_ranking_returns_everything():
+    ranking = make_ranking()
+    everything = [('a', 3.0), ('c', 2.0), ('b', 1.0)]
+    for k in (3, 4, 5, 6, 10):
+        assert ranking.top(k) == everything
+        assert ranking.bottom(k) == everything[::-1]
+    assert ranking.top(0) == [] and ranking.bottom(0) == []
+
+
+def test_set_moves_and_removes_keys():
+    ranking = make_ranking()
+    ranking.set('b', 5.0)
+    ranking.set('a', None)
+    assert ranking.top(10) == [('b', 5.0), ('c', 2.0)]
+    assert len(ranking) == 2
@@ -0,0 +1,471 @@
+import threading
+import time
+import logging
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, List, Any, Iterable, Optional, Sequence, Tuple
+
+import numpy as np
+
+from forecasting import day_number, to_timestamp
+from metrics_exporter import FIRESTORE_READS, VELOCITY_INDEX_DRIFT
+from ranking import Ranking
+
+logger = logging.getLogger("VelocityIndex")
+
+DAY_US = 86_400_000_000
+RANK_METRICS = ('units', 'days_to_sell')
+
+
+def _velocity_ts(value) -> Optional[int]:
+    # Same rule as calculate_sales_velocity: only datetime-like values count
+    # towards days-to-sell. Integer microseconds keep the running sums exact,
+    # so removing a sale restores the previous state bit for bit.
+    if hasattr(value, 'timestamp'):
+        return round(value.timestamp() * 1_000_000)
+    return None
+
+
+def _same_days(a: Dict[int, float], b: Dict[int, float], tolerance: float) -> bool:
+    return all(abs(a.get(day, 0) - b.get(day, 0)) <= tolerance for day in set(a) | set(b))
+
+
+@dataclass
+class _Totals:
+    sale_count: int = 0
+    total_sold: float = 0
+    dated_count: int = 0
+    ts_sum_us: int = 0
+
+
+class VelocityIndex:
+    """
+    Per-product sales velocity kept up to date sale by sale
+
+    For each product it holds the number of sales, units sold, and the count
+    and sum of sale timestamps, plus units per calendar day. Mean days from
+    entry to sale is (mean sale time - entry time), so a new sale is O(1),
+    and a changed entry_date costs nothing at all: it is only used when the
+    velocity is read. Each sale's contribution is remembered so edits and
+    deletions can be undone exactly.
+
+    Fed by Firestore listeners on products and sales (start()); the first
+    snapshot of each loads everything, later ones apply the changes. A
+    background thread periodically recomputes velocity from a full read and
+    compares; any drift is logged, exported and repaired by a rebuild.
+
+    Every known product is also ranked by units sold and mean days to sell,
+    all time and over each of rank_windows trailing days, so top-K and
+    bottom-K reads (rank()) cost O(K) instead of a pass over the catalogue.
+    A change re-ranks only the products it touched; window rankings are
+    rebuilt once when the day rolls over.
+    """
+    def __init__(self, rank_windows: Sequence[int] = (7, 30)):
+        self._lock = threading.Lock()
+        self._products: Dict[str, Dict[str, Any]] = {}
+        self._product_keys: Dict[str, str] = {}  # document id -> barcode id
+        self._totals: Dict[str, _Totals] = defaultdict(_Totals)
+        self._daily: Dict[str, Dict[int, float]] = defaultdict(lambda: defaultdict(float))
+        # product -> day -> [dated sales, sum of their timestamps in microseconds]
+        self._daily_dated: Dict[str, Dict[int, List[int]]] = defaultdict(lambda: defaultdict(lambda: [0, 0]))
+        # sale id -> (product_id, quantity, timestamp in microseconds, calendar day)
+        self._sales: Dict[str, Tuple[str, float, Optional[int], Optional[int]]] = {}
+        self.rank_windows = tuple(rank_windows)
+        self._rankings = {(metric, window): Ranking()
+                          for metric in RANK_METRICS for window in (None, *self.rank_windows)}
+        self._rank_day = day_number(time.time())
+        self._touched = set()  # products to re-rank after the current change
+        self._loaded = set()
+        self._listeners = []
+        self._stop = threading.Event()
+        self._verifier: Optional[threading.Thread] = None
+        self._replay: Optional[List[Tuple[str, str, Optional[Dict[str, Any]]]]] = None  # changes during a verify read
+        self.updates = 0
+        self.last_verified: Optional[float] = None
+        self.last_drift: Optional[int] = None
+
+    @property
+    def ready(self) -> bool:
+        """Whether both collections have been loaded"""
+        return self._loaded >= {'products', 'sales'}
+
+    # Updates -----------------------------------------------------------
+
+    def upsert_product(self, doc_id: str, data: Dict[str, Any]):
+        with self._lock:
+            self._record('products', doc_id, data)
+            self._upsert_product(doc_id, data)
+            self._rerank_touched()
+
+    def _upsert_product(self, doc_id: str, data: Dict[str, Any]):
+        key = data.get('barcode_id')
+        previous = self._product_keys.pop(doc_id, None)
+        if previous is not None:
+            self._products.pop(previous, None)
+            self._touched.add(previous)
+        if key is None:
+            return
+        self._product_keys[doc_id] = key
+        self._products[key] = {**data, 'id': doc_id}
+        self._touched.add(key)
+        self.updates += 1
+
+    def remove_product(self, doc_id: str):
+        with self._lock:
+            self._record('products', doc_id, None)
+            self._remove_product(doc_id)
+            self._rerank_touched()
+
+    def _remove_product(self, doc_id: str):
+        key = self._product_keys.pop(doc_id, None)
+        if key is not None:
+            self._products.pop(key, None)
+            self._touched.add(key)
+            self.updates += 1
+
+    def upsert_sale(self, sale_id: str, data: Dict[str, Any]):
+        with self._lock:
+            self._record('sales', sale_id, data)
+            self._remove_sale(sale_id)
+            self._add_sale(sale_id, data)
+            self._rerank_touched()
+
+    def remove_sale(self, sale_id: str):
+        with self._lock:
+            self._record('sales', sale_id, None)
+            self._remove_sale(sale_id)
+            self._rerank_touched()
+
+    def _record(self, collection: str, doc_id: str, data: Optional[Dict[str, Any]]):
+        if self._replay is not None:
+            self._replay.append((collection, doc_id, data))
+
+    def _add_sale(self, sale_id: str, data: Dict[str, Any]):
+        product_id = data.get('product_id')
+        if product_id is None:
+            return
+        quantity = data.get('quantity_sold', 0)
+        ts_us = _velocity_ts(data.get('selling_date'))
+        ts = to_timestamp(data.get('selling_date'))
+        day = day_number(ts) if ts is not None else None
+
+        totals = self._totals[product_id]
+        totals.sale_count += 1
+        totals.total_sold += quantity
+        if ts_us is not None:
+            totals.dated_count += 1
+            totals.ts_sum_us += ts_us
+        if day is not None:
+            self._daily[product_id][day] += quantity or 0
+            if ts_us is not None:
+                dated = self._daily_dated[product_id][day]
+                dated[0] += 1
+                dated[1] += ts_us
+        self._sales[sale_id] = (product_id, quantity, ts_us, day)
+        self._touched.add(product_id)
+        self.updates += 1
+
+    def _remove_sale(self, sale_id: str):
+        entry = self._sales.pop(sale_id, None)
+        if entry is None:
+            return
+        product_id, quantity, ts_us, day = entry
+        totals = self._totals[product_id]
+        totals.sale_count -= 1
+        totals.total_sold -= quantity
+        if ts_us is not None:
+            totals.dated_count -= 1
+            totals.ts_sum_us -= ts_us
+        if totals.sale_count == 0:
+            del self._totals[product_id]
+        if day is not None:
+            days = self._daily[product_id]
+            days[day] -= quantity or 0
+            if days[day] == 0:
+                del days[day]
+            if not days:
+                del self._daily[product_id]
+            if ts_us is not None:
+                dated_days = self._daily_dated[product_id]
+                dated = dated_days[day]
+                dated[0] -= 1
+                dated[1] -= ts_us
+                if dated[0] == 0:
+                    del dated_days[day]
+                if not dated_days:
+                    del self._daily_dated[product_id]
+        self._touched.add(product_id)
+        self.updates += 1
+
+    def rebuild(self, products: Iterable[Dict[str, Any]], sales: Iterable[Dict[str, Any]]):
+        """Replace all state from full collections (documents with an 'id')"""
+        with self._lock:
+            self._products.clear()
+            self._product_keys.clear()
+            self._totals.clear()
+            self._daily.clear()
+            self._daily_dated.clear()
+            self._sales.clear()
+            for product in products:
+                self._upsert_product(product['id'], product)
+            for sale in sales:
+                self._add_sale(sale['id'], sale)
+            self._rerank_all()
+            self._loaded = {'products', 'sales'}
+
+    def apply_changes(self, collection: str, changes):
+        """Apply Firestore DocumentChanges of the products or sales collection"""
+        with self._lock:
+            for change in changes:
+                doc_id = change.document.id
+                data = None if change.type.name == 'REMOVED' else change.document.to_dict() or {}
+                self._record(collection, doc_id, data)
+                if collection == 'products':
+                    if data is None:
+                        self._remove_product(doc_id)
+                    else:
+                        self._upsert_product(doc_id, data)
+                else:
+                    self._remove_sale(doc_id)
+                    if data is not None:
+                        self._add_sale(doc_id, data)
+            self._rerank_touched()
+            self._loaded.add(collection)
+
+    # Reads -------------------------------------------------------------
+
+    def products(self) -> List[Dict[str, Any]]:
+        """Current product documents"""
+        with self._lock:
+            return [dict(p) for p in self._products.values()]
+
+    def velocity_data(self, products: Optional[List[Dict]] = None) -> Dict[str, Any]:
+        """
+        Same result as InventoryChatService.calculate_sales_velocity over
+        all sales, for the given products (default: all known products)
+        """
+        with self._lock:
+            products = list(self._products.values()) if products is None else products
+            velocity_data = {}
+            for product in products:
+                product_id = product.get('barcode_id')
+                totals = self._totals.get(product_id)
+                if totals is None or 'entry_date' not in product or not totals.total_sold > 0:
+                    continue
+                entry_us = _velocity_ts(product['entry_date'])
+                avg_days_to_sell = None
+                if totals.dated_count and entry_us is not None:
+                    # mean(sale - entry) = mean(sale) - entry
+                    avg_days_to_sell = (totals.ts_sum_us / totals.dated_count - entry_us) / DAY_US
+                velocity_data[product_id] = {
+                    'name': product.get('name', 'Unknown Product'),
+                    'total_sold': totals.total_sold,
+                    'avg_days_to_sell': avg_days_to_sell,
+                    'current_stock': product.get('quantity', 0),
+                    'price': product.get('price', 0),
+                    'entry_date': product.get('entry_date')
+                }
+            return velocity_data
+
+    def demand(self, product_ids: Sequence[str], history_days: int = 56, now: Optional[float] = None) -> np.ndarray:
+        """(products, history_days) units per calendar day, like forecasting.demand_matrix over all sales"""
+        today = day_number(time.time() if now is None else now)
+        matrix = np.zeros((len(product_ids), history_days))
+        with self._lock:
+            for row, product_id in enumerate(product_ids):
+                for day, units in self._daily.get(product_id, {}).items():
+                    age = today - day
+                    if 0 <= age < history_days:
+                        matrix[row, history_days - 1 - age] = units
+        return matrix
+
+    # Rankings ----------------------------------------------------------
+
+    def _scores(self, product_id: str, window: Optional[int]) -> Tuple[float, Optional[float]]:
+        """(units sold, mean days from entry to sale) over a trailing window, or all time"""
+        if window is None:
+            totals = self._totals.get(product_id)
+            units = totals.total_sold if totals else 0
+            dated, ts_sum = (totals.dated_count, totals.ts_sum_us) if totals else (0, 0)
+        else:
+            days = self._daily.get(product_id, {})
+            dated_days = self._daily_dated.get(product_id, {})
+            units = dated = ts_sum = 0
+            for day in range(self._rank_day - window + 1, self._rank_day + 1):
+                units += days.get(day, 0)
+                if day in dated_days:
+                    dated += dated_days[day][0]
+                    ts_sum += dated_days[day][1]
+        entry_us = _velocity_ts(self._products[product_id].get('entry_date'))
+        days_to_sell = (ts_sum / dated - entry_us) / DAY_US if dated and entry_us is not None else None
+        return units, days_to_sell
+
+    def _rerank(self, product_id: str):
+        if product_id not in self._products:
+            for ranking in self._rankings.values():
+                ranking.discard(product_id)
+            return
+        for window in (None, *self.rank_windows):
+            units, days_to_sell = self._scores(product_id, window)
+            self._rankings['units', window].set(product_id, units)
+            self._rankings['days_to_sell', window].set(product_id, days_to_sell)
+
+    def _rerank_touched(self):
+        for product_id in self._touched:
+            self._rerank(product_id)
+        self._touched.clear()
+
+    def _rerank_all(self):
+        self._touched.clear()
+        for ranking in self._rankings.values():
+            ranking.clear()
+        for product_id in self._products:
+            self._rerank(product_id)
+
+    def rank(self, k: int = 10, metric: str = 'units', window_days: Optional[int] = 7,
+             ascending: bool = False, now: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        The k products with the highest (or, with ascending, lowest) score
+
+        Args:
+            metric: 'units' (units sold) or 'days_to_sell' (mean days from
+                entry to sale; products without dated sales are not ranked)
+            window_days: Trailing days counted, one of rank_windows, or None
+                for all time
+        """
+        ranking = self._rankings.get((metric, window_days))
+        if ranking is None:
+            raise ValueError(f"Unknown ranking {metric!r} over {window_days} days; metrics are {RANK_METRICS} "
+                             f"and windows {self.rank_windows} or all time")
+        with self._lock:
+            today = day_number(time.time() if now is None else now)
+            if today != self._rank_day:
+                self._rank_day = today
+                self._rerank_all()
+            entries = ranking.bottom(k) if ascending else ranking.top(k)
+            ranked = []
+            for position, (product_id, _) in enumerate(entries, start=1):
+                product = self._products[product_id]
+                units, days_to_sell = self._scores(product_id, window_days)
+                ranked.append({
+                    'rank': position,
+                    'product_id': product_id,
+                    'name': product.get('name', 'Unknown Product'),
+                    'units_sold': units,
+                    'days_to_sell': days_to_sell,
+                    'current_stock': product.get('quantity', 0)
+                })
+            return ranked
+
+    # Drift check -------------------------------------------------------
+
+    def begin_verify(self):
+        """Start recording live changes, to be replayed by verify() onto its recompute"""
+        with self._lock:
+            self._replay = []
+
+    def verify(self, products: List[Dict], sales: List[Dict], tolerance: float = 1e-9) -> Dict[str, Any]:
+        """
+        Compare the maintained state with a recompute from full collections
+
+        Products whose sale count, units sold, sale timestamps or daily units
+        differ are counted as drifted; if any are, the recomputed state
+        replaces the maintained one. Changes recorded since begin_verify()
+        was called are replayed onto the recompute first, so updates that
+        land while the collections are being read are not reported as drift
+        (replaying one the read already saw is harmless: every change is an
+        upsert or removal by document id).
+        """
+        fresh = VelocityIndex(rank_windows=())
+        fresh.rebuild(products, sales)
+
+        with self._lock:
+            replay, self._replay = self._replay or [], None
+            for collection, doc_id, data in replay:
+                if collection == 'products':
+                    if data is None:
+                        fresh._remove_product(doc_id)
+                    else:
+                        fresh._upsert_product(doc_id, data)
+                else:
+                    fresh._remove_sale(doc_id)
+                    if data is not None:
+                        fresh._add_sale(doc_id, data)
+            theirs = {k: (t.sale_count, t.total_sold, t.dated_count, t.ts_sum_us) for k, t in fresh._totals.items()}
+            drifted = []
+            for product_id in set(self._totals) | set(theirs):
+                totals = self._totals.get(product_id)
+                a = (totals.sale_count, totals.total_sold, totals.dated_count, totals.ts_sum_us) if totals else None
+                b = theirs.get(product_id)
+                if a is None or b is None or a[0] != b[0] or a[2:] != b[2:] or abs(a[1] - b[1]) > tolerance:
+                    drifted.append(product_id)
+                elif not _same_days(self._daily.get(product_id, {}), fresh._daily.get(product_id, {}), tolerance):
+                    drifted.append(product_id)
+                elif self._daily_dated.get(product_id, {}) != fresh._daily_dated.get(product_id, {}):
+                    drifted.append(product_id)
+            if drifted:
+                self._products, self._product_keys = fresh._products, fresh._product_keys
+                self._totals, self._daily, self._sales = fresh._totals, fresh._daily, fresh._sales
+                self._daily_dated = fresh._daily_dated
+                self._rerank_all()
+            self.last_verified = time.time()
+            self.last_drift = len(drifted)
+
+        VELOCITY_INDEX_DRIFT.set(len(drifted))
+        if drifted:
+            logger.warning(f"Velocity index drifted for {len(drifted)} products (e.g. {drifted[:5]}); rebuilt")
+        return {"status": "success", "products": len(theirs), "drifted": len(drifted), "sample": drifted[:10]}
+
+    # Firestore wiring ----------------------------------------------------
+
+    def start(self, db, verify_interval: float = 3600.0):
+        """Subscribe to products and sales and verify against a full read every verify_interval seconds"""
+        self._stop.clear()
+        self._listeners = [
+            db.collection(name).on_snapshot(
+                lambda docs, changes, read_time, name=name: self.apply_changes(name, changes))
+            for name in ('products', 'sales')
+        ]
+        if verify_interval:
+            self._verifier = threading.Thread(target=self._verify_loop, args=(db, verify_interval),
+                                              name="velocity-verify", daemon=True)
+            self._verifier.start()
+        logger.info("Velocity index listening to products and sales")
+
+    def stop(self):
+        self._stop.set()
+        for watch in self._listeners:
+            try:
+                watch.unsubscribe()
+            except Exception as e:
+                logger.error(f"Error unsubscribing listener: {str(e)}")
+        self._listeners = []
+        self._loaded.clear()
+
+    def _verify_loop(self, db, interval: float):
+        while not self._stop.wait(interval):
+            if not self.ready:
+                continue
+            try:
+                self.begin_verify()
+                data = {}
+                for name in ('products', 'sales'):
+                    data[name] = [{**doc.to_dict(), 'id': doc.id} for doc in db.collection(name).stream()]
+                    FIRESTORE_READS.inc(len(data[name]), collection=name)
+                self.verify(data['products'], data['sales'])
+            except Exception as e:
+                with self._lock:
+                    self._replay = None
+                logger.error(f"Velocity index verification failed: {str(e)}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "ready": self.ready,
+                "products": len(self._products),
+                "sales": len(self._sales),
+                "updates": self.updates,
+                "rank_windows": self.rank_windows,
+                "last_verified": self.last_verified,
+                "last_drift": self.last_drift
+            }
@@ -3,10 +3,8 @@ from typing import Dict, Any, Optional
 import tempfile
 import io
 import base64
-import torch
-import soundfile as sf
-import numpy as np
-from transformers import pipeline
+
+from metrics_exporter import WHISPER_INFERENCE
 
 class VoiceProcessingService:
     def __init__(self, chat_service):
@@ -29,6 +27,10 @@ class VoiceProcessingService:
     def _load_whisper_model(self):
         """Load the Whisper model on first use to save memory"""
         if self.whisper_model is None:
+            # torch/transformers are imported here so that importing this
+            # module (e.g. in chat workers that hand audio to voice workers)
+            # stays cheap
+            from transformers import pipeline
             print("Loading Whisper model...")
             self.whisper_model = pipeline("automatic-speech-recognition", model="openai/whisper-small")
             print("Whisper model loaded")
@@ -44,32 +46,62 @@ class VoiceProcessingService:
             Dict containing the response and audio response
         """
         try:
-            # Save audio data to a temporary file
-            with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_audio:
-                temp_audio.write(audio_data)
-                temp_audio_path = temp_audio.name
+            text_query = await self.transcribe(audio_data)
+            return await self.answer(text_query)
+        except Exception as e:
+            return {
+                "status": "error",
+                "error": f"Error processing voice query: {str(e)}"
+            }
+
+    async def transcribe(self, audio_data: bytes) -> str:
+        """
+        Convert raw audio bytes to text; this is the part voice workers run
+        
+        Args:
+            audio_data: Raw audio bytes
             
+        Returns:
+            Transcribed text ("" if nothing was understood)
+        """
+        # Save audio data to a temporary file
+        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_audio:
+            temp_audio.write(audio_data)
+            temp_audio_path = temp_audio.name
+        
+        try:
             # Convert speech to text
-            text_query = await self.speech_to_text(temp_audio_path)
-            
-            if not text_query:
-                return {
-                    "status": "error",
-                    "error": "Could not understand audio. Please try again."
-                }
+            return await self.speech_to_text(temp_audio_path)
+        finally:
+            # Clean up temporary file
+            try:
+                os.unlink(temp_audio_path)
+            except:
+                pass  # Ignore cleanup errors
+
+    async def answer(self, text_query: str) -> Dict[str, Any]:
+        """
+        Answer a transcribed voice query with the chat service
+        
+        Args:
+            text_query: Transcribed query text
             
+        Returns:
+            Dict containing the response
+        """
+        if not text_query:
+            return {
+                "status": "error",
+                "error": "Could not understand audio. Please try again."
+            }
+        
+        try:
             # Process the query directly using the chat service
             response = await self.chat_service.process_query(text_query)
             
             # Get response text
             response_text = response.get("response", "")
             
-            # Clean up temporary file
-            try:
-                os.unlink(temp_audio_path)
-            except:
-                pass  # Ignore cleanup errors
-            
             return {
                 "status": "success",
                 "text_query": text_query,
@@ -98,7 +130,8 @@ class VoiceProcessingService:
         
         try:
             # Perform speech recognition
-            result = self.whisper_model(audio_file_path)
+            with WHISPER_INFERENCE.time():
+                result = self.whisper_model(audio_file_path)
             text = result["text"].strip()  # Get the transcribed text
             
             return text
@@ -0,0 +1,107 @@
+import asyncio
+import signal
+import threading
+import time
+import logging
+from typing import Any, Callable, Dict, Optional
+
+from job_queue import JobQueue
+from metrics_exporter import start_http_server
+
+logger = logging.getLogger("Workers")
+
+# Job kinds handled by each worker profile
+VOICE_JOB = 'voice'
+SCAN_JOB = 'scan'
+
+
+def voice_handler() -> Callable[[bytes, Dict[str, Any]], Any]:
+    """
+    Transcribe audio with Whisper
+
+    Voice workers only run speech-to-text; the chat worker that submitted
+    the job answers the transcribed question itself, so voice workers need
+    neither Firebase nor an LLM client.
+    """
+    from voice_service import VoiceProcessingService
+
+    voice_service = VoiceProcessingService(chat_service=None)
+    voice_service._load_whisper_model()  # Pay the model load before taking jobs
+
+    def handle(payload: bytes, params: Dict[str, Any]) -> Any:
+        return {"text_query": asyncio.run(voice_service.transcribe(payload))}
+    return handle
+
+
+def scan_handler() -> Callable[[bytes, Dict[str, Any]], Any]:
+    """Decode barcodes from images"""
+    from barcode_service import decode_barcode
+
+    def handle(payload: bytes, params: Dict[str, Any]) -> Any:
+        return decode_barcode(payload)
+    return handle
+
+
+HANDLERS = {
+    VOICE_JOB: voice_handler,
+    SCAN_JOB: scan_handler,
+}
+
+
+def run_worker(kind: str, queue: JobQueue, handler: Callable[[bytes, Dict[str, Any]], Any],
+               stop_event: Optional[threading.Event] = None, poll_interval: float = 0.1,
+               purge_interval: float = 600.0):
+    """
+    Take jobs of one kind off the queue until stop_event is set
+
+    Each worker process runs one job at a time; scale a tier by starting
+    more processes.
+    """
+    stop_event = stop_event or threading.Event()
+    last_purge = time.monotonic()
+    logger.info(f"Worker {queue.worker_id} taking '{kind}' jobs from {queue.db_path}")
+    while not stop_event.is_set():
+        job = queue.claim([kind])
+        if job is None:
+            if time.monotonic() - last_purge > purge_interval:
+                queue.purge()
+                last_purge = time.monotonic()
+            stop_event.wait(poll_interval)
+            continue
+
+        job_id, _, payload, params = job
+        started = time.perf_counter()
+        try:
+            queue.complete(job_id, handler(payload, params))
+            logger.info(f"Job {job_id} done in {time.perf_counter() - started:.2f}s")
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {str(e)}")
+            queue.fail(job_id, str(e))
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Voice transcription / barcode scan worker")
+    parser.add_argument('profile', choices=sorted(HANDLERS), help="Kind of jobs to run")
+    parser.add_argument('--queue-db', default=None, help="SQLite job queue shared with the API (default: JOB_QUEUE_DB)")
+    parser.add_argument('--worker-id', default=None)
+    parser.add_argument('--metrics-port', type=int, default=None, help="Serve OpenMetrics on this port")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if args.metrics_port:
+        start_http_server(args.metrics_port)
+
+    queue = JobQueue(args.queue_db, worker_id=args.worker_id)
+    handler = HANDLERS[args.profile]()
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+    try:
+        run_worker(args.profile, queue, handler, stop_event)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()